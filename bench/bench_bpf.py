@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+## Feature : receive cost with / without the socket BPF filter (ether.bpf_program), no network interface needed
+##           the program is attached to an AF_UNIX datagram socket : the kernel runs it on each datagram (= frame)
+##           then compare frames reaching python with / without the filter (JSON result)
+##           accepted / rejected frames are checked by bench/check_bpf.py
+## usage : sudo is not needed, python3 bench/bench_bpf.py [--frames 20000] [--own 50] [--output result.json]
+
+import argparse, json, os, platform, struct, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from lib.ethernet import *
+from check_bpf import OWN_MAC, frame, pair, received
+
+def python_filter(data) -> bool:
+    '''the same checks in python (what the receive loop does without the filter)'''
+    if len(data) < ETHER.ETH_HLEN + ETHER.RAW_MIN_PAYLOAD:
+        return False
+    dst, src, proto = struct.unpack_from('!6s6sH', data)
+    return proto == ETHER.ETH_REQ_HUBINFO and src != OWN_MAC
+
+def throughput(program, frames, own_percent) -> dict:
+    '''frames sent in bursts of 32, own frames = own_percent %, sec of the receiver side'''
+    burst = [frame(src=OWN_MAC) if i * 100 < own_percent * 32 else frame() for i in range(32)]
+    rx, tx = pair(program)
+    wakeups, delivered, accepted, rx_sec = 0, 0, 0, 0.0
+    try:
+        for _ in range(frames // len(burst)):
+            for data in burst:
+                tx.send(data)
+            start = time.perf_counter()
+            got = received(rx)
+            accepted += sum(1 for data in got if python_filter(data))
+            rx_sec += time.perf_counter() - start
+            delivered += len(got)
+            wakeups += 1
+    finally:
+        rx.close()
+        tx.close()
+    dic = dict()
+    dic['filter'] = program is not None
+    dic['sent'] = wakeups * len(burst)
+    dic['delivered_to_python'] = delivered
+    dic['accepted'] = accepted
+    dic['rx_us_per_sent_frame'] = round(rx_sec / (wakeups * len(burst)) * 1e6, 3)
+    return dic
+
+def main():
+    parser = argparse.ArgumentParser(description='BPF receive filter benchmark')
+    parser.add_argument('--frames', type=int, default=20000, help='frames of the throughput case')
+    parser.add_argument('--own', type=int, default=50, help='%% of own frames (looped back) in the throughput case')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    program = ether.bpf_program(ETHER.ETH_REQ_HUBINFO, OWN_MAC)
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'instructions': len(program) // struct.calcsize('HBBI'),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['throughput'] = [throughput(None, args.frames, args.own), throughput(program, args.frames, args.own)]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
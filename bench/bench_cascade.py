@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+## Feature : N virtual hubs of task_network in a daisy chain over the simulated link (lib.simlink), in one or more processes
+##           ID assignment convergence (TCP setServerId -> every hub stored its client number),
+##           age of hub data at the server (TCP getHubInfo), frames per hop (JSON result)
+## usage : python3 bench/bench_cascade.py [--hubs 8,64,256] [--processes 1] [--duration 10] [--period 1]
+##                                        [--wire json|binary] [--aggregate] [--reliable] [--loss 0]
+##                                        [--neighbor-ttl 0] [--output result.json]
+
+import argparse, importlib.util, json, multiprocessing, os, platform, shutil, socket, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(ROOT)
+import lib.database as database
+from lib.database import *
+from lib.ethernet import *
+from lib.protocol import *
+from lib.sharedstate import *
+from lib.simlink import *
+
+SERVER_ID = 0x5000
+STAMP = 100000      # power of a virtual hub = time.time() % STAMP when published (fits WIRE.HUBINFO)
+
+def percentile(samples, p):
+    data = sorted(samples)
+    return data[min(len(data) - 1, int(len(data) * p / 100))] if data else None
+
+def summary_ms(samples) -> dict:
+    dic = dict()
+    dic['samples'] = len(samples)
+    for name, p in (('p50_ms', 50), ('p99_ms', 99), ('max_ms', 100)):
+        value = percentile(samples, p)
+        dic[name] = round(value * 1000, 2) if value is not None else None
+    return dic
+
+def notify_address(chain, index) -> str:
+    return f'{SIM_PARAMETER.PREFIX}.{chain}.{index}.notify'
+
+def load_hub(chain, index, hubs, workdir, loss):
+    '''
+    one more copy of src/task_network.py (own module globals : Ether, tcpData, db_writer, ...)
+    db_file_path of the copy is the file of the hub, Ether is the simulated link of the hub
+    '''
+    filename = os.path.join(workdir, f'hub-{index}.db')
+    SqlSchema.migrate(filename)
+    SqlLib(filename=filename, table=SQL_PARAMETER.DATA_TABLE).sql_upsert_rows([(0, 0, 0.0, 0, 0)])
+    spec = importlib.util.spec_from_file_location(f'task_network_{index}', os.path.join(ROOT, 'src', 'task_network.py'))
+    module = importlib.util.module_from_spec(spec)
+    default = database.db_file_path
+    database.db_file_path = filename    # taken by 'from lib.database import *' of the copy
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        database.db_file_path = default
+    module.Ether = etherSim(chain, index, hubs, loss=loss)
+    module.frame_reliable = etherReliable(module.Ether)
+    module.shared_state = sharedState(path=os.path.join(workdir, f'hub-{index}.state'), create=True)
+    module.Ether.get_operate_mode()
+    return module
+
+def worker(chain, indexes, hubs, workdir, loss, period, neighbor_ttl, conn):
+    '''virtual hubs of indexes, commands of the coordinator on conn : snapshot / stop'''
+    sys.stdout = open(os.devnull, 'w')  # print() of task_network
+    if neighbor_ttl:
+        ETHER.NEIGHBOR_TTL = neighbor_ttl
+        ETHER.NEIGHBOR_HELLO = neighbor_ttl / 3
+    modules = dict()
+    latency = []    # (client number, sec) at the server : publish -> handle_event_server
+    published = [0]
+    for index in indexes:
+        modules[index] = load_hub(chain, index, hubs, workdir, loss)
+    port = None
+    for index, module in modules.items():
+        if module.reliable_send:
+            module.frame_reliable.start()
+        if index == 0:
+            put = module.db_writer.put
+            def traced(serverId, clientId, power, signal, powerStatus, put=put):
+                if power:   # 0 : DB row of a hub not published yet
+                    latency.append((clientId - serverId, (time.time() - power) % STAMP))
+                put(serverId, clientId, power, signal, powerStatus)
+            module.db_writer.put = traced
+            module.db_writer.start()
+            server = module.ThreadedHubTCPServer((SIM_PARAMETER.HOST_IP, 0), module.HubTCPHandler)
+            port = server.server_address[1]
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            threading.Thread(target=module.getClientDataPort,
+                             args=([module.Ether.port_out], [ETHER.ETH_REQ_HUBINFO, ETHER.ETH_ACK]), daemon=True).start()
+            def keepalive(module=module):
+                '''neighbor keepalive of the runServer loop'''
+                while True:
+                    module.sendNeighborHello()
+                    time.sleep(ETHER.MODE_POLL)
+            threading.Thread(target=keepalive, daemon=True).start()
+        else:
+            threading.Thread(target=module.setClientDataPort, args=(notify_address(chain, index),), daemon=True).start()
+            threading.Thread(target=module.getClientDataPort,
+                             args=([ETHER.PORT_WAN, ETHER.PORT_LAN],
+                                   [ETHER.ETH_REQ_ID, ETHER.ETH_REQ_HUBINFO, ETHER.ETH_SET_POWER_SAVE, ETHER.ETH_ACK]),
+                             daemon=True).start()
+
+    def monitoring():
+        '''task_monitoring of every client hub : hub data published with the time in power, then notified'''
+        clients = [(module, stateNotifier(address=notify_address(chain, index))) for index, module in modules.items() if index]
+        while clients:
+            for module, notifier in clients:
+                tcpData = module.tcpData
+                if tcpData.h_client_number > 0:
+                    module.shared_state.publish(SHARED_PARAMETER.LOCAL, tcpData.h_server_id,
+                                                tcpData.h_server_id + tcpData.h_client_number,
+                                                round(time.time() % STAMP, 4), TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)
+                    notifier.notify()
+                    published[0] += 1
+                time.sleep(period / len(clients))
+    threading.Thread(target=monitoring, daemon=True).start()
+
+    def counters() -> dict:
+        dic = dict()
+        dic['sent'] = {index: {f'{key[0]}:{key[1]}': count for key, count in module.Ether.sent.items()}
+                       for index, module in modules.items()}
+        dic['lost'] = sum(module.Ether.lost for module in modules.values())
+        dic['filtered'] = sum(module.Ether.filtered for module in modules.values())
+        dic['overrun'] = sum(module.Ether.overrun for module in modules.values())
+        dic['retransmits'] = sum(module.frame_reliable.retransmits for module in modules.values())
+        # hub data frames by destination : unicast to the upstream neighbor, broadcast if not known (expired)
+        for kind in ('unicast', 'broadcast'):
+            dic[f'hubinfo_{kind}'] = sum(module.Ether.destinations.get((ETHER.ETH_REQ_HUBINFO, kind), 0)
+                                         for module in modules.values())
+        dic['published'] = published[0]
+        return dic
+
+    conn.send(('ready', port))
+    while True:
+        command = conn.recv()
+        if command == 'snapshot':
+            conn.send(counters())
+        elif command == 'stop':
+            dic = counters()
+            dic['latency'] = list(latency)
+            conn.send(dic)
+            break
+
+def command(name) -> dict:
+    '''host request of the PC (see tcpFormat.getJsonTcp)'''
+    data = dict()
+    data[TCP_OBJECT.HEADER_COMPANY_ID] = TCP_OBJECT.COMPANY_ID
+    data[TCP_OBJECT.HEADER_PRODUCT_INFO] = TCP_OBJECT.PRODUCT_INFO
+    data[TCP_OBJECT.HEADER_SERVER_ID] = SERVER_ID
+    data[TCP_OBJECT.HEADER_CLIENT_NUMBER] = 0
+    for cmd in (TCP_OBJECT.RESPONSE_CMD_ID, TCP_OBJECT.RESPONSE_CMD_SAVE, TCP_OBJECT.RESPONSE_CMD_INFO):
+        data[cmd] = 1 if cmd == name else 0
+    return data
+
+def request(port, data: dict, timeout=30.0) -> dict:
+    '''one TCP request to the server hub, the response is complete when it decodes as JSON'''
+    decoder = json.JSONDecoder()
+    with socket.create_connection((SIM_PARAMETER.HOST_IP, port), timeout=timeout) as s:
+        s.sendall(json.dumps(data).encode('utf-8'))
+        buf = b''
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+            try:
+                return decoder.raw_decode(buf.decode('utf-8'))[0]
+            except ValueError:
+                continue
+    return None
+
+def sent_on(counters, index, interface, etherTypes) -> int:
+    sent = counters['sent'].get(index, {})
+    return sum(sent.get(f'{interface}:{etherType}', 0) for etherType in etherTypes)
+
+def merge(reports) -> dict:
+    keys = ('lost', 'filtered', 'overrun', 'retransmits', 'hubinfo_unicast', 'hubinfo_broadcast', 'published')
+    dic = {'sent': dict(), 'latency': []}
+    dic.update({key: 0 for key in keys})
+    for report in reports:
+        dic['sent'].update(report['sent'])
+        for key in keys:
+            dic[key] += report[key]
+        dic['latency'] += report.get('latency', [])
+    return dic
+
+def hop_frames(before, after, hubs, etherTypes) -> list:
+    '''frames of each hop (hub k - 1 <-> hub k, k = 1 .. hubs - 1), both directions'''
+    frames = []
+    for k in range(1, hubs):
+        count = sent_on(after, k, ETHER.PORT_WAN, etherTypes) + sent_on(after, k - 1, ETHER.PORT_LAN, etherTypes)
+        count -= sent_on(before, k, ETHER.PORT_WAN, etherTypes) + sent_on(before, k - 1, ETHER.PORT_LAN, etherTypes)
+        frames.append(count)
+    return frames
+
+def run_chain(hubs, args) -> dict:
+    chain = f'{os.getpid()}-{hubs}'
+    workdir = tempfile.mkdtemp(prefix='hub-cascade-')
+    ctx = multiprocessing.get_context('spawn')
+    count = max(1, min(args.processes, hubs))
+    slices = [list(range(hubs))[i::count] for i in range(count)]
+    slices = [sorted(part) for part in slices]
+    conns, processes = [], []
+    result = {'hubs': hubs, 'processes': count}
+    try:
+        for part in slices:
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=worker, args=(chain, part, hubs, workdir, args.loss, args.period,
+                                                                  args.neighbor_ttl, child), daemon=True)
+            process.start()
+            conns.append(parent)
+            processes.append(process)
+        port = None
+        for conn in conns:
+            if not conn.poll(args.timeout):
+                raise RuntimeError('virtual hubs not started')
+            _, value = conn.recv()
+            port = value if value is not None else port
+
+        # ID assignment : setServerId to the server, every client stored its client number (hubCmdTable)
+        start = time.perf_counter()
+        request(port, command(TCP_OBJECT.RESPONSE_CMD_ID))
+        pending = set(range(1, hubs))
+        deadline = start + args.timeout
+        while pending and time.perf_counter() < deadline:
+            for index in list(pending):
+                row = SqlLib(filename=os.path.join(workdir, f'hub-{index}.db'), table=SQL_PARAMETER.CMD_TABLE).sql_fetch_first()
+                if row is not None and row[SQL_PARAMETER.COL_CNB] == index:
+                    pending.discard(index)
+            time.sleep(0.005)
+        result['id_converged'] = not pending
+        result['id_assigned'] = hubs - 1 - len(pending)
+        result['id_convergence_ms'] = round((time.perf_counter() - start) * 1000, 1) if not pending else None
+        for conn in conns:
+            conn.send('snapshot')
+        before = merge([conn.recv() for conn in conns])
+        result['id_frames_per_hop'] = round(sum(hop_frames({'sent': {}}, before, hubs,
+                                                           (ETHER.ETH_REQ_ID, ETHER.ETH_ACK))) / max(1, hubs - 1), 2)
+
+        # hub data : getHubInfo every sample sec, age = now - publish time of each client row
+        ages, fresh, full_at = [], [], None
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            response = request(port, command(TCP_OBJECT.RESPONSE_CMD_INFO))
+            now = time.time()
+            clients = response.get(TCP_OBJECT.DATA_CLIENT_INFO) if response else None
+            rows = [row for row in clients if row.get('power')] if isinstance(clients, list) else []
+            sample = [(now - row['power']) % STAMP for row in rows]
+            ages += sample
+            fresh.append(sum(1 for age in sample if age < args.period * 2) / max(1, hubs - 1))
+            if full_at is None and len(rows) == hubs - 1:
+                full_at = time.perf_counter() - start
+            time.sleep(args.sample)
+        for conn in conns:
+            conn.send('stop')
+        after = merge([conn.recv() for conn in conns])
+        elapsed = time.perf_counter() - start
+
+        result['data_full_ms'] = round(full_at * 1000, 1) if full_at is not None else None
+        result['data_age'] = summary_ms(ages)
+        result['data_fresh_ratio'] = round(sum(fresh) / len(fresh), 3) if fresh else 0.0
+        result['delivery'] = summary_ms([sec for _, sec in after['latency']])
+        result['delivery_last_hub'] = summary_ms([sec for number, sec in after['latency'] if number == hubs - 1])
+        frames = hop_frames(before, after, hubs, (ETHER.ETH_REQ_HUBINFO, ETHER.ETH_ACK))
+        updates = after['published'] - before['published']
+        result['updates'] = updates
+        result['frames_per_hop_per_sec'] = round(sum(frames) / max(1, len(frames)) / elapsed, 1)
+        result['frames_server_hop_per_sec'] = round(frames[0] / elapsed, 1) if frames else 0.0
+        result['frames_per_update'] = round(sum(frames) / updates, 2) if updates else None
+        for key in ('hubinfo_unicast', 'hubinfo_broadcast'):
+            result[key] = after[key] - before[key]
+        frames_hubinfo = result['hubinfo_unicast'] + result['hubinfo_broadcast']
+        result['hubinfo_unicast_ratio'] = round(result['hubinfo_unicast'] / frames_hubinfo, 3) if frames_hubinfo else None
+        for key in ('lost', 'filtered', 'overrun', 'retransmits'):
+            result[key] = after[key]
+    finally:
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        SqlConnection.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='cascade simulator of task_network')
+    parser.add_argument('--hubs', type=str, default='8,64,256', help='chain lengths (comma separated, server included)')
+    parser.add_argument('--processes', type=int, default=1, help='processes per chain (hubs split round robin)')
+    parser.add_argument('--duration', type=float, default=10.0, help='sec, hub data phase per chain')
+    parser.add_argument('--period', type=float, default=1.0, help='sec, hub data update period of every client')
+    parser.add_argument('--sample', type=float, default=0.5, help='sec, getHubInfo period of the PC')
+    parser.add_argument('--timeout', type=float, default=60.0, help='sec, limit of the ID assignment')
+    parser.add_argument('--loss', type=float, default=0.0, help='frame loss probability of every hop')
+    parser.add_argument('--wire', type=str, default='', help='HUB_WIRE of the hubs (json / binary)')
+    parser.add_argument('--aggregate', action='store_true', help='HUB_AGGREGATE=1 of the hubs')
+    parser.add_argument('--reliable', action='store_true', help='HUB_RELIABLE=1 of the hubs')
+    parser.add_argument('--neighbor-ttl', type=float, default=0.0,
+                        help='sec, ETHER.NEIGHBOR_TTL of the hubs (0 : default), run longer than it to check unicast')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    # read by the hubs at import (spawned processes)
+    if args.wire:
+        os.environ['HUB_WIRE'] = args.wire
+    if args.aggregate:
+        os.environ['HUB_AGGREGATE'] = '1'
+    if args.reliable:
+        os.environ['HUB_RELIABLE'] = '1'
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'wire': os.environ.get('HUB_WIRE', WIRE.JSON),
+        'aggregate': os.environ.get('HUB_AGGREGATE', '0') == '1',
+        'reliable': os.environ.get('HUB_RELIABLE', '0') == '1',
+        'loss': args.loss,
+        'period': args.period,
+        'duration': args.duration,
+        'neighbor_ttl': args.neighbor_ttl or ETHER.NEIGHBOR_TTL,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = [run_chain(int(hubs), args) for hubs in args.hubs.split(',') if hubs]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+## Feature : per-request latency of SqlLib, new connection per request vs thread-local connection
+## usage : python3 bench/bench_connection.py [--clients 64] [--rounds 20]
+
+import argparse, json, os, shutil, sqlite3, sys, tempfile, threading, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+import lib.database as database
+from lib.database import *
+
+TCP_MIN_ID = 0x5000     # lib.protocol TCP_OBJECT.MIN_ID
+
+def percentile(samples, p):
+    data = sorted(samples)
+    return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+def create_db(filename):
+    con = sqlite3.connect(filename)
+    con.execute(f'create table {SQL_PARAMETER.DATA_TABLE} '
+                f'(serverId INTEGER, clientId INTEGER, power REAL, signal INTEGER, powerStatus INTEGER)')
+    con.execute(f'insert into {SQL_PARAMETER.DATA_TABLE} values (?, ?, ?, ?, ?)', (0x5000, 0, 1.5, 1, 0))
+    con.commit()
+    con.close()
+
+def request_legacy(filename, clientId, leaked):
+    '''baseline : SqlLib before the connection manager (new connect, never closed)'''
+    con = sqlite3.connect(filename)
+    con.row_factory = sqlite3.Row
+    leaked.append(con)
+    rows = con.execute(f'select * from {SQL_PARAMETER.DATA_TABLE}').fetchall()
+    con.commit()
+    if any(row[SQL_PARAMETER.COL_CID] == clientId for row in rows):
+        con.execute(f'update {SQL_PARAMETER.DATA_TABLE} set power = ?, signal = ?, powerStatus = ? where clientId = ?',
+                    (1.6, 1, 0, clientId))
+    else:
+        con.execute(f'insert into {SQL_PARAMETER.DATA_TABLE} values (?, ?, ?, ?, ?)', (0x5000, clientId, 1.6, 1, 0))
+    con.commit()
+
+def request_pooled(filename, clientId, leaked):
+    '''SqlLib with thread-local persistent connection'''
+    db = SqlLib(filename=filename, table=SQL_PARAMETER.DATA_TABLE)
+    rows = db.sql_get_all()
+    if any(row[SQL_PARAMETER.COL_CID] == clientId for row in rows):
+        db.sql_update_multi_column(clientId, 1.6, 1, 0)
+    else:
+        db.sql_insert((0x5000, clientId, 1.6, 1, 0))
+
+def monitoring_writer(filename, stop, errors):
+    '''task_monitoring 동작 모사 : clientId 0 row 갱신'''
+    con = sqlite3.connect(filename, timeout=0.1)
+    while not stop.is_set():
+        try:
+            con.execute(f'update {SQL_PARAMETER.DATA_TABLE} set power = ? where clientId = 0', (time.time() % 10,))
+            con.commit()
+        except sqlite3.OperationalError:
+            errors.append(1)
+        time.sleep(0.001)
+    con.close()
+
+def run(name, request, clients, rounds, workdir):
+    filename = os.path.join(workdir, f'{name}.db')
+    create_db(filename)
+    database.db_file_path = filename    # sql_insert writes to db_file_path only
+    if request is request_pooled:
+        # journal mode 은 파일에 기록되므로 최초 연결에서 WAL 로 전환
+        SqlConnection.get(filename)
+    stop = threading.Event()
+    errors = []
+    writer = threading.Thread(target=monitoring_writer, args=(filename, stop, errors), daemon=True)
+    writer.start()
+    leaked = []
+    samples = []
+    for _ in range(rounds):
+        for clientId in range(1, clients + 1):
+            start = time.perf_counter()
+            try:
+                request(filename, TCP_MIN_ID + clientId, leaked)
+            except sqlite3.OperationalError:
+                errors.append(1)
+            samples.append(time.perf_counter() - start)
+    stop.set()
+    writer.join()
+    SqlConnection.close_all()
+    # both modes must end with the same table (server row + one row per client)
+    con = sqlite3.connect(filename)
+    rows = con.execute(f'select count(*) from {SQL_PARAMETER.DATA_TABLE}').fetchone()[0]
+    con.close()
+    return {
+        'mode': name,
+        'requests': len(samples),
+        'p50_us': round(percentile(samples, 50) * 1e6, 1),
+        'p99_us': round(percentile(samples, 99) * 1e6, 1),
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 1),
+        'open_connections': len(leaked) if leaked else 1,
+        'lock_errors': len(errors),
+        'rows': rows,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='SqlLib connection benchmark')
+    parser.add_argument('--clients', type=int, default=64, help='simulated clients in the chain')
+    parser.add_argument('--rounds', type=int, default=20, help='frames per client')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hub-bench-')
+    try:
+        results = [run('legacy', request_legacy, args.clients, args.rounds, workdir),
+                   run('pooled', request_pooled, args.clients, args.rounds, workdir)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
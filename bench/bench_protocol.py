@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+## Feature : hub-info / command payload encode-decode benchmark, JSON against binary wire format (JSON result)
+## usage : python3 bench/bench_protocol.py [--records 1,16,149] [--iterations 20000] [--output result.json]
+
+import argparse, json, os, platform, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from lib.protocol import *
+
+ETH_DATA_LEN = 1500     # lib.ethernet ETHER.ETH_DATA_LEN
+SERVER_ID = 0x5000
+
+def record(i) -> dict:
+    return {'serverId': SERVER_ID, 'clientId': TCP_OBJECT.MIN_ID + i, 'power': 12.3456 + i,
+            'signal': TCP_OBJECT.MASTER_MAIN, 'powerStatus': TCP_OBJECT.POWER_NORMAL}
+
+def command() -> dict:
+    dic = dict()
+    dic[TCP_OBJECT.HEADER_COMPANY_ID] = TCP_OBJECT.COMPANY_ID
+    dic[TCP_OBJECT.HEADER_PRODUCT_INFO] = TCP_OBJECT.PRODUCT_INFO
+    dic[TCP_OBJECT.HEADER_SERVER_ID] = SERVER_ID
+    dic[TCP_OBJECT.HEADER_CLIENT_NUMBER] = 3
+    dic[TCP_OBJECT.RESPONSE_CMD_ID] = 1
+    dic[TCP_OBJECT.RESPONSE_CMD_SAVE] = 0
+    dic[TCP_OBJECT.RESPONSE_CMD_INFO] = 0
+    return dic
+
+def timeit(fn, iterations) -> float:
+    '''sec per call'''
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+def result(op, format, records, payload, sec) -> dict:
+    dic = dict()
+    dic['op'] = op
+    dic['format'] = format
+    dic['records'] = records
+    dic['payload_bytes'] = len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+    dic['us_per_op'] = round(sec * 1e6, 3)
+    dic['ops_per_sec'] = round(1 / sec, 1) if sec > 0 else 0.0
+    return dic
+
+def max_records(format) -> int:
+    '''records in one ETH_DATA_LEN frame'''
+    count = 1
+    while count < WIRE.MAX_RECORDS and \
+            len(encode_hubinfo([record(i) for i in range(count + 1)], format)) <= ETH_DATA_LEN:
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='wire format benchmark')
+    parser.add_argument('--records', type=str, default=f'1,16,{WIRE.MAX_RECORDS}', help='records per payload (comma separated)')
+    parser.add_argument('--iterations', type=int, default=20000, help='iterations per operation')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'records_per_frame': {format: max_records(format) for format in (WIRE.JSON, WIRE.BINARY)},
+    }
+    report['results'] = []
+    for count in [int(n) for n in args.records.split(',') if n]:
+        records = [record(i) for i in range(count)]
+        for format in (WIRE.JSON, WIRE.BINARY):
+            iterations = max(100, args.iterations // count)
+            payload = encode_hubinfo(records, format)
+            wire = payload.encode('utf-8') if isinstance(payload, str) else payload     # as received
+            assert len(decode_hubinfo(wire)) == count
+            sec = timeit(lambda: encode_hubinfo(records, format), iterations)
+            report['results'].append(result('encode_hubinfo', format, count, payload, sec))
+            sec = timeit(lambda: decode_hubinfo(wire), iterations)
+            report['results'].append(result('decode_hubinfo', format, count, payload, sec))
+
+    cmd = command()
+    for format in (WIRE.JSON, WIRE.BINARY):
+        payload = encode_cmd(cmd, format)
+        wire = payload.encode('utf-8') if isinstance(payload, str) else payload
+        assert decode_cmd(wire)[TCP_OBJECT.HEADER_CLIENT_NUMBER] == cmd[TCP_OBJECT.HEADER_CLIENT_NUMBER]
+        sec = timeit(lambda: encode_cmd(cmd, format), args.iterations)
+        report['results'].append(result('encode_cmd', format, 1, payload, sec))
+        sec = timeit(lambda: decode_cmd(wire), args.iterations)
+        report['results'].append(result('decode_cmd', format, 1, payload, sec))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+## Feature : ID assignment (ETH_REQ_ID) along a simulated chain with frame loss, fire-and-forget against etherReliable
+##           every hub : clientNumber + 1 and send to the next, convergence = the last hub got its ID (JSON result)
+## usage : python3 bench/bench_reliable.py [--hubs 64] [--loss 0,0.01,0.05,0.2] [--runs 5] [--output result.json]
+
+import argparse, heapq, json, os, platform, random, sys, threading, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from lib.ethernet import *
+
+Ether = ether(port_in=ETHER.PORT_WAN, port_out=ETHER.PORT_LAN, op_mode=MODE.CLIENT, local_ip='', host_ip='', broadcast_ip='')
+
+class link(object):
+    '''frames delivered after delay sec, lost with probability loss (both directions)'''
+    def __init__(self, delay, loss, seed):
+        self.delay = delay
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.frames = 0
+        self.lost = 0
+        self._queue = []
+        self._count = 0
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def deliver(self, fn, *args):
+        with self._cond:
+            self.frames += 1
+            if self.random.random() < self.loss:
+                self.lost += 1
+                return
+            self._count += 1
+            heapq.heappush(self._queue, (time.monotonic() + self.delay, self._count, fn, args))
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                if not self._running:
+                    return
+                _, _, fn, args = heapq.heappop(self._queue)
+            fn(*args)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+class hub(object):
+    def __init__(self, index, chain, reliable):
+        self.index = index
+        self.chain = chain
+        self.mac = bytes([0x02, 0, 0, 0, index >> 8, index & 0xFF])
+        self.clientNumber = 0
+        self.assigned = None
+        self.reliable = etherReliable(Ether, transport=self.transport) if reliable else None
+
+    def transport(self, target, interface, etherType, packet) -> int:
+        '''port_out : next hub, port_in : previous hub'''
+        peer = self.index + 1 if interface == ETHER.PORT_LAN else self.index - 1
+        if 0 <= peer < len(self.chain.hubs):
+            side = ETHER.PORT_WAN if interface == ETHER.PORT_LAN else ETHER.PORT_LAN
+            self.chain.link.deliver(self.chain.hubs[peer].frame, side, etherType, packet, self.mac)
+        return 0
+
+    def send_id(self):
+        packet = b'%d' % (self.clientNumber + 1)
+        if self.reliable is not None:
+            self.reliable.send(ETHER.PORT_LAN, ETHER.ETH_REQ_ID, packet)
+        else:
+            self.transport(ETHER.BROADCAST_MAC, ETHER.PORT_LAN, ETHER.ETH_REQ_ID, packet)
+
+    def frame(self, interface, etherType, payload, src):
+        if etherType == ETHER.ETH_ACK:
+            self.reliable.ack(payload)
+            return
+        if self.reliable is not None:
+            payload = self.reliable.receive(interface, etherType, payload, src)
+            if payload is None:
+                return
+        if self.assigned is None:
+            self.clientNumber = int(payload)
+            self.assigned = time.monotonic()
+            self.chain.assigned(self)
+            self.send_id()
+
+class chain(object):
+    def __init__(self, hubs, delay, loss, seed, reliable):
+        self.link = link(delay, loss, seed)
+        self.hubs = [hub(i, self, reliable) for i in range(hubs)]
+        self.done = threading.Event()
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def assigned(self, node):
+        with self._lock:
+            self.count += 1
+            if self.count == len(self.hubs) - 1:
+                self.done.set()
+
+    def run(self, timeout) -> dict:
+        '''hub 0 is the server (setServerId from the operator server)'''
+        for node in self.hubs:
+            if node.reliable is not None:
+                node.reliable.start()
+        start = time.monotonic()
+        self.hubs[0].assigned = start
+        self.hubs[0].send_id()
+        converged = self.done.wait(timeout)
+        elapsed = time.monotonic() - start
+        time.sleep(0.05)    # late ACKs
+        for node in self.hubs:
+            if node.reliable is not None:
+                node.reliable.stop()
+        self.link.stop()
+        dic = dict()
+        dic['converged'] = converged
+        dic['assigned'] = self.count
+        dic['convergence_ms'] = round(elapsed * 1000, 3) if converged else None
+        dic['frames'] = self.link.frames
+        dic['lost'] = self.link.lost
+        if self.hubs[0].reliable is not None:
+            metrics = [node.reliable.getDict() for node in self.hubs]
+            dic['retransmits'] = sum(m['retransmits'] for m in metrics)
+            dic['duplicates'] = sum(m['duplicates'] for m in metrics)
+            dic['failed'] = sum(m['failed'] for m in metrics)
+            dic['max_hop_delivery_ms'] = max(m['max_delivery_ms'] for m in metrics)
+        return dic
+
+def main():
+    parser = argparse.ArgumentParser(description='ID assignment convergence with frame loss')
+    parser.add_argument('--hubs', type=int, default=64, help='hubs of the chain (server included)')
+    parser.add_argument('--loss', type=str, default='0,0.01,0.05,0.2', help='frame loss rates (comma separated)')
+    parser.add_argument('--delay', type=float, default=0.0002, help='sec, link delay per hop')
+    parser.add_argument('--runs', type=int, default=5, help='runs per loss rate')
+    parser.add_argument('--timeout', type=float, default=60.0, help='sec, a run not converged is stopped')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'hubs': args.hubs,
+        'delay_ms': args.delay * 1000,
+        'rto_init_ms': RELIABLE.RTO_INIT * 1000,
+        'rto_min_ms': RELIABLE.RTO_MIN * 1000,
+        'retries': RELIABLE.RETRIES,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = []
+    for loss in [float(n) for n in args.loss.split(',') if n]:
+        for reliable in (False, True):
+            runs = [chain(args.hubs, args.delay, loss, seed, reliable).run(args.timeout if reliable else 1.0)
+                    for seed in range(args.runs)]
+            times = sorted(run['convergence_ms'] for run in runs if run['converged'])
+            dic = dict()
+            dic['mode'] = 'reliable' if reliable else 'fire_and_forget'
+            dic['loss'] = loss
+            dic['runs'] = len(runs)
+            dic['converged'] = len(times)
+            dic['expected_converged'] = round((1 - loss) ** (args.hubs - 1), 4) if not reliable else None
+            dic['convergence_ms_p50'] = times[len(times) // 2] if times else None
+            dic['convergence_ms_max'] = times[-1] if times else None
+            dic['assigned_min'] = min(run['assigned'] for run in runs)
+            for key in ('retransmits', 'duplicates', 'failed'):
+                if key in runs[0]:
+                    dic[key] = sum(run[key] for run in runs)
+            if 'max_hop_delivery_ms' in runs[0]:
+                dic['max_hop_delivery_ms'] = max(run['max_hop_delivery_ms'] for run in runs)
+            report['results'].append(dic)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+## Feature : raw frame receive throughput, receiveRaw / recv() socket / TPACKET_V3 ring (etherRing) (JSON result)
+##           a child process sends frames on --send-interface, received on --interface
+##           veth pair : ip link add veth0 type veth peer name veth1; ip link set veth0 up; ip link set veth1 up
+## usage : sudo python3 bench/bench_rxring.py [--interface lo] [--send-interface lo] [--frames 200000] [--output result.json]
+
+import argparse, contextlib, io, json, multiprocessing, os, platform, select, socket, struct, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from lib.ethernet import *
+
+ETHER_TYPE = ETHER.ETH_P_802_EX1    # not received by task_network
+SRC_MAC = bytes.fromhex('02a1b2c3d4e6')
+PAYLOAD = b'{"serverId": 20480, "clientId": 20481, "power": 1.5, "signal": 1, "powerStatus": 0}'
+PACKET_IGNORE_OUTGOING = 23         # linux 4.20, own frames are not looped back to the receiver (lo)
+IDLE = 0.3                          # sec without frame after the sender finished : end of case
+
+def sender(interface, frames, rate):
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    s.bind((interface, 0))
+    frame = struct.pack('!6s6sH', b'\xff' * ETHER.ETH_ALEN, SRC_MAC, ETHER_TYPE) + PAYLOAD
+    start = time.perf_counter()
+    for i in range(frames):
+        while True:
+            try:
+                s.send(frame)
+                break
+            except OSError:     # ENOBUFS : tx queue full
+                time.sleep(0.0001)
+        if rate and i % 64 == 0:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    s.close()
+
+def ignore_outgoing(s):
+    try:
+        s.setsockopt(ETHER._SOL_PACKET, PACKET_IGNORE_OUTGOING, 1)
+    except OSError:
+        pass
+
+def kernel_drops(s) -> int:
+    packets, drops = struct.unpack('II', s.getsockopt(ETHER._SOL_PACKET, ETHER._PACKET_STATISTICS, 8))
+    return drops
+
+def run(name, receive, args, sock) -> dict:
+    '''receive(deadline) -> frames, until the sender finished and IDLE sec without frame'''
+    child = multiprocessing.Process(target=sender, args=(args.send_interface, args.frames, args.rate))
+    received, cpu, first, last = 0, 0.0, None, None
+    child.start()
+    while True:
+        cpu_start = time.thread_time()
+        count = receive()
+        cpu += time.thread_time() - cpu_start
+        now = time.perf_counter()
+        if count:
+            received += count
+            first = first or now
+            last = now
+        elif not child.is_alive() and (last is None or now - last > IDLE):
+            break
+    child.join()
+    dic = dict()
+    dic['path'] = name
+    dic['sent'] = args.frames
+    dic['received'] = received
+    dic['kernel_drops'] = kernel_drops(sock)
+    dic['frames_per_sec'] = round(received / (last - first), 1) if received > 1 and last > first else 0.0
+    dic['cpu_us_per_frame'] = round(cpu / received * 1e6, 3) if received else 0.0
+    return dic
+
+def bench_receiveRaw(args) -> dict:
+    Ether = ether(port_in='', port_out='', op_mode=MODE.SERVER, local_ip='', host_ip='', broadcast_ip='')
+    s = Ether.get_rx_socket(args.interface, ETHER_TYPE)
+    ignore_outgoing(s)
+    kernel_drops(s)     # reset counters
+    def receive():
+        with contextlib.redirect_stdout(io.StringIO()):     # receiveRaw prints every frame
+            data = Ether.receiveRaw(interface=args.interface, time=0.05, etherType=ETHER_TYPE)
+        return 1 if data else 0
+    try:
+        return run('receiveRaw', receive, args, s)
+    finally:
+        Ether.close_sockets()
+
+def bench_recv(args) -> dict:
+    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETHER_TYPE))
+    s.bind((args.interface, 0))
+    ignore_outgoing(s)
+    s.settimeout(0.05)
+    def receive():
+        count = 0
+        try:
+            for _ in range(ETHER.RAW_DRAIN):
+                frame = s.recv(ETHER.ETH_FRAME_LEN)
+                dst, src, proto = struct.unpack('!6s6sH', frame[:ETHER.ETH_HLEN])
+                count += 1
+                s.settimeout(0)
+        except (socket.timeout, BlockingIOError):
+            pass
+        s.settimeout(0.05)
+        return count
+    try:
+        return run('recv', receive, args, s)
+    finally:
+        s.close()
+
+def bench_ring(args) -> dict:
+    ring = etherRing(args.interface, ETHER_TYPE)
+    ignore_outgoing(ring._sock)
+    ring.statistics()
+    poller = select.poll()
+    poller.register(ring.fileno(), select.POLLIN)
+    def batch(frames):
+        for frame in frames:
+            dst, src, proto = struct.unpack_from('!6s6sH', frame)
+    def receive():
+        poller.poll(50)
+        return ring.drain(batch)
+    try:
+        result = run('ring', receive, args, ring._sock)
+        result['kernel_drops'] += ring.drops
+        result['blocks'] = ring.blocks
+        return result
+    finally:
+        ring.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='raw receive path benchmark (root)')
+    parser.add_argument('--interface', type=str, default='lo', help='receive interface')
+    parser.add_argument('--send-interface', type=str, default='', help='send interface (receive interface if empty)')
+    parser.add_argument('--frames', type=int, default=200000, help='frames per case')
+    parser.add_argument('--rate', type=int, default=0, help='frames/sec of the sender (0 : as fast as possible)')
+    parser.add_argument('--paths', type=str, default='receiveRaw,recv,ring', help='cases (comma separated)')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+    args.send_interface = args.send_interface or args.interface
+
+    cases = {'receiveRaw': bench_receiveRaw, 'recv': bench_recv, 'ring': bench_ring}
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'interface': args.interface,
+        'send_interface': args.send_interface,
+        'ring_bytes': ETHER.RING_BLOCK_SIZE * ETHER.RING_BLOCK_NR,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = [cases[path](args) for path in args.paths.split(',') if path in cases]
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+## Feature : raw frame transmit cost, sendRaw per frame / send_batch (send loop) / send_batch (sendmmsg) (JSON result)
+## usage : sudo python3 bench/bench_sendbatch.py [--interface lo] [--batches 1,8,32] [--frames 20000] [--output result.json]
+
+import argparse, json, os, platform, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+import lib.ethernet as ethernet
+from lib.ethernet import *
+
+ETHER_TYPE = ETHER.ETH_P_802_EX1    # not received by task_network
+SIZES = {'hubinfo': 87, 'aggregated': 1494}     # JSON record / binary frame of 149 records
+
+def timeit(fn, frames, batch) -> float:
+    '''sec per frame'''
+    start = time.perf_counter()
+    for _ in range(frames // batch):
+        fn()
+    return (time.perf_counter() - start) / ((frames // batch) * batch)
+
+def main():
+    parser = argparse.ArgumentParser(description='raw transmit benchmark (root)')
+    parser.add_argument('--interface', type=str, default='lo', help='send interface')
+    parser.add_argument('--batches', type=str, default='1,8,32', help='frames per call (comma separated)')
+    parser.add_argument('--frames', type=int, default=20000, help='frames per case')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    Ether = ether(port_in='', port_out='', op_mode=MODE.CLIENT, local_ip='', host_ip='', broadcast_ip='')
+    kw = dict(target=ETHER.BROADCAST_MAC, interface=args.interface, etherType=ETHER_TYPE)
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'interface': args.interface,
+        'sendmmsg': ethernet._sendmmsg is not None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = []
+    report['sendmmsg_faster'] = []
+    sendmmsg = ETHER.RAW_SENDMMSG, ETHER.RAW_SENDMMSG_MIN
+    try:
+        for name, size in SIZES.items():
+            payload = b'\xb1' + bytes(size - 1)
+            for batch in [int(n) for n in args.batches.split(',') if n]:
+                packets = [payload] * batch
+                def loop():
+                    for packet in packets:
+                        Ether.sendRaw(packet=packet, **kw)
+                cases = [('sendRaw', loop, False), ('send_batch', lambda: Ether.send_batch(packets=packets, **kw), False)]
+                if ethernet._sendmmsg is not None:
+                    cases.append(('send_batch_sendmmsg', lambda: Ether.send_batch(packets=packets, **kw), True))
+                us = dict()
+                for path, fn, mmsg in cases:
+                    ETHER.RAW_SENDMMSG, ETHER.RAW_SENDMMSG_MIN = mmsg, 1
+                    sec = timeit(fn, args.frames, batch)
+                    us[path] = sec * 1e6
+                    report['results'].append({'path': path, 'payload': name, 'payload_bytes': size, 'batch': batch,
+                                              'us_per_frame': round(sec * 1e6, 3),
+                                              'frames_per_sec': round(1 / sec, 1)})
+                if 'send_batch_sendmmsg' in us:
+                    # batches where ETHER.RAW_SENDMMSG / RAW_SENDMMSG_MIN pays off on this machine
+                    report['sendmmsg_faster'].append({'payload': name, 'batch': batch,
+                                                      'faster': us['send_batch_sendmmsg'] < us['send_batch']})
+    finally:
+        ETHER.RAW_SENDMMSG, ETHER.RAW_SENDMMSG_MIN = sendmmsg
+        Ether.close_sockets()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
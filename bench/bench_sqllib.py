@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+## Feature : SqlLib micro-benchmark across table sizes (p50/p99 latency, ops/s as JSON)
+## usage : python3 bench/bench_sqllib.py [--sizes 1,16,256,4095] [--iterations 200] [--output result.json]
+
+import argparse, json, os, platform, random, shutil, sqlite3, sys, tempfile, threading, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+import lib.database as database
+from lib.database import *
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None   # pandas read_sql path is skipped (optional, bench/requirements.txt)
+
+MIN_ID = 0x5000     # lib.protocol TCP_OBJECT.MIN_ID
+SERVER_ID = 0x5000
+
+def percentile(samples, p):
+    data = sorted(samples)
+    return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+def summary(samples, **kwargs) -> dict:
+    dic = dict(kwargs)
+    dic['iterations'] = len(samples)
+    dic['p50_us'] = round(percentile(samples, 50) * 1e6, 2)
+    dic['p99_us'] = round(percentile(samples, 99) * 1e6, 2)
+    dic['ops_per_sec'] = round(len(samples) / sum(samples), 1) if sum(samples) > 0 else 0.0
+    return dic
+
+def measure(fn, iterations, before=None) -> list:
+    samples = []
+    for i in range(iterations):
+        if before is not None:
+            before(i)
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def prepare(filename, clients):
+    '''hubDataTable with the server row (clientId 0) and clients - 1 client rows'''
+    SqlSchema.migrate(filename)
+    db = SqlLib(filename=filename, table=SQL_PARAMETER.DATA_TABLE)
+    rows = [(SERVER_ID, 0, 1.5, 1, 0)]
+    rows += [(SERVER_ID, MIN_ID + i, 1.5, 1, 0) for i in range(1, clients)]
+    db.sql_upsert_rows(rows)
+    return db
+
+def bench_size(workdir, clients, iterations) -> list:
+    filename = os.path.join(workdir, f'size-{clients}.db')
+    database.db_file_path = filename    # sql_insert writes to db_file_path only
+    db = prepare(filename, clients)
+    ids = [0] + [MIN_ID + i for i in range(1, clients)]
+    pick = lambda i: ids[random.randrange(len(ids))]
+    results = []
+
+    # sql_insert : new client id every iteration, removed after the measurement
+    new_id = lambda i: MIN_ID + clients + i
+    samples = measure(lambda i: db.sql_insert((SERVER_ID, new_id(i), 1.6, 1, 0)), iterations)
+    db.sql_do(f'delete from {SQL_PARAMETER.DATA_TABLE} where clientId >= ?', MIN_ID + clients)
+    results.append(summary(samples, op='sql_insert', clients=clients))
+
+    samples = measure(lambda i: db.sql_update_multi_column(pick(i), 1.6, 1, 0), iterations)
+    results.append(summary(samples, op='sql_update_multi_column', clients=clients))
+
+    samples = measure(lambda i: db.sql_upsert_row(SERVER_ID, pick(i), 1.7, 1, 0), iterations)
+    results.append(summary(samples, op='sql_upsert_row', clients=clients))
+
+    samples = measure(lambda i: db.sql_fetch_client(pick(i)), iterations)
+    results.append(summary(samples, op='sql_fetch_client', clients=clients))
+
+    samples = measure(lambda i: db.sql_select_one(SQL_PARAMETER.COL_CID), iterations)
+    results.append(summary(samples, op='sql_select_one', clients=clients))
+
+    samples = measure(lambda i: db.sql_get_all(), iterations)
+    results.append(summary(samples, op='sql_get_all', clients=clients))
+
+    if pd is not None:
+        sql = f'select * from {SQL_PARAMETER.DATA_TABLE}'
+        samples = measure(lambda i: pd.read_sql(sql, db._dbcon, index_col=None).to_dict(orient='index'), iterations)
+        results.append(summary(samples, op='pandas_read_sql', clients=clients))
+
+    # write-behind : one put per client then one flush (all clients in one transaction)
+    writer = SqlWriteBehind(filename=filename, table=SQL_PARAMETER.DATA_TABLE)
+    writer._running = True  # put() only queues, flush measured below
+    def fill(i):
+        for clientId in ids:
+            writer.put(SERVER_ID, clientId, 1.8, 1, 0)
+    samples = measure(lambda i: writer.flush(), iterations, before=fill)
+    writer._running = False
+    results.append(summary(samples, op='write_behind_flush', clients=clients, rows_per_op=len(ids)))
+
+    # history : one sample per client per flush, range query of the last hour
+    history = SqlHistory(filename=filename)
+    def append(i):
+        for clientId in ids:
+            history.append(clientId, 1.8, 1, 0)
+    samples = measure(lambda i: history.flush(force=True), iterations, before=append)
+    results.append(summary(samples, op='history_flush', clients=clients, rows_per_op=len(ids)))
+    now = time.time()
+    samples = measure(lambda i: history.query(now - 3600, now + 1), iterations)
+    results.append(summary(samples, op='history_query_hour', clients=clients))
+    return results
+
+def bench_concurrent(workdir, clients, readers, writers, duration) -> list:
+    '''readers (getHubInfo : sql_get_all) and writers (chain frames : sql_upsert_row) at the same time'''
+    filename = os.path.join(workdir, f'concurrent-{clients}.db')
+    prepare(filename, clients)
+    ids = [MIN_ID + i for i in range(1, clients)] or [0]
+    stop = threading.Event()
+    samples = {'reader': [], 'writer': []}
+    lock = threading.Lock()
+
+    def worker(role):
+        db = SqlLib(filename=filename, table=SQL_PARAMETER.DATA_TABLE)
+        local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            if role == 'reader':
+                db.sql_get_all()
+            else:
+                db.sql_upsert_row(SERVER_ID, random.choice(ids), random.random(), 1, 0)
+            local.append(time.perf_counter() - start)
+        SqlConnection.close_all()
+        with lock:
+            samples[role] += local
+
+    threads = [threading.Thread(target=worker, args=('reader',)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=('writer',)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    results = []
+    for role, count in (('reader', readers), ('writer', writers)):
+        if samples[role]:
+            dic = summary(samples[role], op=f'concurrent_{role}', clients=clients, threads=count)
+            dic['ops_per_sec'] = round(len(samples[role]) / duration, 1)    # throughput of all threads
+            results.append(dic)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='SqlLib micro-benchmark')
+    parser.add_argument('--sizes', type=str, default='1,16,256,4095', help='client counts (comma separated)')
+    parser.add_argument('--iterations', type=int, default=200, help='iterations per operation')
+    parser.add_argument('--readers', type=int, default=2, help='reader threads of the concurrent case')
+    parser.add_argument('--writers', type=int, default=1, help='writer threads of the concurrent case')
+    parser.add_argument('--duration', type=float, default=2.0, help='sec, duration of the concurrent case')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    workdir = tempfile.mkdtemp(prefix='hub-bench-')
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'journal_mode': SQL_PRAGMA.JOURNAL_MODE,
+        'synchronous': SQL_PRAGMA.SYNCHRONOUS,
+        'pandas': pd.__version__ if pd is not None else None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = []
+    try:
+        for size in sizes:
+            report['results'] += bench_size(workdir, size, args.iterations)
+            report['results'] += bench_concurrent(workdir, size, args.readers, args.writers, args.duration)
+    finally:
+        SqlConnection.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
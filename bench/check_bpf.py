@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+## Feature : check the receive socket BPF filter (ether.bpf_program) on crafted frames, no network interface needed
+##           the program is attached to an AF_UNIX datagram socket : the kernel runs it on each datagram (= frame)
+##           accepted / rejected frames compared with the expected result (JSON result), exit code 1 if a check failed
+## usage : sudo is not needed, python3 bench/check_bpf.py [--output result.json]
+
+import argparse, json, os, platform, socket, struct, sys, time
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from lib.ethernet import *
+
+OWN_MAC = bytes.fromhex('02a1b2c3d4e5')
+PEER_MAC = bytes.fromhex('02a1b2c3d4e6')
+BROADCAST = b'\xff' * ETHER.ETH_ALEN
+PAYLOAD = b'{"serverId": 20480, "clientId": 20481, "power": 1.5, "signal": 1, "powerStatus": 0}'
+
+def frame(src=PEER_MAC, etherType=ETHER.ETH_REQ_HUBINFO, payload=PAYLOAD) -> bytes:
+    return struct.pack('!6s6sH', BROADCAST, src, etherType) + payload
+
+# (name, frame, accepted)
+CASES = [
+    ('peer frame', frame(), True),
+    ('own source MAC', frame(src=OWN_MAC), False),
+    ('source MAC differs in last 2 octets', frame(src=OWN_MAC[:4] + b'\x00\x00'), True),
+    ('source MAC differs in first 4 octets', frame(src=b'\x00\x00\x00\x00' + OWN_MAC[4:]), True),
+    ('other etherType', frame(etherType=ETHER.ETH_REQ_ID), False),
+    ('IPv4 etherType', frame(etherType=ETHER.ETH_P_IP), False),
+    ('empty payload', frame(payload=b''), False),
+    ('payload 1 byte', frame(payload=b'{'), False),
+    ('smallest payload', frame(payload=b'{}'), True),
+    ('header only, truncated', frame()[:ETHER.ETH_HLEN - 2], False),
+    ('binary payload', frame(payload=b'\xb1\x01\x01\x01' + bytes(10)), True),
+]
+# lo : all zero MAC, own frames are not filtered
+CASES_LO = [
+    ('all zero MAC (lo) : frame with zero source', frame(src=bytes(ETHER.ETH_ALEN)), True),
+    ('all zero MAC (lo) : other etherType', frame(etherType=ETHER.ETH_REQ_ID), False),
+]
+
+def pair(program=None):
+    rx, tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    if program is not None and not ether.attach_filter(rx, program):
+        raise OSError('SO_ATTACH_FILTER not supported')
+    rx.setblocking(False)
+    return rx, tx
+
+def received(rx) -> list:
+    frames = []
+    try:
+        while True:
+            frames.append(rx.recv(ETHER.ETH_FRAME_LEN))
+    except BlockingIOError:
+        pass
+    return frames
+
+def result(check, passed, **detail) -> dict:
+    dic = dict()
+    dic['check'] = check
+    dic['passed'] = bool(passed)
+    dic.update(detail)
+    return dic
+
+def check(program, cases) -> list:
+    results = []
+    rx, tx = pair(program)
+    try:
+        for name, data, accepted in cases:
+            tx.send(data)
+            frames = received(rx)
+            results.append(result(name, (frames == [data]) == accepted, expected=accepted, accepted=frames == [data]))
+    finally:
+        rx.close()
+        tx.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='BPF receive filter check')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    program = ether.bpf_program(ETHER.ETH_REQ_HUBINFO, OWN_MAC)
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'machine': platform.machine(),
+        'instructions': len(program) // struct.calcsize('HBBI'),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = check(program, CASES)
+    report['results'] += check(ether.bpf_program(ETHER.ETH_REQ_HUBINFO, bytes(ETHER.ETH_ALEN)), CASES_LO)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(0 if all(dic['passed'] for dic in report['results']) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+## Feature : regression checks of task_network on virtual hubs (lib.simlink), no board needed (JSON result)
+##           exit code 1 if a check failed
+## usage : python3 bench/check_chain.py [--output result.json]
+
+import argparse, asyncio, importlib.util, json, os, platform, shutil, socket, struct, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(ROOT)
+import lib.database as database
+from lib.database import *
+from lib.ethernet import *
+from lib.protocol import *
+from lib.sharedstate import *
+from lib.simlink import *
+
+SERVER_ID = 0x5000
+
+def load_hub(workdir, name, index=1, hubs=3, rows=()):
+    '''
+    one copy of src/task_network.py on the database file of name (see bench_cascade.load_hub)
+    no shared state : the hub data of this board is read from the database
+    '''
+    filename = os.path.join(workdir, f'{name}.db')
+    SqlSchema.migrate(filename)
+    SqlLib(filename=filename, table=SQL_PARAMETER.DATA_TABLE).sql_upsert_rows(list(rows) or [(0, 0, 0.0, 0, 0)])
+    spec = importlib.util.spec_from_file_location(f'task_network_{name}', os.path.join(ROOT, 'src', 'task_network.py'))
+    module = importlib.util.module_from_spec(spec)
+    default = database.db_file_path
+    database.db_file_path = filename    # taken by 'from lib.database import *' of the copy
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        database.db_file_path = default
+    module.Ether = etherSim(name, index, hubs)
+    module.frame_reliable = etherReliable(module.Ether)
+    module.shared_state = None
+    module.shared_state_retry = float('inf')
+    module.Ether.get_operate_mode()
+    return module
+
+def rows_of(module) -> list:
+    db = SqlLib(filename=module.db_file_path, table=SQL_PARAMETER.DATA_TABLE)
+    return [(row[SQL_PARAMETER.COL_SID], row[SQL_PARAMETER.COL_CID], row[SQL_PARAMETER.COL_POW],
+             row[SQL_PARAMETER.COL_SIG], row[SQL_PARAMETER.COL_PST]) for row in db.sql_get_all()]
+
+def command(name, clientNumber=0) -> dict:
+    '''host request of the PC (see tcpFormat.getJsonTcp)'''
+    data = dict()
+    data[TCP_OBJECT.HEADER_COMPANY_ID] = TCP_OBJECT.COMPANY_ID
+    data[TCP_OBJECT.HEADER_PRODUCT_INFO] = TCP_OBJECT.PRODUCT_INFO
+    data[TCP_OBJECT.HEADER_SERVER_ID] = SERVER_ID
+    data[TCP_OBJECT.HEADER_CLIENT_NUMBER] = clientNumber
+    for cmd in (TCP_OBJECT.RESPONSE_CMD_ID, TCP_OBJECT.RESPONSE_CMD_SAVE, TCP_OBJECT.RESPONSE_CMD_INFO):
+        data[cmd] = 1 if cmd == name else 0
+    return data
+
+def result(check, passed, **detail) -> dict:
+    dic = dict()
+    dic['check'] = check
+    dic['passed'] = bool(passed)
+    dic.update(detail)
+    return dic
+
+def check_id_assignment(workdir) -> list:
+    '''ETH_REQ_ID on a board that was a server : the chain rows are replaced by the row of the new client id'''
+    chain = [(SERVER_ID, 0, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)]
+    chain += [(SERVER_ID, SERVER_ID + i, 2.5, TCP_OBJECT.MASTER_SUB, TCP_OBJECT.POWER_NORMAL) for i in range(1, 4)]
+    module = load_hub(workdir, 'id-assignment', rows=chain)
+    module.Ether.port_in = ETHER.PORT_WAN
+    module.tcpData.h_client_number = 0
+    module.tcpData.client_request_to_client = encode_cmd(command(TCP_OBJECT.RESPONSE_CMD_ID, clientNumber=2))
+    rows = rows_of(module)
+    expected = [(SERVER_ID, SERVER_ID + 2, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)]
+    return [result('id_assignment_on_used_table', rows == expected, rows=rows, expected=expected)]
+
+def check_mode_switch(workdir) -> list:
+    '''resetModeAttribute : only the row of this board (clientId 0) is left, then an ID is assigned'''
+    results = []
+    local = (SERVER_ID, 0, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)
+    chain = [local] + [(SERVER_ID, SERVER_ID + i, 2.5, TCP_OBJECT.MASTER_SUB, TCP_OBJECT.POWER_NORMAL) for i in range(1, 4)]
+    module = load_hub(workdir, 'server-to-client', rows=chain)
+    module.tcpData.h_server_id = SERVER_ID
+    module.resetModeAttribute(MODE.SERVER, MODE.CLIENT)
+    rows = rows_of(module)
+    results.append(result('mode_switch_server_to_client', rows == [local], rows=rows, expected=[local]))
+    module.Ether.port_in = ETHER.PORT_WAN
+    module.tcpData.client_request_to_client = encode_cmd(command(TCP_OBJECT.RESPONSE_CMD_ID, clientNumber=3))
+    rows = rows_of(module)
+    expected = [(SERVER_ID, SERVER_ID + 3) + local[2:]]
+    results.append(result('id_assignment_after_switch', rows == expected, rows=rows, expected=expected))
+
+    module = load_hub(workdir, 'client-to-server', rows=[(SERVER_ID, SERVER_ID + 3) + local[2:]])
+    module.tcpData.h_server_id = SERVER_ID
+    module.resetModeAttribute(MODE.CLIENT, MODE.SERVER)
+    rows = rows_of(module)
+    results.append(result('mode_switch_client_to_server', rows == [local], rows=rows, expected=[local]))
+    return results
+
+def check_async_frames(workdir) -> list:
+    '''
+    serveClient (HUB_ASYNCIO=1) of hub 1 between virtual hubs 0 and 2 : ID frame from upstream and hub data
+    from downstream are handled in the executor (DB fallback of the local hub data), the hub data is relayed
+    '''
+    module = load_hub(workdir, 'async', rows=[(0, 0, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)])
+    upstream, downstream = etherSim('async', 0, 3), etherSim('async', 2, 3)
+    relayed = upstream.get_rx_socket(ETHER.PORT_LAN, ETHER.ETH_REQ_HUBINFO)
+    relayed.settimeout(0.1)
+    found = {'id': False, 'relayed': []}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        task = asyncio.ensure_future(module.serveClient(stop))
+        await asyncio.sleep(0.1)
+        upstream.sendRaw(target=ETHER.BROADCAST_MAC, interface=ETHER.PORT_LAN, etherType=ETHER.ETH_REQ_ID,
+                         packet=encode_cmd(command(TCP_OBJECT.RESPONSE_CMD_ID, clientNumber=1)))
+        deadline = time.monotonic() + 2.0
+        while module.tcpData.h_client_number != 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        found['id'] = module.tcpData.h_client_number == 1
+        record = {'serverId': SERVER_ID, 'clientId': SERVER_ID + 2, 'power': 2.5,
+                  'signal': TCP_OBJECT.MASTER_SUB, 'powerStatus': TCP_OBJECT.POWER_NORMAL}
+        downstream.sendRaw(target=ETHER.BROADCAST_MAC, interface=ETHER.PORT_WAN, etherType=ETHER.ETH_REQ_HUBINFO,
+                           packet=encode_hubinfo([record]))
+        while SERVER_ID + 2 not in found['relayed'] and time.monotonic() < deadline + 2.0:
+            try:
+                frame = await loop.run_in_executor(None, relayed.recv, ETHER.ETH_FRAME_LEN)
+            except OSError:
+                continue
+            found['relayed'] += [dic['clientId'] for dic in decode_hubinfo(frame[ETHER.ETH_HLEN:])]
+        stop.set()
+        await task
+
+    asyncio.run(run())
+    relayed.close()
+    results = [result('async_id_assignment', found['id'], rows=rows_of(module))]
+    results.append(result('async_hubinfo_relayed', SERVER_ID + 2 in found['relayed'], clients=found['relayed']))
+    return results
+
+def check_shared_state(workdir) -> list:
+    '''
+    sharedState read by task_network : a torn record (stores seen out of order on ARM64, no memory barrier)
+    is not returned, read() gives None after READ_RETRY and the caller reads the database
+    '''
+    path = os.path.join(workdir, 'hub.state')
+    writer, reader = sharedState(path=path, create=True), sharedState(path=path)
+    offset = SHARED_PARAMETER.HEADER.size
+    results = []
+    writer.publish(SHARED_PARAMETER.LOCAL, SERVER_ID, 0, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)
+    dic = reader.read()
+    results.append(result('shared_state_read', dic is not None and dic['power'] == 1.5, record=dic))
+    # new seq with the old record
+    seq = SHARED_PARAMETER.SEQ.unpack_from(writer._view, offset)[0]
+    SHARED_PARAMETER.SEQ.pack_into(writer._view, offset, seq + 2)
+    dic = reader.read()
+    results.append(result('shared_state_torn_seq', dic is None, record=dic))
+    # new power with the old crc
+    writer.publish(SHARED_PARAMETER.LOCAL, SERVER_ID, 0, 2.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)
+    struct.pack_into('<d', writer._view, offset + 16, 3.5)    # power
+    dic = reader.read()
+    results.append(result('shared_state_torn_record', dic is None, record=dic))
+    reader.close()
+    writer.close()
+    return results
+
+def exchange(port, request, timeout=5.0):
+    '''one connection to the TCP command port : (response, sec until the hub closed it), None if not closed'''
+    start = time.monotonic()
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall(request)
+        response = b''
+        try:
+            while True:
+                data = sock.recv(TCP_FRAME.RECV_SIZE)
+                if not data:
+                    return response, time.monotonic() - start
+                response += data
+        except socket.timeout:
+            return response, None
+
+def check_tcp_framing(workdir) -> list:
+    '''
+    HubTCPHandler and serveTcpClient (HUB_ASYNCIO=1) : a legacy request with a trailing newline is answered
+    and closed at once (not after TCP_FRAME.IDLE_TIMEOUT), input that is not JSON gets an error reply and is
+    closed without running the command of the previous request
+    '''
+    module = load_hub(workdir, 'tcp', rows=[(SERVER_ID, 0, 1.5, TCP_OBJECT.MASTER_MAIN, TCP_OBJECT.POWER_NORMAL)])
+    module.Ether.port_out = 'undefinded'
+    request = bytes(json.dumps(command(TCP_OBJECT.RESPONSE_CMD_INFO)), 'utf-8')
+    server = module.ThreadedHubTCPServer(('127.0.0.1', 0), module.HubTCPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports = {'thread': server.server_address[1]}
+    loop = asyncio.new_event_loop()
+    aserver = loop.run_until_complete(asyncio.start_server(module.serveTcpClient, '127.0.0.1', 0))
+    ports['asyncio'] = aserver.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    results = []
+    try:
+        for name, port in ports.items():
+            response, closed = exchange(port, request + b'\r\n')
+            dic = json.loads(response) if response else {}
+            results.append(result(f'tcp_legacy_newline_{name}', closed is not None and dic.get(TCP_OBJECT.RESPONSE_CMD) == TCP_OBJECT.RESPONSE_CMD_INFO,
+                                  closed_sec=closed, response_bytes=len(response)))
+            exchange(port, request)     # c_command of the previous request
+            response, closed = exchange(port, b'{"companyId": cudoled}\n')
+            dic = json.loads(response) if response else {}
+            results.append(result(f'tcp_invalid_json_{name}', closed is not None and TCP_OBJECT.RESPONSE_ERROR in dic
+                                  and TCP_OBJECT.RESPONSE_CMD not in dic, closed_sec=closed, response=dic))
+    finally:
+        server.shutdown()
+        server.server_close()
+        aserver.close()
+        loop.call_soon_threadsafe(loop.stop)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='task_network regression checks')
+    parser.add_argument('--output', type=str, default='', help='JSON file (stdout if empty)')
+    args = parser.parse_args()
+
+    sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout    # print() of task_network
+    workdir = tempfile.mkdtemp(prefix='hub-check-')
+    report = dict()
+    report['meta'] = {
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    report['results'] = []
+    try:
+        for check in (check_id_assignment, check_mode_switch, check_async_frames, check_shared_state, check_tcp_framing):
+            report['results'] += check(workdir)
+    finally:
+        SqlConnection.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+        sys.stdout = stdout
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(0 if all(dic['passed'] for dic in report['results']) else 1)
+
+if __name__ == '__main__':
+    main()
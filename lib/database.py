@@ -6,17 +6,29 @@
 ## Feature : manage a power or signal data of the processor board
 
 import sqlite3
+import threading
+import atexit
+import fcntl
+import os
+import time
 import syslog, sys
 # import pandas as pd
 
 # To import *
-__all__ = [ 'db_file_path', 'SQL_PARAMETER', 'SQL_EVENT', 'SqlLib' ]
+__all__ = [ 'db_file_path', 'db_persist_path', 'db_ram_path',
+            'SQL_PARAMETER', 'SQL_EVENT', 'SQL_PRAGMA', 'SQL_WRITE_BEHIND', 'SQL_HISTORY', 'SQL_RAMDISK',
+            'SqlConnection', 'SqlSchema', 'SqlLib', 'SqlWriteBehind', 'SqlHistory', 'SqlRamDisk' ]
 
-db_file_path = "/home/orangepi/wiringOP-Python/project/DB/hubData.db"
+# SD card file, working copy on tmpfs when HUB_DB_RAM=1 (SqlRamDisk)
+db_persist_path = "/home/orangepi/wiringOP-Python/project/DB/hubData.db"
+db_ram_path = "/dev/shm/hubData.db"
+db_file_path = db_ram_path if os.environ.get('HUB_DB_RAM', '0') == '1' else db_persist_path
 
 class SQL_PARAMETER(object):
     DATA_TABLE = 'hubDataTable'
     CMD_TABLE = 'hubCmdTable'
+    HISTORY_TABLE = 'hubHistoryTable'
+    ROLLUP_TABLE = 'hubRollupTable'
     COL_SID = 'serverId'
     COL_CID = 'clientId'
     COL_POW = 'power'
@@ -28,6 +40,152 @@ class SQL_PARAMETER(object):
 class SQL_EVENT(object):
     CONNECT = 60
 
+class SQL_PRAGMA(object):
+    '''connection options (task_monitoring / task_network 동시 접근)'''
+    JOURNAL_MODE = 'WAL'        # readers do not block the writer
+    SYNCHRONOUS = 'NORMAL'      # fsync on checkpoint only (safe with WAL)
+    BUSY_TIMEOUT = 5000         # msec, wait for a lock instead of failing
+
+class SQL_WRITE_BEHIND(object):
+    INTERVAL = 1.0              # sec, flush period of pending rows
+    BATCH_SIZE = 64             # flush early when pending clients reach this count
+
+class SQL_HISTORY(object):
+    RAW = 0                     # resolution : raw samples of the ring buffer
+    MINUTE = 60                 # resolution : per-minute rollup
+    HOUR = 3600                 # resolution : per-hour rollup
+    RAW_ROWS = 512              # raw samples kept per client (ring buffer size)
+    INTERVAL = 10.0             # sec, flush period of buffered samples
+    BATCH_SIZE = 2048           # flush early when buffered samples reach this count
+    MAX_PENDING = 16384         # drop the oldest samples over this count (flush failure)
+    MINUTE_RETENTION = 2 * 86400    # sec, per-minute rollup kept
+    HOUR_RETENTION = 90 * 86400     # sec, per-hour rollup kept
+    PRUNE_INTERVAL = 600        # sec, period of rollup retention check
+    MAX_QUERY_ROWS = 65536      # finest rollup under this row count is chosen (resolution None)
+
+class SQL_RAMDISK(object):
+    INTERVAL = 300              # sec, checkpoint period of the tmpfs database to the SD card
+    LOCK = '/dev/shm/hubData.lock'  # restore / checkpoint lock between task_monitoring and task_network
+    TEMP_SUFFIX = '.tmp'
+
+class SqlConnection:
+    '''
+    thread-local persistent connection manager
+    one connection per (thread, database file), opened once and reused
+    '''
+    _local = threading.local()
+
+    @classmethod
+    def get(cls, filename) -> sqlite3.Connection:
+        pool = getattr(cls._local, 'pool', None)
+        if pool is None:
+            pool = cls._local.pool = dict()
+        con = pool.get(filename)
+        if con is None:
+            con = cls.open(filename)
+            pool[filename] = con
+        return con
+
+    @staticmethod
+    def open(filename) -> sqlite3.Connection:
+        con = sqlite3.connect(filename, timeout=SQL_PRAGMA.BUSY_TIMEOUT / 1000)
+        con.row_factory = sqlite3.Row  # row 리턴 값을 튜플 또는 dic(row)를 통해 딕셔너리 형태로 선택 가능
+        con.execute(f'PRAGMA journal_mode={SQL_PRAGMA.JOURNAL_MODE}')
+        con.execute(f'PRAGMA synchronous={SQL_PRAGMA.SYNCHRONOUS}')
+        con.execute(f'PRAGMA busy_timeout={SQL_PRAGMA.BUSY_TIMEOUT}')
+        return con
+
+    @classmethod
+    def close(cls, filename):
+        '''close the connection of the current thread (reopened on next use)'''
+        pool = getattr(cls._local, 'pool', None)
+        if pool is None:
+            return
+        con = pool.pop(filename, None)
+        if con is not None:
+            con.close()
+
+    @classmethod
+    def close_all(cls):
+        '''close every connection of the current thread'''
+        pool = getattr(cls._local, 'pool', None)
+        if pool is None:
+            return
+        for filename in list(pool):
+            cls.close(filename)
+
+class SqlSchema:
+    '''
+    versioned schema of hubData.db (PRAGMA user_version)
+    MIGRATIONS[n-1] upgrades the database from version n-1 to n, append only
+    '''
+    MIGRATIONS = [
+        # v1 : tables of the legacy (pandas to_sql) layout for a fresh database
+        [
+            f'CREATE TABLE IF NOT EXISTS "{SQL_PARAMETER.DATA_TABLE}" ('
+            f'"serverId" INTEGER, "clientId" INTEGER, "power" REAL, "signal" INTEGER, "powerStatus" INTEGER)',
+            f'CREATE TABLE IF NOT EXISTS "{SQL_PARAMETER.CMD_TABLE}" ('
+            f'"serverId" INTEGER, "hostIp" TEXT, "clientNumber" INTEGER, "IN" TEXT, "OUT" TEXT)',
+        ],
+        # v2 : clientId primary key (last row wins for duplicated id) and serverId index
+        [
+            f'CREATE TABLE "{SQL_PARAMETER.DATA_TABLE}_v2" ('
+            f'"serverId" INTEGER, "clientId" INTEGER PRIMARY KEY, "power" REAL, "signal" INTEGER, "powerStatus" INTEGER)',
+            f'INSERT INTO "{SQL_PARAMETER.DATA_TABLE}_v2" '
+            f'SELECT serverId, clientId, power, signal, powerStatus FROM "{SQL_PARAMETER.DATA_TABLE}" '
+            f'WHERE rowid IN (SELECT max(rowid) FROM "{SQL_PARAMETER.DATA_TABLE}" '
+            f'WHERE clientId IS NOT NULL GROUP BY clientId)',
+            f'DROP TABLE "{SQL_PARAMETER.DATA_TABLE}"',
+            f'ALTER TABLE "{SQL_PARAMETER.DATA_TABLE}_v2" RENAME TO "{SQL_PARAMETER.DATA_TABLE}"',
+            f'CREATE INDEX IF NOT EXISTS "{SQL_PARAMETER.DATA_TABLE}_serverId" '
+            f'ON "{SQL_PARAMETER.DATA_TABLE}" ("serverId")',
+        ],
+        # v3 : history ring buffer (RAW_ROWS slots per client) and min/avg/max rollups (SqlHistory)
+        [
+            f'CREATE TABLE IF NOT EXISTS "{SQL_PARAMETER.HISTORY_TABLE}" ('
+            f'"clientId" INTEGER NOT NULL, "slot" INTEGER NOT NULL, "ts" REAL, '
+            f'"power" REAL, "signal" INTEGER, "powerStatus" INTEGER, '
+            f'PRIMARY KEY ("clientId", "slot")) WITHOUT ROWID',
+            f'CREATE INDEX IF NOT EXISTS "{SQL_PARAMETER.HISTORY_TABLE}_ts" '
+            f'ON "{SQL_PARAMETER.HISTORY_TABLE}" ("ts")',
+            f'CREATE TABLE IF NOT EXISTS "{SQL_PARAMETER.ROLLUP_TABLE}" ('
+            f'"period" INTEGER NOT NULL, "bucket" INTEGER NOT NULL, "clientId" INTEGER NOT NULL, '
+            f'"samples" INTEGER, "powerMin" REAL, "powerMax" REAL, "powerSum" REAL, '
+            f'"signalMin" INTEGER, "signalMax" INTEGER, "powerStatusMax" INTEGER, '
+            f'PRIMARY KEY ("period", "bucket", "clientId")) WITHOUT ROWID',
+        ],
+    ]
+
+    @classmethod
+    def migrate(cls, filename) -> int:
+        '''upgrade the database to the latest version, return the schema version'''
+        con = SqlConnection.open(filename)
+        con.isolation_level = None  # BEGIN / COMMIT 직접 관리
+        version = 0
+        try:
+            for target, statements in enumerate(cls.MIGRATIONS, start=1):
+                # lock first, the other task may be migrating at the same time
+                con.execute('BEGIN IMMEDIATE')
+                version = con.execute('PRAGMA user_version').fetchone()[0]
+                if version >= target:
+                    con.execute('COMMIT')
+                    continue
+                try:
+                    for sql in statements:
+                        con.execute(sql)
+                    con.execute(f'PRAGMA user_version = {target}')
+                    con.execute('COMMIT')
+                    version = target
+                    syslog.syslog(f'Event : Sql schema migrated to version [{target}], file [{filename}]')
+                except sqlite3.Error:
+                    con.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(1)} schema version [{version}] {e}')
+        finally:
+            con.close()
+        return version
+
 class SqlLib:
     def __init__(self, **kwargs):
         self.filename = kwargs.get('filename')  # 클래스 초기화 인수1 : database file
@@ -123,6 +281,80 @@ class SqlLib:
             self.close()
         return results
 
+    def sql_fetch_client(self, clientId):
+        '''return the row of clientId as dict, None if not exist'''
+        sql = f"select * from {self._table} where clientId = ?"
+        row = None
+        try:
+            cur = self._dbcon.cursor()
+            cur.execute(sql, (clientId,))
+            row = cur.fetchone()
+            cur.close()
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(1)} {e}')
+            self.close()
+        return dict(row) if row is not None else None
+
+    def sql_fetch_first(self):
+        '''return the first row of table as dict (index 0 of read_sql), None if empty'''
+        sql = f"select * from {self._table} limit 1"
+        row = None
+        try:
+            cur = self._dbcon.cursor()
+            cur.execute(sql)
+            row = cur.fetchone()
+            cur.close()
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(1)} {e}')
+            self.close()
+        return dict(row) if row is not None else None
+
+    def sql_upsert_row(self, serverId, clientId, power, signal, powerStatus):
+        '''update the row of clientId, insert if not exist (one statement, SqlSchema v2 primary key)'''
+        return self.sql_upsert_rows([(serverId, clientId, power, signal, powerStatus)])
+
+    def sql_upsert_rows(self, rows) -> bool:
+        '''upsert rows of (serverId, clientId, power, signal, powerStatus) in one transaction'''
+        sql = (f"insert into {self._table} (serverId, clientId, power, signal, powerStatus) values (?, ?, ?, ?, ?) "
+               f"on conflict(clientId) do update set "
+               f"power = excluded.power, signal = excluded.signal, powerStatus = excluded.powerStatus")
+        try:
+            cur = self._dbcon.cursor()
+            cur.executemany(sql, rows)
+            self._dbcon.commit()
+            cur.close()
+            return True
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(1)} {e}')
+            self.close()
+            return False
+
+    def sql_replace_data_row(self, serverId, clientId, power, signal, powerStatus):
+        '''replace hubDataTable with a single row (to_sql if_exists='replace' 대체)'''
+        self._sql_replace_row((SQL_PARAMETER.COL_SID, SQL_PARAMETER.COL_CID, SQL_PARAMETER.COL_POW,
+                               SQL_PARAMETER.COL_SIG, SQL_PARAMETER.COL_PST),
+                              (serverId, clientId, power, signal, powerStatus))
+
+    def sql_replace_cmd_row(self, serverId, hostIp, clientNumber, port_in, port_out):
+        '''replace hubCmdTable with a single row (to_sql if_exists='replace' 대체)'''
+        self._sql_replace_row((SQL_PARAMETER.COL_SID, SQL_PARAMETER.COL_HIP, SQL_PARAMETER.COL_CNB,
+                               'IN', 'OUT'),
+                              (serverId, hostIp, clientNumber, port_in, port_out))
+
+    def _sql_replace_row(self, columns, values):
+        # table 은 유지하고 row 만 교체 (drop / create 없음)
+        names = ', '.join(f'"{column}"' for column in columns)
+        marks = ', '.join('?' for _ in columns)
+        try:
+            cur = self._dbcon.cursor()
+            cur.execute(f"delete from {self._table}")
+            cur.execute(f"insert into {self._table} ({names}) values ({marks})", values)
+            self._dbcon.commit()
+            cur.close()
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(2)} {e}')
+            self.close()
+
     def sql_select_one(self, column, params=()):
         sql = f'SELECT {column} FROM {self._table}'
         try:
@@ -173,8 +405,13 @@ class SqlLib:
             self.close()
 
     def close(self):
-        self._dbcon.close()
-        del self._filename
+        # 스레드 공용 연결을 닫음 (다음 호출 시 다시 연결)
+        SqlConnection.close(self._filename)
+
+    # connection of the calling thread (SqlConnection 에서 관리)
+    @property
+    def _dbcon(self):
+        return SqlConnection.get(self._filename)
 
     @property
     def filename(self):
@@ -183,8 +420,6 @@ class SqlLib:
     @filename.setter
     def filename(self, fn):
         self._filename = fn
-        self._dbcon = sqlite3.connect(fn) # type: ignore
-        self._dbcon.row_factory = sqlite3.Row  # row 리턴 값을 튜플 또는 dic(row)를 통해 딕셔너리 형태로 선택 가능
         # self._cur = self._db.cursor()  # Connection 을 얻고 명령 실행을 위한 cursor 객체를 생성함
 
     @filename.deleter
@@ -204,6 +439,402 @@ class SqlLib:
     def table(self):
         self._table = 'test'
 
+class SqlWriteBehind:
+    '''
+    write-behind queue of hubDataTable rows
+    put() keeps only the latest row per clientId, a worker thread flushes the pending
+    rows in one transaction every interval (or when batch_size is reached) and on exit
+    every put() is also appended to the optional history (SqlHistory), flushed by the same worker
+    '''
+    def __init__(self, **kwargs):
+        self.db = SqlLib(filename=kwargs.get('filename'), table=kwargs.get('table', SQL_PARAMETER.DATA_TABLE))
+        self.history = kwargs.get('history')
+        self.interval = kwargs.get('interval', SQL_WRITE_BEHIND.INTERVAL)
+        self.batch_size = kwargs.get('batch_size', SQL_WRITE_BEHIND.BATCH_SIZE)
+        self._pending = dict()  # clientId : (serverId, clientId, power, signal, powerStatus)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        # metrics
+        self._puts = 0
+        self._merged = 0
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._failures = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name='SqlWriteBehind', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        '''stop the worker and flush the remaining rows'''
+        running = self._running
+        if running:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self.history is not None:
+            self.history.flush(force=True)
+        if running:
+            syslog.syslog(f'Event : Sql write-behind stopped, metrics {self.getDict()}')
+
+    def put(self, serverId, clientId, power, signal, powerStatus):
+        with self._lock:
+            if clientId in self._pending:
+                self._merged += 1
+            self._pending[clientId] = (serverId, clientId, power, signal, powerStatus)
+            self._puts += 1
+            depth = len(self._pending)
+            self._max_depth = max(self._max_depth, depth)
+        if self.history is not None:
+            self.history.append(clientId, power, signal, powerStatus)
+        if not self._running:
+            # worker 미동작 시 즉시 기록 (기존 동작과 동일)
+            self.flush()
+        elif depth >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        '''write pending rows in one transaction, return the number of rows'''
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                rows = self._pending
+                self._pending = dict()
+            start = time.perf_counter()
+            result = self.db.sql_upsert_rows(list(rows.values()))
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                if result:
+                    self._flushes += 1
+                    self._flushed_rows += len(rows)
+                    self._last_flush_ms = elapsed
+                    self._max_flush_ms = max(self._max_flush_ms, elapsed)
+                    self._total_flush_ms += elapsed
+                else:
+                    # requeue, newer rows put() during the flush have priority
+                    self._failures += 1
+                    for clientId, row in rows.items():
+                        self._pending.setdefault(clientId, row)
+            return len(rows) if result else 0
+
+    def _worker(self):
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+            if self.history is not None:
+                self.history.flush()
+        # this thread owns a connection of SqlConnection
+        SqlConnection.close_all()
+
+    def getDict(self) -> dict:
+        with self._lock:
+            dic = dict()
+            dic['queue_depth'] = len(self._pending)
+            dic['max_queue_depth'] = self._max_depth
+            dic['puts'] = self._puts
+            dic['merged'] = self._merged
+            dic['flushes'] = self._flushes
+            dic['flushed_rows'] = self._flushed_rows
+            dic['failures'] = self._failures
+            dic['last_flush_ms'] = round(self._last_flush_ms, 3)
+            dic['max_flush_ms'] = round(self._max_flush_ms, 3)
+            dic['avg_flush_ms'] = round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0.0
+            return dic
+
+class SqlHistory:
+    '''
+    bounded time-series history of hub data (SqlSchema v3)
+    raw samples go to a ring buffer of RAW_ROWS slots per client, every sample is also
+    folded into per-minute and per-hour min/avg/max rollups at write time.
+    append() only buffers, flush() writes the buffer in one transaction.
+    '''
+    _SQL_RAW = (f'insert or replace into {SQL_PARAMETER.HISTORY_TABLE} '
+                f'(clientId, slot, ts, power, signal, powerStatus) values (?, ?, ?, ?, ?, ?)')
+    _SQL_ROLLUP = (f'insert into {SQL_PARAMETER.ROLLUP_TABLE} '
+                   f'(period, bucket, clientId, samples, powerMin, powerMax, powerSum, '
+                   f'signalMin, signalMax, powerStatusMax) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                   f'on conflict(period, bucket, clientId) do update set '
+                   f'samples = samples + excluded.samples, '
+                   f'powerMin = min(powerMin, excluded.powerMin), powerMax = max(powerMax, excluded.powerMax), '
+                   f'powerSum = powerSum + excluded.powerSum, '
+                   f'signalMin = min(signalMin, excluded.signalMin), signalMax = max(signalMax, excluded.signalMax), '
+                   f'powerStatusMax = max(powerStatusMax, excluded.powerStatusMax)')
+
+    def __init__(self, **kwargs):
+        self.filename = kwargs.get('filename')
+        self.rows = kwargs.get('rows', SQL_HISTORY.RAW_ROWS)
+        self.interval = kwargs.get('interval', SQL_HISTORY.INTERVAL)
+        self.batch_size = kwargs.get('batch_size', SQL_HISTORY.BATCH_SIZE)
+        self._samples = []      # (clientId, ts, power, signal, powerStatus)
+        self._head = None       # clientId : next slot of ring buffer
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+
+    def append(self, clientId, power, signal, powerStatus, ts=None):
+        with self._lock:
+            self._samples.append((clientId, time.time() if ts is None else ts, power, signal, powerStatus))
+
+    def flush(self, force=False) -> int:
+        '''write buffered samples if the interval elapsed (or force), return the number of samples'''
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                if not self._samples:
+                    return 0
+                if not force and len(self._samples) < self.batch_size and now - self._last_flush < self.interval:
+                    return 0
+                samples = self._samples
+                self._samples = []
+            self._last_flush = now
+            con = SqlConnection.get(self.filename)
+            try:
+                if self._head is None:
+                    self._head = self._load_head(con)
+                head = dict(self._head)
+                raw = []
+                rollup = dict()     # (period, bucket, clientId) : [samples, pmin, pmax, psum, smin, smax, pstmax]
+                for clientId, ts, power, signal, powerStatus in samples:
+                    slot = head.get(clientId, 0)
+                    head[clientId] = (slot + 1) % self.rows
+                    raw.append((clientId, slot, ts, power, signal, powerStatus))
+                    for period in (SQL_HISTORY.MINUTE, SQL_HISTORY.HOUR):
+                        key = (period, int(ts // period) * period, clientId)
+                        agg = rollup.get(key)
+                        if agg is None:
+                            rollup[key] = [1, power, power, power, signal, signal, powerStatus]
+                        else:
+                            agg[0] += 1
+                            agg[1] = min(agg[1], power)
+                            agg[2] = max(agg[2], power)
+                            agg[3] += power
+                            agg[4] = min(agg[4], signal)
+                            agg[5] = max(agg[5], signal)
+                            agg[6] = max(agg[6], powerStatus)
+                cur = con.cursor()
+                cur.executemany(self._SQL_RAW, raw)
+                cur.executemany(self._SQL_ROLLUP, [key + tuple(agg) for key, agg in rollup.items()])
+                if time.time() - self._last_prune >= SQL_HISTORY.PRUNE_INTERVAL:
+                    self._prune(cur, time.time())
+                con.commit()
+                cur.close()
+                self._head = head
+                return len(samples)
+            except sqlite3.Error as e:
+                syslog.syslog(f'{sys._getframe(1)} {e}')
+                SqlConnection.close(self.filename)
+                with self._lock:
+                    # keep the samples for the next flush (oldest dropped over MAX_PENDING)
+                    self._samples = (samples + self._samples)[-SQL_HISTORY.MAX_PENDING:]
+                return 0
+
+    def query(self, start, end, clientIds=None, resolution=None) -> list:
+        '''
+        samples of [start, end) (unix time) for clientIds (None : all clients), ordered by time
+        resolution RAW : dict(clientId, ts, power, signal, powerStatus)
+        resolution MINUTE / HOUR : dict(clientId, ts, samples, powerMin, powerAvg, powerMax,
+                                        signalMin, signalMax, powerStatusMax)
+        resolution None : MINUTE if the result fits MAX_QUERY_ROWS, else HOUR
+        '''
+        if resolution is None:
+            resolution = self._resolution(start, end, clientIds)
+        params = []
+        if resolution == SQL_HISTORY.RAW:
+            sql = (f'select clientId, ts, power, signal, powerStatus from {SQL_PARAMETER.HISTORY_TABLE} '
+                   f'where ts >= ? and ts < ?')
+            params += [start, end]
+        else:
+            sql = (f'select clientId, bucket as ts, samples, powerMin, powerSum / samples as powerAvg, powerMax, '
+                   f'signalMin, signalMax, powerStatusMax from {SQL_PARAMETER.ROLLUP_TABLE} '
+                   f'where period = ? and bucket >= ? and bucket < ?')
+            params += [resolution, int(start // resolution) * resolution, end]
+        if clientIds is not None:
+            sql += f' and clientId in ({", ".join("?" for _ in clientIds)})'
+            params += list(clientIds)
+        # rollup in the order of its primary key (period, bucket, clientId), no sort
+        sql += ' order by ts' if resolution == SQL_HISTORY.RAW else ' order by bucket, clientId'
+        results = []
+        try:
+            cur = SqlConnection.get(self.filename).cursor()
+            cur.execute(sql, params)
+            results = [dict(row) for row in cur.fetchall()]
+            cur.close()
+        except sqlite3.Error as e:
+            syslog.syslog(f'{sys._getframe(1)} {e}')
+            SqlConnection.close(self.filename)
+        return results
+
+    def _resolution(self, start, end, clientIds) -> int:
+        if clientIds is not None:
+            clients = len(clientIds)
+        else:
+            clients = 0
+            try:
+                sql = (f'select count(distinct clientId) from {SQL_PARAMETER.ROLLUP_TABLE} '
+                       f'where period = ? and bucket >= ? and bucket < ?')
+                row = SqlConnection.get(self.filename).execute(
+                    sql, (SQL_HISTORY.HOUR, int(start // SQL_HISTORY.HOUR) * SQL_HISTORY.HOUR, end)).fetchone()
+                clients = row[0]
+            except sqlite3.Error as e:
+                syslog.syslog(f'{sys._getframe(1)} {e}')
+        rows = (end - start) / SQL_HISTORY.MINUTE * max(clients, 1)
+        return SQL_HISTORY.MINUTE if rows <= SQL_HISTORY.MAX_QUERY_ROWS else SQL_HISTORY.HOUR
+
+    def _load_head(self, con) -> dict:
+        # next slot = slot of the latest sample + 1 (per client)
+        head = dict()
+        sql = (f'select clientId, slot, max(ts) from {SQL_PARAMETER.HISTORY_TABLE} group by clientId')
+        for row in con.execute(sql):
+            head[row[0]] = (row[1] + 1) % self.rows
+        return head
+
+    def _prune(self, cur, now):
+        for period, retention in ((SQL_HISTORY.MINUTE, SQL_HISTORY.MINUTE_RETENTION),
+                                  (SQL_HISTORY.HOUR, SQL_HISTORY.HOUR_RETENTION)):
+            cur.execute(f'delete from {SQL_PARAMETER.ROLLUP_TABLE} where period = ? and bucket < ?',
+                        (period, now - retention))
+        self._last_prune = now
+
+class SqlRamDisk:
+    '''
+    working database on tmpfs (db_ram_path) with crash-safe checkpoint to the SD card (db_persist_path)
+    restore() : copy the checkpoint to tmpfs at boot (once, the first task wins)
+    checkpoint() : sqlite backup API to a temp file, fsync, rename over the checkpoint
+    start() / stop() : periodic checkpoint thread, last checkpoint on clean shutdown
+                       one owner (task_monitoring), the other task only calls restore()
+    '''
+    def __init__(self, **kwargs):
+        self.ram = kwargs.get('ram', db_ram_path)
+        self.persist = kwargs.get('persist', db_persist_path)
+        self.interval = kwargs.get('interval', SQL_RAMDISK.INTERVAL)
+        self.lock = kwargs.get('lock', SQL_RAMDISK.LOCK)
+        self._stop = threading.Event()
+        self._thread = None
+        self._version = None    # PRAGMA data_version of the last checkpoint
+        self._con = None        # own connection, data_version counts commits of every other connection
+
+    @staticmethod
+    def enabled() -> bool:
+        return db_file_path == db_ram_path
+
+    def restore(self) -> bool:
+        '''copy the checkpoint to tmpfs if the working database does not exist yet'''
+        with open(self.lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.ram):
+                return False    # restored by the other task (or running since boot)
+            if not os.path.exists(self.persist):
+                syslog.syslog(f'Event : Sql checkpoint not exist [{self.persist}], new database on [{self.ram}]')
+                return False
+            temp = self.ram + SQL_RAMDISK.TEMP_SUFFIX
+            try:
+                self._copy(self.persist, temp)
+                os.replace(temp, self.ram)
+                # same as the checkpoint : the first checkpoint waits for a change
+                self._version = self._data_version()
+                syslog.syslog(f'Event : Sql restored [{self.persist}] -> [{self.ram}]')
+                return True
+            except (sqlite3.Error, OSError) as e:
+                syslog.syslog(f'{sys._getframe(1)} restore {e}')
+                return False
+
+    def checkpoint(self, force=False) -> bool:
+        '''write the working database to the SD card atomically, skipped if not changed'''
+        with open(self.lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                version = self._data_version()
+                if not force and version == self._version:
+                    return False
+                temp = self.persist + SQL_RAMDISK.TEMP_SUFFIX
+                self._copy(self.ram, temp, source=self._con)
+                # the checkpoint is self-contained, an old journal must not be applied to it
+                for suffix in ('-wal', '-shm', '-journal'):
+                    if os.path.exists(self.persist + suffix):
+                        os.remove(self.persist + suffix)
+                os.replace(temp, self.persist)
+                self._fsync_dir(self.persist)
+                self._version = version
+                return True
+            except (sqlite3.Error, OSError) as e:
+                syslog.syslog(f'{sys._getframe(1)} checkpoint {e}')
+                if self._con is not None:
+                    self._con.close()
+                    self._con = None
+                return False
+
+    def _data_version(self) -> int:
+        if self._con is None:
+            self._con = sqlite3.connect(self.ram, check_same_thread=False,
+                                        timeout=SQL_PRAGMA.BUSY_TIMEOUT / 1000)
+        return self._con.execute('PRAGMA data_version').fetchone()[0]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._worker, name='SqlRamDisk', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        '''stop the periodic checkpoint and write the last one'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.checkpoint()
+
+    def _worker(self):
+        while not self._stop.wait(self.interval):
+            self.checkpoint()
+
+    def _copy(self, src, dst, source=None):
+        # sqlite backup API (consistent snapshot while the other task is writing)
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(dst + suffix):
+                os.remove(dst + suffix)
+        con = source if source is not None else sqlite3.connect(src)
+        target = sqlite3.connect(dst)
+        try:
+            con.backup(target)
+            target.execute('PRAGMA journal_mode=DELETE')    # single file without -wal
+            target.commit()
+        finally:
+            target.close()
+            if source is None:
+                con.close()
+        fd = os.open(dst, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _fsync_dir(path):
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
 # def main():
 #     #dataframe 생성
 #     table_name = 'hubDataTable'
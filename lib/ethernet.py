@@ -5,26 +5,89 @@
 ## This is a functional testing code for a processor unit of Hub board
 ## Feature : manage the network communication between daisy-chained the processor board
 
+import asyncio
 import binascii
+import ctypes
+import errno
 import fcntl
+import mmap
+import random
 import re
+import select
 import socket
 import struct
-import selectors
+import threading
+import time
 import netifaces, syslog, sys, os
 from enum import IntEnum
+from typing import Callable
 
 sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
 from lib.protocol import *
 
 # To import *
-__all__ = ['ETHER', 'MODE', 'RESULT', 'ether']
+__all__ = ['ETHER', 'MODE', 'RESULT', 'RELIABLE', 'ether', 'etherRing', 'etherDispatcher', 'etherReliable', 'etherLink', 'etherDiscovery']
 
 class ETHER(object):
     # Definitions of the socket-level I/O control calls.
     # Source: https://github.com/torvalds/linux/blob/master/include/uapi/linux/sockios.h
     _SIOCGIFHWADDR = 0x8927      # Get hardware address
 
+    # Definitions of the classic BPF socket filter.
+    # Source: https://github.com/torvalds/linux/blob/master/include/uapi/linux/filter.h
+    _SO_ATTACH_FILTER = 26
+    _BPF_LD_W_ABS = 0x20        # A = frame[k:k+4]
+    _BPF_LD_H_ABS = 0x28        # A = frame[k:k+2]
+    _BPF_LD_W_LEN = 0x80        # A = frame length
+    _BPF_JEQ_K = 0x15           # A == k
+    _BPF_JGE_K = 0x35           # A >= k
+    _BPF_RET_K = 0x06           # accept k bytes (0 : drop)
+    _BPF_INSN = struct.Struct('HBBI')   # struct sock_filter
+    _BPF_FPROG = struct.Struct('HP')    # struct sock_fprog
+
+    # Definitions of the packet socket memory-mapped ring (TPACKET_V3).
+    # Source: https://github.com/torvalds/linux/blob/master/include/uapi/linux/if_packet.h
+    _SOL_PACKET = 263
+    _PACKET_RX_RING = 5
+    _PACKET_STATISTICS = 6
+    _PACKET_VERSION = 10
+    _TPACKET_V3 = 2
+    _TP_STATUS_KERNEL = 0
+    _TP_STATUS_USER = 1
+    _TPACKET_REQ3 = struct.Struct('IIIIIII')        # struct tpacket_req3
+    _TPACKET_STATS_V3 = struct.Struct('III')        # struct tpacket_stats_v3
+    _TPACKET_BLOCK = struct.Struct('III')           # tpacket_block_desc.hdr.bh1 : block_status, num_pkts, offset_to_first_pkt
+    _TPACKET_BLOCK_STATUS = 8                       # offset of block_status in the block
+    _TPACKET3_HDR = struct.Struct('IIIIIIH')        # struct tpacket3_hdr : next_offset, sec, nsec, snaplen, len, status, mac
+    _TPACKET3_SLL_PKTTYPE = 48 + 10                 # sockaddr_ll.sll_pkttype after the aligned tpacket3_hdr
+
+    # Definitions of rtnetlink (link / IPv4 address state and change events).
+    # Source: https://github.com/torvalds/linux/blob/master/include/uapi/linux/rtnetlink.h
+    _RTMGRP_LINK = 0x1
+    _RTMGRP_IPV4_IFADDR = 0x10
+    _RTM_NEWLINK = 16
+    _RTM_DELLINK = 17
+    _RTM_GETLINK = 18
+    _RTM_NEWADDR = 20
+    _RTM_DELADDR = 21
+    _RTM_GETADDR = 22
+    _NLMSG_ERROR = 2
+    _NLMSG_DONE = 3
+    _NLM_F_REQUEST = 0x1
+    _NLM_F_DUMP = 0x300
+    _IFLA_ADDRESS = 1
+    _IFLA_IFNAME = 3
+    _IFLA_CARRIER = 33
+    _IFA_ADDRESS = 1
+    _IFA_LOCAL = 2
+    _IFA_BROADCAST = 4
+    _IFF_UP = 0x1
+    _IFF_LOWER_UP = 0x10000
+    _NLMSGHDR = struct.Struct('IHHII')              # struct nlmsghdr : len, type, flags, seq, pid
+    _IFINFOMSG = struct.Struct('BxHiII')            # struct ifinfomsg : family, type, index, flags, change
+    _IFADDRMSG = struct.Struct('BBBBi')             # struct ifaddrmsg : family, prefixlen, flags, scope, index
+    _RTATTR = struct.Struct('HH')                   # struct rtattr : len, type
+
     # Global definitions for the Ethernet IEEE 802.3 interface.
     # Source: https://github.com/torvalds/linux/blob/master/include/uapi/linux/if_ether.h
     ETH_ALEN = 6                # Octets in one ethernet addr
@@ -44,6 +107,7 @@ class ETHER(object):
     ETH_REQ_ID = 0x6000
     ETH_SET_POWER_SAVE = 0x6002
     ETH_REQ_HUBINFO = 0x6001
+    ETH_ACK = 0x6003            # per-hop acknowledge of a reliable frame (see etherReliable)
 
     # Definitions of ethernet layer
     TCP_PORT = 55555
@@ -59,6 +123,131 @@ class ETHER(object):
     TCP_TIMEOUT = 10
     RAW_TIMEOUT = 5
     RAW_SEND_DELAY = 2
+    RAW_HEARTBEAT = 10          # hub data send period without change event
+    RAW_AGGREGATE_HOLD = 0.01   # sec, wait for the other frames of a downstream cycle before sending upstream
+    RAW_AGGREGATE_STALE = 30    # sec, downstream is silent : send on the heartbeat again
+    RAW_RELAY_TTL = 1.0         # sec, a relayed frame seen again in this time is dropped (< RAW_SEND_DELAY)
+    RAW_RELAY_CACHE = 1024      # relayed frames remembered
+    NEIGHBOR_TTL = 30           # sec, a neighbor not heard for this time is forgotten (3 x RAW_HEARTBEAT)
+    NEIGHBOR_HELLO = 10         # sec, keepalive to the downstream hub (< NEIGHBOR_TTL / 2, see RELIABLE.HELLO)
+    RAW_REOPEN = 5              # sec, retry period of a socket not opened (link down, no interface)
+    RAW_DRAIN = 64              # max frames read from one socket per wake up (fairness between ports)
+    RAW_MIN_PAYLOAD = 2         # smallest payload ('{}' JSON), shorter frames are dropped by the filter
+    RAW_BPF = True              # attach the kernel filter to receive sockets
+    RAW_SENDMMSG = True         # send_batch by sendmmsg(2) (one system call per batch, see bench_sendbatch)
+    RAW_SENDMMSG_MIN = 2        # frames of a batch sent by sendmmsg(2), fewer by send()
+    RAW_SENDMMSG_MAX = 64       # frames per sendmmsg(2) call (buffer allocated once)
+    RING_BLOCK_SIZE = 1 << 15   # TPACKET_V3 block (multiple of the page size)
+    RING_BLOCK_NR = 16          # blocks of the ring (512 KiB)
+    RING_FRAME_SIZE = 2048      # frame slot (ETH_FRAME_LEN + headers)
+    RING_TIMEOUT = 4            # msec, a block not full is given to user space after this time
+    LINK_BUFFER = 1 << 16       # netlink receive buffer (one dump of every link / address)
+    LINK_SETTLE = 2.0           # sec, operating mode is checked again after link events settle (DHCP, carrier flaps)
+    MODE_POLL = 1.0             # sec, stop check period of the mode threads (server / client switch)
+
+# struct iovec / msghdr / mmsghdr of sendmmsg(2)
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+# the same layout packed by struct (native alignment) : filled faster than ctypes fields
+_IOVEC = struct.Struct('PN')
+_IOVEC_LEN = struct.Struct('N')
+_MSGHDR = struct.Struct('PIPNPNi0P')        # padded to the alignment of msghdr
+_MMSGHDR = struct.Struct('PIPNPNi0PI0P')    # msghdr, msg_len
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None    # send_batch sends one frame per send()
+
+# hand packed layout of the C ABI (32 / 64 bit) : send() per frame if it does not match
+if _sendmmsg is not None and (_IOVEC.size != ctypes.sizeof(_iovec)
+                              or struct.calcsize('P') != _iovec.iov_len.offset
+                              or _MSGHDR.size != ctypes.sizeof(_msghdr)
+                              or _MSGHDR.size != _mmsghdr.msg_len.offset
+                              or _MMSGHDR.size != ctypes.sizeof(_mmsghdr)):
+    syslog.syslog(f'Socket error {__file__}, msg : mmsghdr layout [{_MMSGHDR.size} != {ctypes.sizeof(_mmsghdr)}]')
+    _sendmmsg = None
+
+class _mmsgBuffer:
+    '''
+    frames, iovec and mmsghdr of sendmmsg(2), allocated and packed once (frame slot of ETH_FRAME_LEN)
+    a send only copies the frames and packs iov_len, one caller at a time (lock)
+    '''
+    def __init__(self, count=ETHER.RAW_SENDMMSG_MAX):
+        self.count = count
+        self.lock = threading.Lock()
+        self._header = b''
+        self._data = bytearray(count * ETHER.ETH_FRAME_LEN)
+        self._ctl = bytearray(count * (_IOVEC.size + _MMSGHDR.size))
+        # ctypes views keep the buffers exported (not resized) and give their addresses
+        self._data_ref = (ctypes.c_char * len(self._data)).from_buffer(self._data)
+        self._ctl_ref = (ctypes.c_char * len(self._ctl)).from_buffer(self._ctl)
+        data_addr = ctypes.addressof(self._data_ref)
+        ctl_addr = ctypes.addressof(self._ctl_ref)
+        self._msgs_addr = ctl_addr + count * _IOVEC.size
+        for i in range(count):
+            _IOVEC.pack_into(self._ctl, i * _IOVEC.size, data_addr + i * ETHER.ETH_FRAME_LEN, 0)
+            _MMSGHDR.pack_into(self._ctl, count * _IOVEC.size + i * _MMSGHDR.size,
+                               0, 0, ctl_addr + i * _IOVEC.size, 1, 0, 0, 0, 0)
+
+    def send(self, fd, header, payloads, status) -> bool:
+        '''payloads : [(index, bytes)], status[index] set to errno if not sent, return True if one failed'''
+        failed = False
+        data, ctl, pack_len = self._data, self._ctl, _IOVEC_LEN.pack_into
+        slot, hlen, len_offset = ETHER.ETH_FRAME_LEN, len(header), _iovec.iov_len.offset
+        with self.lock:
+            if header != self._header:
+                # same header in every slot until the next (target, interface, etherType)
+                for offset in range(0, len(data), slot):
+                    data[offset:offset + hlen] = header
+                self._header = header
+            for start in range(0, len(payloads), self.count):
+                chunk = payloads[start:start + self.count]
+                for i, (_, payload) in enumerate(chunk):
+                    offset = i * slot + hlen
+                    data[offset:offset + len(payload)] = payload
+                    pack_len(ctl, i * _IOVEC.size + len_offset, hlen + len(payload))
+                done = 0
+                while done < len(chunk):
+                    sent = _sendmmsg(fd, self._msgs_addr + done * _MMSGHDR.size, len(chunk) - done, 0)
+                    if sent <= 0:
+                        # the frame at done is not sent, go on with the next
+                        status[chunk[done][0]] = ctypes.get_errno() or errno.EIO
+                        failed = True
+                        done += 1
+                    else:
+                        done += sent
+        return failed
+
+class RELIABLE(object):
+    '''sequenced frame with per-hop ACK (etherReliable)'''
+    MAGIC = 0xB2                # first byte of reliable payload (JSON '{', binary wire format 0xB1)
+    VERSION = 1
+    HEADER = struct.Struct('!BBI')      # magic, version, seq + payload
+    ACK = struct.Struct('!BBIH')        # magic, version, seq, etherType of the acknowledged frame
+    HELLO = bytes([MAGIC, 0])           # neighbor keepalive on ETH_ACK : shorter than ACK, never acknowledged
+    RTO_INIT = 0.2              # sec, retransmit timeout before the first RTT sample
+    RTO_MIN = 0.02
+    RTO_MAX = 2.0
+    RETRIES = 8                 # retransmits before giving up (RTO_MAX bound : about 10 sec per hop)
+    WINDOW = 64                 # duplicate window per (source MAC, etherType)
+    # RFC 6298 gains
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
 
 class MODE(IntEnum):
     NONE = 0
@@ -82,6 +271,16 @@ class ether:
     _local_ip_addr: str # allocated ip address
     _host_ip_addr: str
     _broadcast_ip_addr: str
+    # long-lived raw sockets and source MAC (reopened / refreshed when the link changes)
+    # shared by the instances of the process, a subclass may give an instance its own (see lib.simlink)
+    _rx_sockets: dict = dict()  # (interface, etherType) : socket
+    _tx_sockets: dict = dict()  # interface : socket
+    _hw_addr: dict = dict()     # interface : source MAC (bytes)
+    _headers: dict = dict()     # (target, interface, etherType) : packed ethernet header
+    _neighbors: dict = dict()   # interface : {source MAC (bytes) : last seen} learned from received frames
+    _sock_lock = threading.Lock()
+    _mmsg = None                # _mmsgBuffer of send_batch, allocated on the first batch
+    _link = None                # etherLink : interface state from netlink, netifaces / ioctl if None
 
     def __init__(self, port_in: str,
                  port_out: str,
@@ -116,14 +315,186 @@ class ether:
 
     def get_hardware_address(self, interface):
         """Get hardware address of specific interface."""
+        if self._link is not None and self._link.get_mac(interface) is not None:
+            return self._link.get_mac(interface)
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             # Invoke ioctl for a socket descriptor to obtain a hardware address
             info = fcntl.ioctl(s.fileno(), ETHER._SIOCGIFHWADDR, struct.pack('256s', interface[:15].encode()))
             return info[18:24]
 
+    def get_source_address(self, interface) -> bytes:
+        '''cached hardware address of interface (get_hardware_address once per link)'''
+        addr = self._hw_addr.get(interface)
+        if addr is None:
+            addr = self.get_hardware_address(interface)
+            self._hw_addr[interface] = addr
+        return addr
+
+    def get_rx_socket(self, interface, etherType) -> socket.socket:
+        '''receive socket bound to (interface, etherType), opened once'''
+        key = (interface, etherType)
+        s = self._rx_sockets.get(key)
+        if s is None:
+            with self._sock_lock:
+                s = self._rx_sockets.get(key)
+                if s is None:
+                    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(etherType))
+                    try:
+                        # filter before bind (see etherRing) : no unfiltered frame queued in between
+                        if ETHER.RAW_BPF:
+                            self.attach_filter(s, self.bpf_program(etherType, self.get_source_address(interface)))
+                        s.bind((interface, 0))
+                    except OSError:
+                        s.close()
+                        raise
+                    self._rx_sockets[key] = s
+        return s
+
+    @staticmethod
+    def bpf_program(etherType, hw_addr: bytes = None, min_payload=ETHER.RAW_MIN_PAYLOAD) -> bytes:
+        '''
+        classic BPF program (sock_filter array) run by the kernel on every frame of the socket
+        drop : other etherType, payload shorter than min_payload, source MAC == hw_addr (own frames)
+        hw_addr None or all zero (lo) : own frames are not filtered
+        '''
+        insn = ETHER._BPF_INSN.pack
+        program = [
+            insn(ETHER._BPF_LD_H_ABS, 0, 0, ETHER.ETH_ALEN * 2),                # A = etherType
+            insn(ETHER._BPF_JEQ_K, 0, 7, etherType),                            # != etherType : drop
+            insn(ETHER._BPF_LD_W_LEN, 0, 0, 0),                                 # A = frame length
+            insn(ETHER._BPF_JGE_K, 0, 5, ETHER.ETH_HLEN + min_payload),         # too short : drop
+        ]
+        if hw_addr and any(hw_addr):
+            hi, lo = struct.unpack('!IH', hw_addr)
+            program += [
+                insn(ETHER._BPF_LD_W_ABS, 0, 0, ETHER.ETH_ALEN),                # A = source MAC [0:4]
+                insn(ETHER._BPF_JEQ_K, 0, 2, hi),                               # != : accept
+                insn(ETHER._BPF_LD_H_ABS, 0, 0, ETHER.ETH_ALEN + 4),            # A = source MAC [4:6]
+                insn(ETHER._BPF_JEQ_K, 1, 0, lo),                               # == : drop
+            ]
+        else:
+            # same jump offsets without the source MAC check
+            program[1] = insn(ETHER._BPF_JEQ_K, 0, 3, etherType)
+            program[3] = insn(ETHER._BPF_JGE_K, 0, 1, ETHER.ETH_HLEN + min_payload)
+        program += [
+            insn(ETHER._BPF_RET_K, 0, 0, 0xFFFF),                               # accept
+            insn(ETHER._BPF_RET_K, 0, 0, 0),                                    # drop
+        ]
+        return b''.join(program)
+
+    @staticmethod
+    def attach_filter(s: socket.socket, program: bytes) -> bool:
+        '''SO_ATTACH_FILTER (the kernel copies the program), False if not supported'''
+        buf = ctypes.create_string_buffer(program)
+        fprog = ETHER._BPF_FPROG.pack(len(program) // ETHER._BPF_INSN.size, ctypes.addressof(buf))
+        try:
+            s.setsockopt(socket.SOL_SOCKET, ETHER._SO_ATTACH_FILTER, fprog)
+            return True
+        except OSError as e:
+            syslog.syslog(f'Socket error {__file__} attach_filter(), msg : {e}')
+            return False
+
+    def get_tx_socket(self, interface) -> socket.socket:
+        '''send socket bound to interface, opened once'''
+        s = self._tx_sockets.get(interface)
+        if s is None:
+            with self._sock_lock:
+                s = self._tx_sockets.get(interface)
+                if s is None:
+                    s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+                    try:
+                        s.bind((interface, 0))
+                    except OSError:
+                        s.close()
+                        raise
+                    self._tx_sockets[interface] = s
+        return s
+
+    def invalidate_interface(self, interface):
+        '''close sockets and forget MAC of interface (link down / changed), reopened on next use'''
+        with self._sock_lock:
+            for key in [key for key in self._rx_sockets if key[0] == interface]:
+                self._rx_sockets.pop(key).close()
+            s = self._tx_sockets.pop(interface, None)
+            if s is not None:
+                s.close()
+            self._hw_addr.pop(interface, None)
+            for key in [key for key in self._headers if key[1] == interface]:
+                self._headers.pop(key)
+            self._neighbors.pop(interface, None)
+
+    def learn_neighbor(self, interface, src: bytes):
+        '''source MAC of a received frame (own frames are dropped before, see bpf_program)'''
+        table = self._neighbors.get(interface)
+        if table is None:
+            table = self._neighbors.setdefault(interface, dict())
+        table[bytes(src)] = time.monotonic()
+
+    def get_neighbor_target(self, interface) -> str:
+        '''
+        destination MAC for interface : the neighbor if exactly one is alive (daisy chain),
+        broadcast if none is known yet (discovery) or more than one (switch)
+        '''
+        table = self._neighbors.get(interface)
+        if table:
+            now = time.monotonic()
+            alive = [mac for mac, seen in list(table.items()) if now - seen < ETHER.NEIGHBOR_TTL]
+            if not alive and len(table) == 1 and self.neighbor_kept(interface):
+                alive = list(table)
+            if len(alive) == 1:
+                return self.bytes_to_eui48(alive[0])
+        return ETHER.BROADCAST_MAC
+
+    def neighbor_kept(self, interface) -> bool:
+        '''
+        the only neighbor of interface is kept after NEIGHBOR_TTL while the carrier is up (etherLink, point to point),
+        forgotten on carrier down (on_link_change). without etherLink only NEIGHBOR_HELLO / received frames refresh it
+        '''
+        return self._link is not None and self._link.get_carrier(interface)
+
+    def get_neighbors(self) -> dict:
+        '''neighbor table for diagnostics {interface : [{'mac', 'age'}]}, expired entries are removed'''
+        now = time.monotonic()
+        dic = dict()
+        for interface, table in list(self._neighbors.items()):
+            kept = len(table) == 1 and self.neighbor_kept(interface)
+            for mac, seen in list(table.items()):
+                if now - seen >= ETHER.NEIGHBOR_TTL and not kept:
+                    table.pop(mac, None)
+            dic[interface] = [{'mac': self.bytes_to_eui48(mac), 'age': round(now - seen, 1)}
+                              for mac, seen in sorted(table.items(), key=lambda item: -item[1])]
+        return dic
+
+    def set_link(self, link, start=True):
+        '''
+        interface queries answered by link (etherLink), None : netifaces / ioctl
+        start : event thread of link, False if an event loop reads it (link.fileno() / link.drain())
+        '''
+        self._link = link
+        if link is not None:
+            link.subscribe(self.on_link_change)
+            if start:
+                link.start()
+
+    def on_link_change(self, interface, changed: set, state: dict):
+        '''etherLink event : MAC / neighbors of interface are learned again (sockets are reopened on error)'''
+        if 'mac' in changed:
+            with self._sock_lock:
+                self._hw_addr.pop(interface, None)
+                for key in [key for key in self._headers if key[1] == interface]:
+                    self._headers.pop(key)
+        if ('carrier' in changed or 'up' in changed) and not (state['up'] and state['carrier']):
+            self._neighbors.pop(interface, None)
+
+    def close_sockets(self):
+        for interface in set([key[0] for key in self._rx_sockets] + list(self._tx_sockets)):
+            self.invalidate_interface(interface)
+
     def get_IPv4_address_by(self, interface):
         """Check allocated ip address of specific interface."""
         """return dictionary {'ip': ip_addr, 'iface': iface}"""
+        if self._link is not None:
+            return self._link.get_ip(interface)
         iface_info = netifaces.ifaddresses(interface)
         # Check ethernet layer 3 level
         if netifaces.AF_INET in iface_info:
@@ -135,6 +506,8 @@ class ether:
     def get_IPv4_address(self) -> dict:
         """Check allocated ip address of specific interface."""
         """return dictionary {'ip': ip_addr, 'iface': iface}"""
+        if self._link is not None:
+            return self._link.get_IPv4_address((ETHER.PORT_WAN, ETHER.PORT_LAN))
         for iface in netifaces.interfaces():
             if iface == 'eth0' or iface == 'lan0':
                 iface_info = netifaces.ifaddresses(iface)
@@ -147,6 +520,10 @@ class ether:
         ip_dict = {'ip': ipv4_addr, 'iface': iface}
         return ip_dict
 
+    def detect_operate_mode(self) -> int:
+        '''operating mode by the current address (nothing is changed, see get_operate_mode)'''
+        return MODE.SERVER if self.get_IPv4_address()['ip'] != "" else MODE.CLIENT
+
     def get_operate_mode(self) -> int:
         """
         Get operating mode(server or client)
@@ -170,42 +547,66 @@ class ether:
             # 포트정의는 raw packet 이벤트 함수에서 설정함
             return MODE.CLIENT
 
-    def get_host_ip_addr(self, broadcast, port):
+    def answer_discovery(self, data: bytes, addr) -> tuple:
+        '''
+        reply of a UDP discovery request (local ip to UDP_PORT of the sender) : sent by the caller,
+        return (reply, host ip) : host ip is the sender if data is PRODUCT_INFO, else None
+        '''
+        reply = bytes(self.get_IPv4_address()['ip'], 'UTF-8')
+        try:
+            message = data.strip().decode('utf-8')
+        except UnicodeError:
+            return reply, None
+        print(f'Message[{addr[0]} : {str(addr[1])}] {message}')
+        if message == TCP_OBJECT.PRODUCT_INFO:
+            if addr[0] != self.host_ip_addr:
+                syslog.syslog(f'get host ip : [{addr}], set server mode')
+            self.host_ip_addr = addr[0] # ip 만 전달
+            return reply, addr[0]
+        return reply, None
+
+    def get_host_ip_addr(self, broadcast, port, stop: threading.Event = None, on_host: Callable = None):
         '''
         get dhcp host ip address
+        stop : set by a mode switch, checked every ETHER.MODE_POLL (return None)
+        on_host(ip) : background responder, every request is answered until stop and
+                      on_host is called when the host ip is changed (else the first host ip is returned)
         '''
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
             s.bind((broadcast, port))
             s.setblocking(False)
-            s.settimeout(ETHER.TCP_TIMEOUT)
+            s.settimeout(ETHER.TCP_TIMEOUT if stop is None else ETHER.MODE_POLL)
 
             print('UDP server is up and listening')
             syslog.syslog('UDP server is up and listening')
             # s.listen()
-            while True:
+            while stop is None or not stop.is_set():
                 try:
-                    d = s.recvfrom(1024)
-                    if d:
-                        data = d[0] # packet data
-                        addr = d[1] # host ip
-                        reply = self.get_IPv4_address()
-
-                        s.sendto(bytes(reply['ip'], 'UTF-8'), (addr[0],ETHER.UDP_PORT)) # UDP PORT는 고정
-                        print(f'Message[{addr[0]} : {str(addr[1])}] {data.strip().decode()}')
-
-                        if data.strip().decode('utf-8') == TCP_OBJECT.PRODUCT_INFO:
-                            self.host_ip_addr = addr[0] # ip 만 전달
-                            syslog.syslog(f'get host ip : [{addr}], set server mode')
-                            return self.host_ip_addr
+                    data, addr = s.recvfrom(1024)
+                    previous = self.host_ip_addr
+                    reply, host = self.answer_discovery(data, addr)
+                    s.sendto(reply, (addr[0], ETHER.UDP_PORT)) # UDP PORT는 고정
+                    if host is None:
+                        continue
+                    if on_host is None:
+                        return host
+                    if host != previous:
+                        on_host(host)
+                except socket.timeout:
+                    if on_host is None:
+                        syslog.syslog(f'Waiting to request activation..')
                 except IOError as e:
-                    # time.sleep(1)
-                    syslog.syslog(f'Waiting to request activation..')
-                    pass
+                    syslog.syslog(f'Socket error {__file__} get_host_ip_addr, msg : {e}')
+            return None
 
     def get_broadcast_ip_addr(self):
         '''
         get broadcast ip address
         '''
+        if self._link is not None:
+            iface = self._link.get_IPv4_address((ETHER.PORT_WAN, ETHER.PORT_LAN))['iface']
+            self.broadcast_ip_addr = self._link.get_broadcast(iface) if iface else ""
+            return self.broadcast_ip_addr
         for iface in netifaces.interfaces():
             if iface == 'eth0' or iface == 'lan0':
                 iface_info = netifaces.ifaddresses(iface)
@@ -232,32 +633,29 @@ class ether:
             return ""
         else:
             try:
-                with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(etherType)) as s:
-                    s.bind((interface, 0))
-                    s.settimeout(time)
-                    with selectors.DefaultSelector() as selector:
-                        selector.register(s.fileno(), selectors.EVENT_READ)
-                        ready = selector.select()
-                        if ready:
-                            if self.port_in == "undefinded":
-                                self.port_in = interface
-                            frame = s.recv(ETHER.ETH_DATA_LEN)
-                            header = frame[:ETHER.ETH_HLEN]
-                            dst, src, proto = struct.unpack('!6s6sH', header)
-                            payload = frame[ETHER.ETH_HLEN:]
-                            _len = len(payload)
-                            unpackData = struct.unpack(f'!{_len}s', payload)
-                            decodeData = unpackData[0].decode('utf-8')
-            except socket.error as e:
-                syslog.syslog(f'Socket error {__file__} receiveRaw(), msg : {e}')
-            except UnicodeError as e:
-                syslog.syslog(f'Socket error {__file__} receiveRaw(), msg : {e}')
-            finally:
+                # the socket stays open between calls, frames are queued while not reading
+                s = self.get_rx_socket(interface, etherType)
+                s.settimeout(time)
+                frame = s.recv(ETHER.ETH_FRAME_LEN)
+                if self.port_in == "undefinded":
+                    self.port_in = interface
+                header = frame[:ETHER.ETH_HLEN]
+                dst, src, proto = struct.unpack('!6s6sH', header)
+                self.learn_neighbor(interface, src)
+                payload = frame[ETHER.ETH_HLEN:]
+                decodeData = payload.decode('utf-8')
                 print(f'dst: {self.bytes_to_eui48(dst)}, '
                     f'src: {self.bytes_to_eui48(src)}, '
                     f'type: {hex(proto)}, '
                     f'payload: {len(decodeData)} {decodeData}')
-                return decodeData
+            except socket.timeout:
+                pass
+            except socket.error as e:
+                syslog.syslog(f'Socket error {__file__} receiveRaw(), msg : {e}')
+                self.invalidate_interface(interface)
+            except UnicodeError as e:
+                syslog.syslog(f'Socket error {__file__} receiveRaw(), msg : {e}')
+            return decodeData
 
     def sendRaw(self, **kwargs) -> int:
         '''
@@ -269,31 +667,90 @@ class ether:
         packet = kwargs.get('packet', "")
 
         error_code = 0
+        # payload : str (JSON, utf-8 encoded here) or bytes (binary wire format)
+        payload = packet.encode('utf-8') if isinstance(packet, str) else bytes(packet)
 
-        if len(packet) > ETHER.ETH_DATA_LEN:
-            syslog.syslog(f'Socket error {__file__}, msg : packet size bigger than {ETHER.ETH_DATA_LEN} [{len(packet)}]')
+        if len(payload) > ETHER.ETH_DATA_LEN:
+            syslog.syslog(f'Socket error {__file__}, msg : packet size bigger than {ETHER.ETH_DATA_LEN} [{len(payload)}]')
             return -1
-        elif len(packet) == 0:
-            syslog.syslog(f'Socket error {__file__}, msg : packet size [{len(packet)}]')
+        elif len(payload) == 0:
+            syslog.syslog(f'Socket error {__file__}, msg : packet size [{len(payload)}]')
             return -1
         else:
             try:
-                _len = len(packet)  # packing size
-                with socket.socket(socket.AF_PACKET, socket.SOCK_RAW) as s:
-                    s.bind((interface, 0))
-                    s.sendall(
-                        struct.pack(f'!6s6sH{_len}s',
-                                    self.eui48_to_bytes(target),            # Destination MAC address
-                                    self.get_hardware_address(interface),   # Source MAC address
-                                    etherType,                              # Ethernet type
-                                    packet.encode('utf-8')))                # Payload (encoding bytes type)
-                    # print(f'send Raw packet : [len : {len(packet)}]')
-                    # syslog.syslog(f'send Raw packet : [len : {len(packet)}]')
-                    error_code = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                s = self.get_tx_socket(interface)
+                s.sendall(
+                    struct.pack('!6s6sH',
+                                self.eui48_to_bytes(target),            # Destination MAC address
+                                self.get_source_address(interface),     # Source MAC address (cached)
+                                etherType) + payload)                   # Ethernet type, payload (bytes)
+                # print(f'send Raw packet : [len : {len(packet)}]')
+                # syslog.syslog(f'send Raw packet : [len : {len(packet)}]')
+                error_code = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
             except socket.error as e:
                 syslog.syslog(f'Socket error {__file__} sendRaw(), msg : {e}')
-            finally:
-                return error_code
+                # link down or interface changed : reopen and refresh MAC on next send
+                self.invalidate_interface(interface)
+                error_code = e.errno if e.errno else errno.EIO
+            return error_code
+
+    def send_batch(self, **kwargs) -> list:
+        '''
+        send raw packets to mac address (target, interface, etherType, packets : list of str / bytes)
+        the header is packed once per (target, interface, etherType), no SO_ERROR check per frame
+        frames are written by sendmmsg(2) from ETHER.RAW_SENDMMSG_MIN frames (ETHER.RAW_SENDMMSG), or send() per frame
+        return status per packet : 0 sent, -1 size error (not sent), errno
+        '''
+        target = kwargs.get('target', "")
+        interface = kwargs.get('interface', "")
+        etherType = kwargs.get('etherType', 0)
+        packets = kwargs.get('packets', [])
+
+        status = [0] * len(packets)
+        payloads = []   # (index, bytes)
+        for index, packet in enumerate(packets):
+            payload = packet.encode('utf-8') if isinstance(packet, str) else bytes(packet)
+            if len(payload) > ETHER.ETH_DATA_LEN or len(payload) == 0:
+                syslog.syslog(f'Socket error {__file__}, msg : packet size [{len(payload)}] send_batch()')
+                status[index] = -1
+            else:
+                payloads.append((index, payload))
+        if not payloads:
+            return status
+        try:
+            key = (target, interface, etherType)
+            header = self._headers.get(key)
+            if header is None:
+                header = struct.pack('!6s6sH', self.eui48_to_bytes(target), self.get_source_address(interface), etherType)
+                self._headers[key] = header
+            s = self.get_tx_socket(interface)
+        except socket.error as e:
+            syslog.syslog(f'Socket error {__file__} send_batch(), msg : {e}')
+            self.invalidate_interface(interface)
+            for index, _ in payloads:
+                status[index] = e.errno if e.errno else errno.EIO
+            return status
+
+        failed = False
+        if (_sendmmsg is None or not ETHER.RAW_SENDMMSG or len(payloads) < ETHER.RAW_SENDMMSG_MIN
+                or not isinstance(s, socket.socket)):   # sockets of a subclass (lib.simlink)
+            for index, payload in payloads:
+                try:
+                    s.send(header + payload)
+                except socket.error as e:
+                    status[index] = e.errno if e.errno else errno.EIO
+                    failed = True
+        else:
+            if ether._mmsg is None:
+                with self._sock_lock:
+                    if ether._mmsg is None:
+                        ether._mmsg = _mmsgBuffer()
+            failed = ether._mmsg.send(s.fileno(), header, payloads, status)
+        if failed:
+            syslog.syslog(f'Socket error {__file__} send_batch(), msg : {[code for code in status if code > 0]}')
+            # link down or interface changed : reopen and refresh MAC on next send
+            self.invalidate_interface(interface)
+        return status
 
     def getDict(self) -> dict:
         dic = dict()
@@ -302,6 +759,7 @@ class ether:
         dic['op_mode'] = self.op_mode
         dic['host_ip_addr'] = self.host_ip_addr
         dic['broadcast_ip_addr'] = self.broadcast_ip_addr
+        dic['neighbors'] = self.get_neighbors()
         return dic
 
     @property
@@ -334,6 +792,732 @@ class ether:
     @local_ip_addr.setter
     def local_ip_addr(self, value): self._local_ip_addr = value
 
+class etherRing:
+    '''
+    TPACKET_V3 receive ring (PACKET_RX_RING) of (interface, etherType)
+    the kernel writes frames into memory-mapped blocks : no recv() copy per frame,
+    ready blocks are read as batches of memoryview and given back to the kernel after the batch.
+    '''
+    def __init__(self, interface, etherType, **kwargs):
+        self.interface = interface
+        self.etherType = etherType
+        self.block_size = kwargs.get('block_size', ETHER.RING_BLOCK_SIZE)
+        self.block_nr = kwargs.get('block_nr', ETHER.RING_BLOCK_NR)
+        self.timeout = kwargs.get('timeout', ETHER.RING_TIMEOUT)
+        hw_addr = kwargs.get('hw_addr')     # own MAC for the BPF filter (None : not filtered)
+        self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(etherType))
+        try:
+            self._sock.setsockopt(ETHER._SOL_PACKET, ETHER._PACKET_VERSION, ETHER._TPACKET_V3)
+            self._sock.setsockopt(ETHER._SOL_PACKET, ETHER._PACKET_RX_RING,
+                                  ETHER._TPACKET_REQ3.pack(self.block_size, self.block_nr, ETHER.RING_FRAME_SIZE,
+                                                           self.block_size * self.block_nr // ETHER.RING_FRAME_SIZE,
+                                                           self.timeout, 0, 0))
+            self._mm = mmap.mmap(self._sock.fileno(), self.block_size * self.block_nr,
+                                 mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if ETHER.RAW_BPF:
+                ether.attach_filter(self._sock, ether.bpf_program(etherType, hw_addr))
+            self._sock.bind((interface, 0))
+        except (OSError, ValueError):
+            self._sock.close()
+            raise
+        self._view = memoryview(self._mm)
+        self._block = 0     # next block to read
+        self.frames = 0
+        self.blocks = 0
+        self.drops = 0
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def drain(self, handler: Callable, max_blocks=None) -> int:
+        '''
+        handler(frames: list of memoryview) for each ready block, outgoing frames are skipped
+        the views are valid during the call only (the block is reused by the kernel after)
+        return the number of frames
+        '''
+        count = 0
+        for _ in range(max_blocks or self.block_nr):
+            offset = self._block * self.block_size
+            status, num, first = ETHER._TPACKET_BLOCK.unpack_from(self._view, offset + ETHER._TPACKET_BLOCK_STATUS)
+            if not status & ETHER._TP_STATUS_USER:
+                break
+            frames = []
+            pkt = offset + first
+            for _ in range(num):
+                next_offset, _, _, snaplen, _, _, mac = ETHER._TPACKET3_HDR.unpack_from(self._view, pkt)
+                if self._view[pkt + ETHER._TPACKET3_SLL_PKTTYPE] != socket.PACKET_OUTGOING:
+                    frames.append(self._view[pkt + mac:pkt + mac + snaplen])
+                pkt += next_offset
+            try:
+                if frames:
+                    handler(frames)
+            finally:
+                for frame in frames:
+                    frame.release()
+                # give the block back to the kernel
+                struct.pack_into('I', self._view, offset + ETHER._TPACKET_BLOCK_STATUS, ETHER._TP_STATUS_KERNEL)
+                self._block = (self._block + 1) % self.block_nr
+            self.blocks += 1
+            self.frames += len(frames)
+            count += len(frames)
+        return count
+
+    def statistics(self) -> tuple:
+        '''(packets, drops) since the last call (kernel counters are reset on read)'''
+        packets, drops, _ = ETHER._TPACKET_STATS_V3.unpack(
+            self._sock.getsockopt(ETHER._SOL_PACKET, ETHER._PACKET_STATISTICS, ETHER._TPACKET_STATS_V3.size))
+        self.drops += drops
+        return (packets, drops)
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+        self._sock.close()
+
+    def getDict(self) -> dict:
+        dic = dict()
+        dic['interface'] = self.interface
+        dic['etherType'] = hex(self.etherType)
+        dic['frames'] = self.frames
+        dic['blocks'] = self.blocks
+        dic['drops'] = self.drops
+        return dic
+
+class etherDispatcher:
+    '''
+    single-threaded frame dispatcher : one epoll over the raw receive sockets of ether
+    handler(interface, etherType, payload: bytes, src: bytes) is called for each frame in the loop thread,
+    sockets are drained without sleeping. a socket with error is reopened after RAW_REOPEN sec.
+    '''
+    def __init__(self, Ether: ether):
+        self.ether = Ether
+        self._epoll = select.epoll()
+        self._handlers = dict()     # (interface, etherType) : handler
+        self._rings = set()         # (interface, etherType) received by etherRing
+        self._fds = dict()          # fd : (interface, etherType, socket or etherRing)
+        self._opened = dict()       # (interface, etherType) : fd
+        self._retry = dict()        # (interface, etherType) : next open time
+        self._running = False
+        self._loop = None           # asyncio loop reading the sockets (attach)
+        self._reopen_handle = None
+        self.frames = 0
+        self.errors = 0
+
+    def register(self, interface, etherType, handler: Callable, ring=False):
+        '''
+        route frames of (interface, etherType) to handler, the socket is opened now or retried later
+        ring : receive by etherRing (payload / src are memoryview, valid during the call only)
+        '''
+        key = (interface, etherType)
+        self._handlers[key] = handler
+        if ring:
+            self._rings.add(key)
+        self._open(key)
+
+    def unregister(self, interface, etherType):
+        key = (interface, etherType)
+        self._handlers.pop(key, None)
+        self._close(key)
+        self._rings.discard(key)
+        self._retry.pop(key, None)
+
+    def _open(self, key):
+        if key in self._opened:
+            return True
+        try:
+            if key in self._rings:
+                s = etherRing(*key, hw_addr=self.ether.get_source_address(key[0]))
+            else:
+                s = self.ether.get_rx_socket(*key)
+                s.setblocking(False)
+            if self._loop is not None:
+                self._loop.add_reader(s.fileno(), self._drain, s.fileno())
+            else:
+                self._epoll.register(s.fileno(), select.EPOLLIN)
+        except OSError as e:
+            syslog.syslog(f'Socket error {__file__} etherDispatcher, msg : {key} {e}')
+            self._retry[key] = time.monotonic() + ETHER.RAW_REOPEN
+            return False
+        self._fds[s.fileno()] = (key[0], key[1], s)
+        self._opened[key] = s.fileno()
+        self._retry.pop(key, None)
+        return True
+
+    def _close(self, key):
+        fd = self._opened.pop(key, None)
+        if fd is not None:
+            entry = self._fds.pop(fd, None)
+            try:
+                if self._loop is not None:
+                    self._loop.remove_reader(fd)
+                else:
+                    self._epoll.unregister(fd)
+            except OSError:
+                pass    # already closed by invalidate_interface()
+            if entry is not None and isinstance(entry[2], etherRing):
+                entry[2].close()    # rings are owned by the dispatcher
+
+    def _reopen(self):
+        now = time.monotonic()
+        for key in [key for key, due in self._retry.items() if due <= now]:
+            if key in self._handlers:
+                self._open(key)
+
+    def _drain(self, fd):
+        interface, etherType, s = self._fds[fd]
+        handler = self._handlers[(interface, etherType)]
+        if isinstance(s, etherRing):
+            self._drain_ring(s, handler)
+            return
+        for _ in range(ETHER.RAW_DRAIN):
+            try:
+                frame, addr = s.recvfrom(ETHER.ETH_FRAME_LEN)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # link down or interface changed : close every socket of interface, reopen later
+                syslog.syslog(f'Socket error {__file__} etherDispatcher, msg : {interface} {e}')
+                self.errors += 1
+                for key in [key for key in self._opened if key[0] == interface]:
+                    self._close(key)
+                    self._retry[key] = time.monotonic() + ETHER.RAW_REOPEN
+                self.ether.invalidate_interface(interface)
+                return
+            if addr[2] == socket.PACKET_OUTGOING or len(frame) < ETHER.ETH_HLEN:
+                continue    # own frames sent on this interface are looped back to packet sockets
+            self.frames += 1
+            self.ether.learn_neighbor(interface, frame[ETHER.ETH_ALEN:ETHER.ETH_ALEN * 2])
+            try:
+                handler(interface, etherType, frame[ETHER.ETH_HLEN:], frame[ETHER.ETH_ALEN:ETHER.ETH_ALEN * 2])
+            except Exception as e:
+                syslog.syslog(f'File : {__file__} func : etherDispatcher handler, Msg : {e}')
+
+    def _drain_ring(self, ring: etherRing, handler: Callable):
+        def batch(frames):
+            for frame in frames:
+                if len(frame) < ETHER.ETH_HLEN:
+                    continue
+                self.frames += 1
+                self.ether.learn_neighbor(ring.interface, frame[ETHER.ETH_ALEN:ETHER.ETH_ALEN * 2])
+                try:
+                    handler(ring.interface, ring.etherType, frame[ETHER.ETH_HLEN:], frame[ETHER.ETH_ALEN:ETHER.ETH_ALEN * 2])
+                except Exception as e:
+                    syslog.syslog(f'File : {__file__} func : etherDispatcher handler, Msg : {e}')
+        try:
+            ring.drain(batch)
+        except OSError as e:
+            syslog.syslog(f'Socket error {__file__} etherDispatcher, msg : {ring.interface} {e}')
+            self.errors += 1
+            key = (ring.interface, ring.etherType)
+            self._close(key)
+            self._retry[key] = time.monotonic() + ETHER.RAW_REOPEN
+
+    def poll(self, timeout=ETHER.RAW_TIMEOUT) -> int:
+        '''wait at most timeout sec, dispatch every pending frame, return the number of ready sockets'''
+        if self._retry:
+            self._reopen()
+            timeout = min(timeout, ETHER.RAW_REOPEN)
+        try:
+            events = self._epoll.poll(timeout)
+        except InterruptedError:
+            return 0
+        for fd, _ in events:
+            if fd in self._fds:
+                self._drain(fd)
+        return len(events)
+
+    def attach(self, loop):
+        '''
+        read the sockets by an asyncio loop (add_reader) instead of poll() / run()
+        handlers are called in the loop, sockets not opened are retried every RAW_REOPEN
+        '''
+        self._loop = loop
+        for fd in self._fds:
+            self._epoll.unregister(fd)
+            loop.add_reader(fd, self._drain, fd)
+        self._reopen_tick()
+
+    def _reopen_tick(self):
+        if self._retry:
+            self._reopen()
+        self._reopen_handle = self._loop.call_later(ETHER.RAW_REOPEN, self._reopen_tick)
+
+    def run(self):
+        '''dispatch loop, returns after stop()'''
+        self._running = True
+        while self._running:
+            self.poll()
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        self._running = False
+        for key in list(self._opened):
+            self._close(key)
+        if self._reopen_handle is not None:
+            self._reopen_handle.cancel()
+        self._epoll.close()
+
+    def getDict(self) -> dict:
+        dic = dict()
+        dic['sockets'] = [f'{key[0]}:{hex(key[1])}' for key in self._opened]
+        dic['retry'] = [f'{key[0]}:{hex(key[1])}' for key in self._retry]
+        dic['frames'] = self.frames
+        dic['errors'] = self.errors
+        return dic
+
+class etherReliable:
+    '''
+    reliable delivery of raw frames to the next hop
+    sender : sequence number, retransmit until ETH_ACK with adaptive timeout (RFC 6298 SRTT / RTTVAR, Karn, backoff)
+    receiver : ACK unicast to the source MAC, duplicates (retransmit after a lost ACK) dropped by a sliding window
+    transport(target: str, interface, etherType, packet: bytes) -> 0 if sent (default ether.sendRaw)
+    '''
+    def __init__(self, Ether: ether, **kwargs):
+        self.ether = Ether
+        self.transport = kwargs.get('transport', self._sendRaw)
+        self.retries = kwargs.get('retries', RELIABLE.RETRIES)
+        self.rto_min = kwargs.get('rto_min', RELIABLE.RTO_MIN)
+        self.rto_max = kwargs.get('rto_max', RELIABLE.RTO_MAX)
+        self.rto = kwargs.get('rto', RELIABLE.RTO_INIT)
+        self.srtt = None
+        self.rttvar = None
+        self._seq = random.getrandbits(32)  # a restarted sender is not taken as duplicate
+        self._pending = dict()  # seq : [target, interface, etherType, packet, first sent, deadline, retries, rto, on_done]
+        self._windows = dict()  # (source MAC, etherType) : [highest seq, bitmask of WINDOW seqs below]
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        # metrics
+        self.sent = 0
+        self.retransmits = 0
+        self.acked = 0
+        self.failed = 0
+        self.received = 0
+        self.duplicates = 0
+        self.max_delivery = 0.0
+
+    def _sendRaw(self, target, interface, etherType, packet) -> int:
+        return self.ether.sendRaw(target=target, interface=interface, etherType=etherType, packet=packet)
+
+    @staticmethod
+    def is_reliable(payload) -> bool:
+        return len(payload) >= RELIABLE.HEADER.size and payload[0] == RELIABLE.MAGIC
+
+    def send(self, interface, etherType, payload, target=ETHER.BROADCAST_MAC, on_done: Callable = None) -> int:
+        '''
+        send payload (str / bytes) until acknowledged, return seq
+        on_done(delivered: bool, sec) is called by the ACK receiver or the retransmit thread
+        '''
+        payload = payload.encode('utf-8') if isinstance(payload, str) else bytes(payload)
+        with self._cond:
+            seq = self._seq
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            packet = RELIABLE.HEADER.pack(RELIABLE.MAGIC, RELIABLE.VERSION, seq) + payload
+            now = time.monotonic()
+            self._pending[seq] = [target, interface, etherType, packet, now, now + self.rto, 0, self.rto, on_done]
+            self.sent += 1
+            self._cond.notify()
+        self.transport(target, interface, etherType, packet)     # not sent : retransmitted on timeout
+        return seq
+
+    def receive(self, interface, etherType, payload, src: bytes):
+        '''
+        reliable frame : send ACK, return the inner payload, None if duplicate
+        other payload : returned as is
+        '''
+        if not self.is_reliable(payload):
+            return payload
+        magic, version, seq = RELIABLE.HEADER.unpack_from(payload, 0)
+        if version != RELIABLE.VERSION:
+            raise ValueError(f'reliable frame version not supported [{version}]')
+        # acknowledge every copy (the ACK of the first one may be lost)
+        self.transport(self.ether.bytes_to_eui48(bytes(src)), interface, ETHER.ETH_ACK,
+                       RELIABLE.ACK.pack(RELIABLE.MAGIC, RELIABLE.VERSION, seq, etherType))
+        if self._duplicate((bytes(src), etherType), seq):
+            self.duplicates += 1
+            return None
+        self.received += 1
+        return payload[RELIABLE.HEADER.size:]
+
+    def _duplicate(self, key, seq) -> bool:
+        window = self._windows.get(key)
+        if window is None:
+            self._windows[key] = [seq, 1]
+            return False
+        top, mask = window
+        ahead = (seq - top) & 0xFFFFFFFF
+        behind = (top - seq) & 0xFFFFFFFF
+        if ahead == 0:
+            return True
+        if ahead < RELIABLE.WINDOW:
+            window[0] = seq
+            window[1] = ((mask << ahead) | 1) & ((1 << RELIABLE.WINDOW) - 1)
+            return False
+        if behind < RELIABLE.WINDOW:
+            if mask & (1 << behind):
+                return True
+            window[1] = mask | (1 << behind)
+            return False
+        # far from the window : sender restarted (new random seq) or long gap
+        self._windows[key] = [seq, 1]
+        return False
+
+    def ack(self, payload) -> bool:
+        '''ETH_ACK payload, True if a pending frame is acknowledged'''
+        if len(payload) < RELIABLE.ACK.size:
+            return False
+        magic, version, seq, etherType = RELIABLE.ACK.unpack_from(payload, 0)
+        if magic != RELIABLE.MAGIC or version != RELIABLE.VERSION:
+            return False
+        with self._cond:
+            entry = self._pending.get(seq)
+            if entry is None or entry[2] != etherType:
+                return False    # late ACK of a retransmitted frame
+            del self._pending[seq]
+            now = time.monotonic()
+            elapsed = now - entry[4]
+            if entry[6] == 0:
+                self._sample(elapsed)   # Karn : no sample from a retransmitted frame
+            self.acked += 1
+            self.max_delivery = max(self.max_delivery, elapsed)
+        if entry[8] is not None:
+            entry[8](True, elapsed)
+        return True
+
+    def _sample(self, rtt):
+        '''RFC 6298 estimator'''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RELIABLE.BETA) * self.rttvar + RELIABLE.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RELIABLE.ALPHA) * self.srtt + RELIABLE.ALPHA * rtt
+        self.rto = min(self.rto_max, max(self.rto_min, self.srtt + RELIABLE.K * self.rttvar))
+
+    def service(self):
+        '''retransmit (or give up) the expired frames, return sec to the next deadline (None : nothing pending)'''
+        resend, done = [], []
+        with self._cond:
+            now = time.monotonic()
+            for seq, entry in list(self._pending.items()):
+                if entry[5] > now:
+                    continue
+                if entry[6] >= self.retries:
+                    del self._pending[seq]
+                    self.failed += 1
+                    done.append((seq, entry))
+                else:
+                    entry[6] += 1
+                    entry[7] = min(self.rto_max, entry[7] * 2)     # backoff
+                    entry[5] = now + entry[7]
+                    self.retransmits += 1
+                    resend.append(entry)
+            deadline = min([entry[5] for entry in self._pending.values()], default=None)
+        for entry in resend:
+            self.transport(entry[0], entry[1], entry[2], entry[3])
+        for seq, entry in done:
+            syslog.syslog(f'Socket error {__file__} etherReliable, msg : no ACK {entry[1]} {hex(entry[2])} seq {seq}')
+            if entry[8] is not None:
+                entry[8](False, now - entry[4])
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name='etherReliable', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def _worker(self):
+        timeout = None
+        while self._running:
+            with self._cond:
+                if self._running:
+                    self._cond.wait(timeout)
+            timeout = self.service()
+
+    def getDict(self) -> dict:
+        dic = dict()
+        dic['pending'] = len(self._pending)
+        dic['sent'] = self.sent
+        dic['retransmits'] = self.retransmits
+        dic['acked'] = self.acked
+        dic['failed'] = self.failed
+        dic['received'] = self.received
+        dic['duplicates'] = self.duplicates
+        dic['srtt_ms'] = round(self.srtt * 1000, 3) if self.srtt is not None else None
+        dic['rto_ms'] = round(self.rto * 1000, 3)
+        dic['max_delivery_ms'] = round(self.max_delivery * 1000, 3)
+        return dic
+
+class etherDiscovery(asyncio.DatagramProtocol):
+    '''
+    UDP responder of the operating PC on an asyncio loop (see ether.get_host_ip_addr)
+    every request is answered with the local ip, the PC is the sender of PRODUCT_INFO :
+    found (future) is set with the first host ip, on_host(ip) is called when the host ip is changed
+    '''
+    def __init__(self, Ether: ether, found: asyncio.Future = None, on_host: Callable = None):
+        self.ether = Ether
+        self.found = found
+        self.on_host = on_host
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        print('UDP server is up and listening')
+        syslog.syslog('UDP server is up and listening')
+
+    def datagram_received(self, data, addr):
+        previous = self.ether.host_ip_addr
+        reply, host = self.ether.answer_discovery(data, addr)
+        self.transport.sendto(reply, (addr[0], ETHER.UDP_PORT)) # UDP PORT는 고정
+        if host is None:
+            return
+        if self.found is not None and not self.found.done():
+            self.found.set_result(host)
+        if self.on_host is not None and host != previous:
+            self.on_host(host)
+
+    def error_received(self, exc):
+        syslog.syslog(f'Socket error {__file__} etherDiscovery, msg : {exc}')
+
+class etherLink:
+    '''
+    interface state cache fed by rtnetlink (RTMGRP_LINK | RTMGRP_IPV4_IFADDR)
+    every link / IPv4 address is dumped once at open, then kept by the change events of the kernel :
+    ip, broadcast, MAC and carrier are dict lookups (no netifaces scan, no ioctl).
+    handler(interface, changed: set of keys, state: dict) is called on every change in the event thread (start)
+    '''
+    def __init__(self, **kwargs):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, kwargs.get('buffer', ETHER.LINK_BUFFER))
+            self._sock.bind((0, ETHER._RTMGRP_LINK | ETHER._RTMGRP_IPV4_IFADDR))
+        except OSError:
+            self._sock.close()
+            raise
+        self._states = dict()   # interface : {'index', 'mac', 'up', 'carrier', 'ip', 'broadcast', 'prefixlen'}
+        self._names = dict()    # ifindex : interface
+        self._lock = threading.Lock()
+        self._handlers = []
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        # metrics
+        self.events = 0
+        self.resyncs = 0
+        self.dump()
+
+    @staticmethod
+    def open(**kwargs):
+        '''etherLink or None (logged) if netlink is not available (netifaces is used instead)'''
+        try:
+            return etherLink(**kwargs)
+        except OSError as e:
+            syslog.syslog(f'Socket error {__file__} etherLink, msg : {e}')
+            return None
+
+    def subscribe(self, handler: Callable):
+        self._handlers.append(handler)
+
+    def dump(self):
+        '''state of every link and IPv4 address (at open, and after lost events : ENOBUFS)'''
+        for msg_type, body in ((ETHER._RTM_GETLINK, ETHER._IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)),
+                               (ETHER._RTM_GETADDR, ETHER._IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))):
+            self._seq += 1
+            self._sock.send(ETHER._NLMSGHDR.pack(ETHER._NLMSGHDR.size + len(body), msg_type,
+                                                 ETHER._NLM_F_REQUEST | ETHER._NLM_F_DUMP, self._seq, 0) + body)
+            done = False
+            while not done:
+                done = self._parse(self._sock.recv(ETHER.LINK_BUFFER), self._seq)
+
+    def _parse(self, data, seq=None) -> bool:
+        '''apply the messages of one datagram, True at the end of the dump of seq'''
+        offset = 0
+        done = False
+        while offset + ETHER._NLMSGHDR.size <= len(data):
+            length, msg_type, _, msg_seq, _ = ETHER._NLMSGHDR.unpack_from(data, offset)
+            if length < ETHER._NLMSGHDR.size:
+                break
+            body = offset + ETHER._NLMSGHDR.size
+            if msg_type in (ETHER._RTM_NEWLINK, ETHER._RTM_DELLINK):
+                self._link(msg_type, data, body, offset + length)
+            elif msg_type in (ETHER._RTM_NEWADDR, ETHER._RTM_DELADDR):
+                self._address(msg_type, data, body, offset + length)
+            elif msg_type in (ETHER._NLMSG_DONE, ETHER._NLMSG_ERROR) and msg_seq == seq:
+                done = True
+            offset += (length + 3) & ~3
+        return done
+
+    @staticmethod
+    def _attributes(data, offset, end) -> dict:
+        attrs = dict()
+        while offset + ETHER._RTATTR.size <= end:
+            length, attr_type = ETHER._RTATTR.unpack_from(data, offset)
+            if length < ETHER._RTATTR.size:
+                break
+            attrs[attr_type] = data[offset + ETHER._RTATTR.size:offset + length]
+            offset += (length + 3) & ~3
+        return attrs
+
+    def _link(self, msg_type, data, offset, end):
+        _, _, index, flags, _ = ETHER._IFINFOMSG.unpack_from(data, offset)
+        attrs = self._attributes(data, offset + ETHER._IFINFOMSG.size, end)
+        name = attrs.get(ETHER._IFLA_IFNAME, b'').rstrip(b'\x00').decode() or self._names.get(index)
+        if name is None:
+            return
+        if msg_type == ETHER._RTM_DELLINK:
+            with self._lock:
+                self._names.pop(index, None)
+                old = self._states.pop(name, None)
+            if old is not None:
+                self._emit(name, set(old), {'index': index, 'mac': None, 'up': False, 'carrier': False,
+                                            'ip': "", 'broadcast': "", 'prefixlen': 0})
+            return
+        carrier = attrs.get(ETHER._IFLA_CARRIER)
+        update = {'index': index,
+                  'up': bool(flags & ETHER._IFF_UP),
+                  'carrier': bool(carrier[0]) if carrier else bool(flags & ETHER._IFF_LOWER_UP)}
+        if ETHER._IFLA_ADDRESS in attrs:
+            update['mac'] = bytes(attrs[ETHER._IFLA_ADDRESS])
+        self._update(name, index, update)
+
+    def _address(self, msg_type, data, offset, end):
+        family, prefixlen, _, _, index = ETHER._IFADDRMSG.unpack_from(data, offset)
+        name = self._names.get(index)
+        if family != socket.AF_INET or name is None:
+            return
+        attrs = self._attributes(data, offset + ETHER._IFADDRMSG.size, end)
+        local = attrs.get(ETHER._IFA_LOCAL, attrs.get(ETHER._IFA_ADDRESS))
+        if local is None:
+            return
+        ip = socket.inet_ntoa(local)
+        broadcast = socket.inet_ntoa(attrs[ETHER._IFA_BROADCAST]) if ETHER._IFA_BROADCAST in attrs else ""
+        state = self._states.get(name, {})
+        if msg_type == ETHER._RTM_NEWADDR:
+            if state.get('ip') and state['ip'] != ip:
+                return  # first address is used (netifaces [0])
+            self._update(name, index, {'ip': ip, 'broadcast': broadcast, 'prefixlen': prefixlen})
+        elif state.get('ip') == ip:
+            self._update(name, index, {'ip': "", 'broadcast': "", 'prefixlen': 0})
+
+    def _update(self, name, index, update: dict):
+        with self._lock:
+            self._names[index] = name
+            state = self._states.get(name)
+            if state is None:
+                state = self._states[name] = {'index': index, 'mac': None, 'up': False, 'carrier': False,
+                                              'ip': "", 'broadcast': "", 'prefixlen': 0}
+            changed = set(key for key, value in update.items() if state.get(key) != value)
+            state.update(update)
+            snapshot = dict(state)
+        if changed:
+            self._emit(name, changed, snapshot)
+
+    def _emit(self, name, changed: set, state: dict):
+        self.events += 1
+        for handler in self._handlers:
+            try:
+                handler(name, changed, state)
+            except Exception as e:
+                syslog.syslog(f'File : {__file__} func : etherLink handler, Msg : {e}')
+
+    def drain(self):
+        '''apply every pending event (non-blocking), events lost on overflow are recovered by a new dump'''
+        while True:
+            try:
+                data = self._sock.recv(ETHER.LINK_BUFFER, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                self.resyncs += 1
+                self.dump()
+                continue
+            self._parse(data)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name='etherLink', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _worker(self):
+        while self._running:
+            try:
+                if select.select([self._sock], [], [], ETHER.MODE_POLL)[0]:
+                    self.drain()
+            except OSError as e:
+                syslog.syslog(f'Socket error {__file__} etherLink, msg : {e}')
+                time.sleep(ETHER.RAW_REOPEN)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def close(self):
+        self.stop()
+        self._sock.close()
+
+    # queries (O(1), any thread)
+    def get_state(self, interface) -> dict:
+        with self._lock:
+            state = self._states.get(interface)
+            return dict(state) if state is not None else None
+
+    def get_ip(self, interface) -> str:
+        state = self._states.get(interface)
+        return state['ip'] if state is not None else ""
+
+    def get_broadcast(self, interface) -> str:
+        state = self._states.get(interface)
+        return state['broadcast'] if state is not None else ""
+
+    def get_mac(self, interface) -> bytes:
+        state = self._states.get(interface)
+        return state['mac'] if state is not None else None
+
+    def get_carrier(self, interface) -> bool:
+        state = self._states.get(interface)
+        return state is not None and state['up'] and state['carrier']
+
+    def get_IPv4_address(self, interfaces) -> dict:
+        '''first of interfaces (ifindex order, like netifaces) with an IPv4 address {'ip', 'iface'}'''
+        with self._lock:
+            names = sorted((state['index'], name) for name, state in self._states.items() if name in interfaces)
+            for _, name in names:
+                if self._states[name]['ip']:
+                    return {'ip': self._states[name]['ip'], 'iface': name}
+        return {'ip': "", 'iface': names[-1][1] if names else ""}
+
+    def getDict(self) -> dict:
+        dic = dict()
+        with self._lock:
+            for name, state in self._states.items():
+                item = dict(state)
+                item['mac'] = ':'.join('%02x' % octet for octet in state['mac']) if state['mac'] else None
+                dic[name] = item
+        dic['events'] = self.events
+        dic['resyncs'] = self.resyncs
+        return dic
+
 # def main():
 #     Ether = ether()
 #     # check host ip
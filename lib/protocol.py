@@ -5,6 +5,16 @@
 ## This is a functional testing code for a processor unit of Hub board
 ## Feature : manage the network communication between daisy-chained the processor board
 
+import codecs
+import json
+import os
+import re
+import struct
+
+# To import *
+__all__ = ['COLOR', 'TCP_OBJECT', 'WIRE', 'TCP_FRAME', 'wire_format', 'tcpFramer',
+           'is_binary', 'encode_hubinfo', 'encode_hubinfo_frames', 'decode_hubinfo', 'encode_cmd', 'decode_cmd']
+
 class COLOR(object):
     CYAN = '\033[96m'
     RED = '\033[91m'
@@ -22,6 +32,7 @@ class TCP_OBJECT(object):
     RESPONSE_CMD_ID = 'setServerId'
     RESPONSE_CMD_SAVE = 'setPowerSave'
     RESPONSE_CMD_INFO = 'getHubInfo'
+    RESPONSE_ERROR = 'error'
     DATA_SERVER_INFO = 'serverHubInfo'
     DATA_CLIENT_INFO = 'clientHubInfo'
     DATA_ID = 'Id'
@@ -44,5 +55,251 @@ class TCP_OBJECT(object):
     PORT_IN = 'IN'
     PORT_OUT = 'OUT'
 
+class WIRE(object):
+    '''raw frame payload format (ETH_REQ_HUBINFO, ETH_REQ_ID)'''
+    JSON = 'json'
+    BINARY = 'binary'
+    MAGIC = 0xB1                    # first byte of binary payload (JSON payload starts with '{')
+    VERSION = 1
+    TYPE_HUBINFO = 1
+    TYPE_CMD = 2
+    # header : magic, version, type, record count (ethernet padding after the records is ignored)
+    HEADER = struct.Struct('<BBBB')
+    # hub info record : serverId, clientId, power x POWER_SCALE, signal, powerStatus
+    HUBINFO = struct.Struct('<HHiBB')
+    POWER_SCALE = 10000
+    # command record : serverId, clientNumber, command flags
+    CMD = struct.Struct('<HHB')
+    CMD_FLAGS = (TCP_OBJECT.RESPONSE_CMD_ID, TCP_OBJECT.RESPONSE_CMD_SAVE, TCP_OBJECT.RESPONSE_CMD_INFO)
+    MAX_RECORDS = (1500 - HEADER.size) // HUBINFO.size     # ETHER.ETH_DATA_LEN
+
+class TCP_FRAME(object):
+    '''request framing of the TCP command port, taken from the first byte of a connection'''
+    JSON = 'json'                   # JSON values : legacy single shot, newline delimited or back to back
+    LENGTH = 'length'               # 4 byte length (big endian) + UTF-8 JSON, request and response
+    JSON_FIRST = b'{[ \t\r\n'       # first byte of JSON mode, anything else is a length header
+    LENGTH_HEADER = struct.Struct('!I')
+    MAX_SIZE = 1 << 20              # bytes of one request (a larger one closes the connection)
+    RECV_SIZE = 1 << 16
+    IDLE_TIMEOUT = 30.0             # sec without a request, the connection is closed
+    # TCP keepalive of a persistent connection (operating PC gone without FIN)
+    KEEPALIVE_IDLE = 10
+    KEEPALIVE_INTERVAL = 5
+    KEEPALIVE_COUNT = 3
+
+# send format, JSON until every hub of the chain decodes binary (HUB_WIRE=binary)
+wire_format = WIRE.BINARY if os.environ.get('HUB_WIRE', WIRE.JSON) == WIRE.BINARY else WIRE.JSON
+
+def is_binary(payload) -> bool:
+    return isinstance(payload, (bytes, bytearray, memoryview)) and len(payload) > 0 and payload[0] == WIRE.MAGIC
+
+def _header(payload, type):
+    if len(payload) < WIRE.HEADER.size:
+        raise ValueError(f'binary payload too short [{len(payload)}]')
+    magic, version, _type, count = WIRE.HEADER.unpack_from(payload, 0)
+    if version != WIRE.VERSION or _type != type:
+        raise ValueError(f'binary payload not supported [version {version}, type {_type}]')
+    return count
+
+def _json(payload):
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        payload = bytes(payload).rstrip(b'\x00')   # ethernet padding
+    return json.loads(payload)
+
+def encode_hubinfo(records: list, format=None):
+    '''
+    hub data records (dict like a hubDataTable row) to payload
+    JSON : object of one record (list if more), BINARY : header + packed records
+    '''
+    format = format or wire_format
+    if format == WIRE.JSON:
+        return json.dumps(records[0] if len(records) == 1 else records)
+    if len(records) > WIRE.MAX_RECORDS:
+        raise ValueError(f'too many records [{len(records)}]')
+    buf = bytearray(WIRE.HEADER.size + WIRE.HUBINFO.size * len(records))
+    WIRE.HEADER.pack_into(buf, 0, WIRE.MAGIC, WIRE.VERSION, WIRE.TYPE_HUBINFO, len(records))
+    offset = WIRE.HEADER.size
+    for record in records:
+        WIRE.HUBINFO.pack_into(buf, offset,
+                               record['serverId'], record['clientId'],
+                               int(round(record['power'] * WIRE.POWER_SCALE)),
+                               record['signal'], record['powerStatus'])
+        offset += WIRE.HUBINFO.size
+    return bytes(buf)
+
+def encode_hubinfo_frames(records: list, format=None, size=1500) -> list:
+    '''
+    hub data records to payloads of at most size bytes (ETHER.ETH_DATA_LEN) each
+    records are split in order, one record is never split
+    '''
+    format = format or wire_format
+    if format != WIRE.JSON:
+        count = min(WIRE.MAX_RECORDS, (size - WIRE.HEADER.size) // WIRE.HUBINFO.size)
+        return [encode_hubinfo(records[i:i + count], format) for i in range(0, len(records), count)]
+    payloads, chunk, length = [], [], 2     # '[' + ']'
+    for record in records:
+        text = json.dumps(record)
+        if chunk and length + len(text) + 2 > size:
+            payloads.append(chunk[0] if len(chunk) == 1 else '[' + ', '.join(chunk) + ']')
+            chunk, length = [], 2
+        chunk.append(text)
+        length += len(text) + 2             # ', '
+    if chunk:
+        payloads.append(chunk[0] if len(chunk) == 1 else '[' + ', '.join(chunk) + ']')
+    return payloads
+
+def decode_hubinfo(payload) -> list:
+    '''payload (JSON or binary) to list of hub data records'''
+    if not is_binary(payload):
+        data = _json(payload)
+        return data if isinstance(data, list) else [data]
+    count = _header(payload, WIRE.TYPE_HUBINFO)
+    if len(payload) < WIRE.HEADER.size + WIRE.HUBINFO.size * count:
+        raise ValueError(f'binary payload too short [{len(payload)}, {count} records]')
+    records = []
+    for serverId, clientId, power, signal, powerStatus in \
+            WIRE.HUBINFO.iter_unpack(payload[WIRE.HEADER.size:WIRE.HEADER.size + WIRE.HUBINFO.size * count]):
+        records.append({'serverId': serverId, 'clientId': clientId, 'power': power / WIRE.POWER_SCALE,
+                        'signal': signal, 'powerStatus': powerStatus})
+    return records
+
+def encode_cmd(data: dict, format=None):
+    '''command (dict of host request, see getJsonTcp) to payload'''
+    format = format or wire_format
+    if format == WIRE.JSON:
+        return json.dumps(data)
+    flags = 0
+    for bit, name in enumerate(WIRE.CMD_FLAGS):
+        if data.get(name, 0):
+            flags |= 1 << bit
+    return WIRE.HEADER.pack(WIRE.MAGIC, WIRE.VERSION, WIRE.TYPE_CMD, 1) + \
+        WIRE.CMD.pack(data[TCP_OBJECT.HEADER_SERVER_ID], data[TCP_OBJECT.HEADER_CLIENT_NUMBER], flags)
+
+def decode_cmd(payload) -> dict:
+    '''payload (JSON or binary) to command dict'''
+    if not is_binary(payload):
+        return _json(payload)
+    if _header(payload, WIRE.TYPE_CMD) != 1 or len(payload) < WIRE.HEADER.size + WIRE.CMD.size:
+        raise ValueError(f'binary command not valid [{len(payload)}]')
+    serverId, clientNumber, flags = WIRE.CMD.unpack_from(payload, WIRE.HEADER.size)
+    data = dict()
+    data[TCP_OBJECT.HEADER_COMPANY_ID] = TCP_OBJECT.COMPANY_ID
+    data[TCP_OBJECT.HEADER_PRODUCT_INFO] = TCP_OBJECT.PRODUCT_INFO
+    data[TCP_OBJECT.HEADER_SERVER_ID] = serverId
+    data[TCP_OBJECT.HEADER_CLIENT_NUMBER] = clientNumber
+    for bit, name in enumerate(WIRE.CMD_FLAGS):
+        data[name] = (flags >> bit) & 1
+    return data
+
+class tcpFramer:
+    '''
+    requests of one TCP connection (no I/O : feed() the received bytes, send encode() of every response)
+    JSON mode : a value is complete when it decodes (raw_decode), split segments and large requests are joined.
+                a single value followed only by whitespace (legacy '{...}\\n') is one request, closed after the response.
+                a next value after it keeps the connection (responses newline delimited)
+    LENGTH mode : always kept, responses length prefixed. requests are returned in order (pipelining)
+    input that is not a request raises ValueError : answer error() and close, the stream can not be resynchronized
+    '''
+    # rest of a JSON value cut by the segment (number, literal, \u escape)
+    _NUMBER = re.compile(r'-?[0-9]*\.?[0-9]*([eE][+-]?[0-9]*)?')
+    _LITERALS = ('true', 'false', 'null')
+
+    def __init__(self, max_size=TCP_FRAME.MAX_SIZE):
+        self.max_size = max_size
+        self.mode = None
+        self.persistent = False
+        self._buf = bytearray()     # LENGTH
+        self._text = ''             # JSON
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, data: bytes) -> list:
+        '''complete requests (str) after data, ValueError if a request is not JSON, not UTF-8 or larger than max_size'''
+        if not data:
+            return []
+        if self.mode is None:
+            self.mode = TCP_FRAME.JSON if data[:1] in TCP_FRAME.JSON_FIRST else TCP_FRAME.LENGTH
+        if self.mode == TCP_FRAME.LENGTH:
+            return self._feed_length(data)
+        return self._feed_json(data)
+
+    def _feed_length(self, data) -> list:
+        self.persistent = True
+        self._buf += data
+        requests = []
+        header = TCP_FRAME.LENGTH_HEADER.size
+        while len(self._buf) >= header:
+            size = TCP_FRAME.LENGTH_HEADER.unpack_from(self._buf, 0)[0]
+            if size > self.max_size:
+                raise ValueError(f'request too large [{size} > {self.max_size}]')
+            if len(self._buf) < header + size:
+                break
+            request = self._buf[header:header + size].decode('utf-8')
+            try:
+                self._decoder.decode(request)
+            except json.JSONDecodeError as e:
+                raise ValueError(f'invalid JSON request [{e}]')
+            requests.append(request)
+            del self._buf[:header + size]
+        return requests
+
+    def _feed_json(self, data) -> list:
+        self._text += self._utf8.decode(data)
+        requests = []
+        while True:
+            start = len(self._text) - len(self._text.lstrip())
+            if start == len(self._text):
+                self._text = ''
+                break
+            if self._text[start] not in '{[':
+                raise ValueError(f'not a JSON request [{self._text[start:start + 16]!r}]')
+            try:
+                _, end = self._decoder.raw_decode(self._text, start)
+            except json.JSONDecodeError as e:
+                if self._incomplete(e):
+                    break
+                raise ValueError(f'invalid JSON request [{e}]')
+            requests.append(self._text[start:end])
+            self._text = self._text[end:]
+            if self._text.strip():
+                self.persistent = True
+        if len(self._text) > self.max_size:
+            raise ValueError(f'request too large [{len(self._text)} > {self.max_size}]')
+        return requests
+
+    def _incomplete(self, e) -> bool:
+        '''decode error at the end of the received text (the rest of the value is not received yet)'''
+        rest = e.doc[e.pos:]
+        if not rest.strip() or e.msg.startswith('Unterminated string'):
+            return True
+        if e.msg.startswith('Invalid \\uXXXX escape'):
+            return len(rest) <= 5 and all(c in '0123456789abcdefABCDEF' for c in rest[1:])
+        return any(literal.startswith(rest) for literal in self._LITERALS) or self._NUMBER.fullmatch(rest) is not None
+
+    def flush(self) -> list:
+        '''end of the connection (or idle) : ValueError if a request is not complete'''
+        if self._buf or self._text.strip():
+            raise ValueError(f'request not complete [{self.pending}]')
+        return []
+
+    def error(self, message: str) -> bytes:
+        '''error reply of input that is not a request, in the framing of the connection'''
+        data = dict()
+        data[TCP_OBJECT.HEADER_COMPANY_ID] = TCP_OBJECT.COMPANY_ID
+        data[TCP_OBJECT.HEADER_PRODUCT_INFO] = TCP_OBJECT.PRODUCT_INFO
+        data[TCP_OBJECT.RESPONSE_ERROR] = message
+        return self.encode(bytes(json.dumps(data), 'utf-8'))
+
+    def encode(self, response: bytes) -> bytes:
+        '''response (None : command without reply) in the framing of the connection, one per request'''
+        response = response or b''
+        if self.mode == TCP_FRAME.LENGTH:
+            return TCP_FRAME.LENGTH_HEADER.pack(len(response)) + response
+        if self.persistent:
+            return (response or b'{}') + b'\n'
+        return response
 
-    
\ No newline at end of file
+    @property
+    def pending(self) -> int:
+        '''bytes (chars of JSON) of a request not complete yet'''
+        return len(self._buf) + len(self._text)
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+## Author: Dustin Lee
+## Date: 2023.12.10
+## Company: Cudo Communication
+## This is a functional testing code for a processor unit of Hub board
+## Feature : share the latest hub data between task_monitoring and task_network (memory-mapped file)
+
+import errno
+import mmap
+import os
+import socket
+import struct
+import time
+import syslog, sys
+import zlib
+
+# To import *
+__all__ = ['SHARED_PARAMETER', 'sharedState', 'stateNotifier']
+
+class SHARED_PARAMETER(object):
+    PATH = '/dev/shm/hub-r1.state'  # tmpfs, no flash write
+    MAGIC = 0x31425548              # 'HUB1'
+    VERSION = 2                     # 2 : crc of the record
+    SLOTS = 1                       # slot 0 : this hub
+    LOCAL = 0
+    STALE = 10.0                    # sec, a record older than this is not used (writer stopped)
+    READ_RETRY = 1000               # retry count of a reader (writer updating, torn record)
+    NOTIFY = '\0hub-r1.notify'       # unix datagram socket (abstract namespace) of change event
+    # header : magic, version, slots, generation (incremented on every publish)
+    HEADER = struct.Struct('<IHHI4x')
+    # record : seq (seqlock), serverId, clientId, crc, power, timestamp, signal, powerStatus
+    RECORD = struct.Struct('<IIIIddBB6x')
+    CRC_OFFSET = 12                 # zlib.crc32 of the record with crc 0 (seq included)
+    SEQ = struct.Struct('<I')
+    GENERATION_OFFSET = 8
+
+class sharedState:
+    '''
+    fixed-layout hub records in a memory-mapped file
+    each record is guarded by a seqlock : the writer makes seq odd while updating,
+    and by a crc32 of the record : a reader copies the record and retries while seq is odd or the crc does
+    not match (stores seen out of order without a memory barrier, e.g. the new seq with an old record).
+    single writer per slot (task_monitoring), any number of readers.
+    '''
+    def __init__(self, **kwargs):
+        self.path = kwargs.get('path', SHARED_PARAMETER.PATH)
+        self.slots = kwargs.get('slots', SHARED_PARAMETER.SLOTS)
+        self.create = kwargs.get('create', False)   # writer side creates / initializes the file
+        self._size = SHARED_PARAMETER.HEADER.size + SHARED_PARAMETER.RECORD.size * self.slots
+        flags = os.O_RDWR | (os.O_CREAT if self.create else 0)
+        fd = os.open(self.path, flags, 0o644)
+        try:
+            if os.fstat(fd).st_size < self._size:
+                if not self.create:
+                    raise OSError(f'shared state not initialized : {self.path}')
+                os.ftruncate(fd, self._size)
+            self._mm = mmap.mmap(fd, self._size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._view = memoryview(self._mm)
+        magic, version, slots, _ = SHARED_PARAMETER.HEADER.unpack_from(self._view, 0)
+        if magic != SHARED_PARAMETER.MAGIC or version != SHARED_PARAMETER.VERSION or slots != self.slots:
+            if not self.create:
+                self.close()
+                raise OSError(f'shared state layout mismatch : {self.path} [{hex(magic)}, {version}, {slots}]')
+            self._view[:self._size] = bytes(self._size)
+            SHARED_PARAMETER.HEADER.pack_into(self._view, 0, SHARED_PARAMETER.MAGIC,
+                                              SHARED_PARAMETER.VERSION, self.slots, 0)
+
+    def _offset(self, slot) -> int:
+        if slot < 0 or slot >= self.slots:
+            raise IndexError(f'slot {slot} out of range [{self.slots}]')
+        return SHARED_PARAMETER.HEADER.size + SHARED_PARAMETER.RECORD.size * slot
+
+    def publish(self, slot, serverId, clientId, power, signal, powerStatus):
+        '''write a record (seqlock writer, crc computed before the record is stored)'''
+        offset = self._offset(slot)
+        seq = (SHARED_PARAMETER.SEQ.unpack_from(self._view, offset)[0] + 1) | 1
+        SHARED_PARAMETER.SEQ.pack_into(self._view, offset, seq & 0xFFFFFFFF)   # odd : updating
+        seq = (seq + 1) & 0xFFFFFFFF or 2                                    # 0 : never written
+        record = bytearray(SHARED_PARAMETER.RECORD.pack(seq, serverId, clientId, 0, power, time.time(), signal, powerStatus))
+        SHARED_PARAMETER.SEQ.pack_into(record, SHARED_PARAMETER.CRC_OFFSET, zlib.crc32(record))
+        self._view[offset + SHARED_PARAMETER.SEQ.size:offset + len(record)] = record[SHARED_PARAMETER.SEQ.size:]
+        SHARED_PARAMETER.SEQ.pack_into(self._view, offset, seq)                # even : stable
+        generation = SHARED_PARAMETER.SEQ.unpack_from(self._view, SHARED_PARAMETER.GENERATION_OFFSET)[0]
+        SHARED_PARAMETER.SEQ.pack_into(self._view, SHARED_PARAMETER.GENERATION_OFFSET,
+                                       (generation + 1) & 0xFFFFFFFF)
+
+    def read(self, slot=SHARED_PARAMETER.LOCAL, stale=SHARED_PARAMETER.STALE):
+        '''
+        read a record (seqlock reader), unpacked from one copy of the record checked by its crc
+        return dict like a hubDataTable row, None if never written, older than stale sec
+        or not consistent after READ_RETRY (the caller reads the database)
+        '''
+        offset = self._offset(slot)
+        for _ in range(SHARED_PARAMETER.READ_RETRY):
+            record = bytearray(self._view[offset:offset + SHARED_PARAMETER.RECORD.size])
+            seq, serverId, clientId, crc, power, ts, signal, powerStatus = SHARED_PARAMETER.RECORD.unpack(record)
+            if seq == 0:
+                return None     # never written
+            if seq & 1:
+                continue        # writer is updating
+            SHARED_PARAMETER.SEQ.pack_into(record, SHARED_PARAMETER.CRC_OFFSET, 0)
+            if zlib.crc32(record) == crc:
+                break
+        else:
+            return None         # writer stopped in the middle of update, or torn record
+        if stale is not None and time.time() - ts > stale:
+            return None
+        dic = dict()
+        dic['serverId'] = serverId
+        dic['clientId'] = clientId
+        dic['power'] = power
+        dic['signal'] = signal
+        dic['powerStatus'] = powerStatus
+        return dic
+
+    @property
+    def generation(self) -> int:
+        '''change counter of the whole file, cheap check before read()'''
+        return SHARED_PARAMETER.SEQ.unpack_from(self._view, SHARED_PARAMETER.GENERATION_OFFSET)[0]
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+
+    @staticmethod
+    def open(**kwargs):
+        '''sharedState or None (logged) if the file is not available'''
+        try:
+            return sharedState(**kwargs)
+        except (OSError, ValueError) as e:
+            syslog.syslog(f'Shared state error {__file__}, msg : {e}')
+            return None
+
+class stateNotifier:
+    '''
+    change event from the publisher (task_monitoring) to the listener (task_network)
+    unix datagram socket, the payload is not used (wake up only)
+    '''
+    def __init__(self, **kwargs):
+        self.address = kwargs.get('address', SHARED_PARAMETER.NOTIFY)
+        self.listener = kwargs.get('listener', False)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        if self.listener:
+            try:
+                self._sock.bind(self.address)
+            except OSError:
+                self._sock.close()
+                raise
+
+    def notify(self) -> bool:
+        '''send a change event, False if nobody is listening'''
+        try:
+            self._sock.sendto(b'\x01', self.address)
+            return True
+        except OSError as e:
+            # no listener (task_network stopped) or queue full (listener is busy, already woken)
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT, errno.EAGAIN):
+                syslog.syslog(f'Notify error {__file__}, msg : {e}')
+            return False
+
+    def wait(self, timeout) -> bool:
+        '''wait a change event for timeout sec, True if notified (pending events are drained)'''
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.recv(16)
+        except socket.timeout:
+            return False
+        finally:
+            self._sock.setblocking(False)
+        self.drain()
+        return True
+
+    def drain(self):
+        try:
+            while True:
+                self._sock.recv(16)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    @staticmethod
+    def open(**kwargs):
+        '''stateNotifier or None (logged) if the socket is not available'''
+        try:
+            return stateNotifier(**kwargs)
+        except OSError as e:
+            syslog.syslog(f'Notify error {__file__}, msg : {e}')
+            return None
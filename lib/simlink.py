@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+## Author: Dustin Lee
+## Date: 2023.12.10
+## Company: Cudo Communication
+## This is a functional testing code for a processor unit of Hub board
+## Feature : simulated link layer of the daisy chain (virtual hubs without AF_PACKET, bench / development)
+
+import errno
+import random
+import socket
+import struct
+import threading
+
+from lib.ethernet import *
+
+# To import *
+__all__ = ['SIM_PARAMETER', 'simSocket', 'simTxSocket', 'etherSim']
+
+class SIM_PARAMETER(object):
+    # unix datagram socket (abstract namespace) of (chain, hub, interface, etherType) : one process or many
+    PREFIX = '\0hub-r1.sim'
+    OUI = b'\x02\x53\x49'           # locally administered MAC of a virtual hub : 02:53:49:<index>:<port>
+    SEND_TIMEOUT = 0.1              # sec, a frame not queued in this time is dropped (receiver overrun)
+    HOST_IP = '127.0.0.1'           # local ip of the server hub (TCP server of the PC)
+
+def sim_address(chain, index, interface, etherType) -> str:
+    return f'{SIM_PARAMETER.PREFIX}.{chain}.{index}.{interface}.{etherType:04x}'
+
+class simSocket:
+    '''
+    receive side of (hub, interface, etherType), stands in for the AF_PACKET socket of ether.get_rx_socket
+    recvfrom() returns the address tuple of a packet socket (interface, etherType, PACKET_HOST, 1, source MAC)
+    '''
+    def __init__(self, chain, index, interface, etherType):
+        self.interface = interface
+        self.etherType = etherType
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._sock.bind(sim_address(chain, index, interface, etherType))
+        except OSError:
+            self._sock.close()
+            raise
+
+    def recvfrom(self, size):
+        frame = self._sock.recv(size)
+        return frame, (self.interface, self.etherType, socket.PACKET_HOST, 1, frame[ETHER.ETH_ALEN:ETHER.ETH_ALEN * 2])
+
+    def recv(self, size):
+        return self._sock.recv(size)
+
+    def settimeout(self, value):
+        self._sock.settimeout(value)
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+class simTxSocket:
+    '''send side of (hub, interface), stands in for the AF_PACKET socket of ether.get_tx_socket'''
+    def __init__(self, Ether, interface):
+        self.ether = Ether
+        self.interface = interface
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.settimeout(SIM_PARAMETER.SEND_TIMEOUT)
+
+    def send(self, frame) -> int:
+        self.ether.transmit(self._sock, self.interface, frame)
+        return len(frame)
+
+    def sendall(self, frame):
+        self.send(frame)
+
+    def getsockopt(self, level, option, *args) -> int:
+        return 0    # SO_ERROR
+
+    def fileno(self) -> int:
+        return self._sock.fileno()  # not connected : send_batch sends per frame (not a socket.socket)
+
+    def close(self):
+        self._sock.close()
+
+class etherSim(ether):
+    '''
+    ether of a virtual hub in a daisy chain : lan0 of hub i is wired to eth0 of hub i + 1, hub 0 is the server
+    socket calls of ether (sendRaw, send_batch, etherDispatcher) go through simSocket / simTxSocket,
+    a frame is delivered if the destination is broadcast or the MAC of the peer (no promiscuous mode)
+    and lost with probability loss. the sockets, MACs and neighbors are owned by the instance.
+    '''
+    def __init__(self, chain, index, hubs, **kwargs):
+        self.chain = chain
+        self.index = index
+        self.hubs = hubs
+        self.loss = kwargs.get('loss', 0.0)
+        self._random = random.Random(kwargs.get('seed', index))
+        self._port_in = "undefinded"
+        self._port_out = "undefinded"
+        self._op_mode = MODE.NONE
+        self._local_ip_addr = ""
+        self._host_ip_addr = "localhost"
+        self._broadcast_ip_addr = ""
+        self._rx_sockets = dict()
+        self._tx_sockets = dict()
+        self._hw_addr = dict()
+        self._headers = dict()
+        self._neighbors = dict()
+        self._sock_lock = threading.Lock()
+        self._stat_lock = threading.Lock()
+        # metrics
+        self.sent = dict()      # (interface, etherType) : frames
+        self.destinations = dict()  # (etherType, 'unicast' / 'broadcast') : frames
+        self.lost = 0
+        self.filtered = 0       # destination is not the peer
+        self.overrun = 0        # receiver queue full, or nobody receives etherType
+
+    def peer(self, interface):
+        '''(index, interface) wired to interface, None at the ends of the chain'''
+        if interface == ETHER.PORT_LAN and self.index + 1 < self.hubs:
+            return self.index + 1, ETHER.PORT_WAN
+        if interface == ETHER.PORT_WAN and self.index > 0:
+            return self.index - 1, ETHER.PORT_LAN
+        return None
+
+    @staticmethod
+    def sim_hardware_address(index, interface) -> bytes:
+        return SIM_PARAMETER.OUI + struct.pack('!HB', index, 1 if interface == ETHER.PORT_LAN else 0)
+
+    def get_hardware_address(self, interface):
+        return self.sim_hardware_address(self.index, interface)
+
+    def get_rx_socket(self, interface, etherType) -> simSocket:
+        key = (interface, etherType)
+        s = self._rx_sockets.get(key)
+        if s is None:
+            with self._sock_lock:
+                s = self._rx_sockets.get(key)
+                if s is None:
+                    s = simSocket(self.chain, self.index, interface, etherType)
+                    self._rx_sockets[key] = s
+        return s
+
+    def get_tx_socket(self, interface) -> simTxSocket:
+        s = self._tx_sockets.get(interface)
+        if s is None:
+            with self._sock_lock:
+                s = self._tx_sockets.get(interface)
+                if s is None:
+                    s = simTxSocket(self, interface)
+                    self._tx_sockets[interface] = s
+        return s
+
+    def transmit(self, sock, interface, frame):
+        '''frame (ethernet header + payload) to the peer of interface'''
+        dst = bytes(frame[:ETHER.ETH_ALEN])
+        etherType = struct.unpack_from('!H', frame, ETHER.ETH_ALEN * 2)[0]
+        with self._stat_lock:
+            key = (interface, etherType)
+            self.sent[key] = self.sent.get(key, 0) + 1
+            key = (etherType, 'broadcast' if dst == b'\xff' * ETHER.ETH_ALEN else 'unicast')
+            self.destinations[key] = self.destinations.get(key, 0) + 1
+            peer = self.peer(interface)
+            if peer is None:
+                return
+            if dst != b'\xff' * ETHER.ETH_ALEN and dst != self.sim_hardware_address(*peer):
+                self.filtered += 1
+                return
+            if self.loss and self._random.random() < self.loss:
+                self.lost += 1
+                return
+        try:
+            sock.sendto(frame, sim_address(self.chain, peer[0], peer[1], etherType))
+        except (socket.timeout, BlockingIOError, FileNotFoundError, ConnectionRefusedError):
+            with self._stat_lock:
+                self.overrun += 1
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN):
+                raise
+            with self._stat_lock:
+                self.overrun += 1
+
+    def get_IPv4_address(self) -> dict:
+        '''hub 0 has the ip of the PC side (server), the others none (client)'''
+        return {'ip': SIM_PARAMETER.HOST_IP if self.index == 0 else "", 'iface': ETHER.PORT_WAN}
+
+    def getDict(self) -> dict:
+        dic = super().getDict()
+        with self._stat_lock:
+            dic['index'] = self.index
+            dic['sent'] = {f'{key[0]}:{hex(key[1])}': count for key, count in self.sent.items()}
+            dic['destinations'] = {f'{hex(key[0])}:{key[1]}': count for key, count in self.destinations.items()}
+            dic['lost'] = self.lost
+            dic['filtered'] = self.filtered
+            dic['overrun'] = self.overrun
+        return dic
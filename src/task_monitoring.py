@@ -6,7 +6,6 @@
 ## Feature : monitoring task loutine
 
 import sys, os, time, syslog
-import pandas as pd
 # import wiringpi
 # from wiringpi import GPIO
 from dataclasses import dataclass
@@ -16,8 +15,45 @@ from lib.ethernet import *
 from lib.database import *
 from lib.pio import *
 from lib.protocol import *
+from lib.sharedstate import *
 
 ## ---------------- 클래스 ---------------- ##
+class MONITOR(object):
+    LOOP_DELAY = 0.7            # sec, main loop period
+    POWER_DEADBAND = 0.005      # V, power change under this is ADC noise (not written)
+    MAX_STALE = 30.0            # sec, write even without change
+
+@dataclass
+class changeDetector:
+    '''
+    delta filter in front of a writer
+    power : changed when it moves more than deadband from the last written value
+    serverid, clientid, signal, powerstatus : changed on any difference
+    max_stale : changed when the last write is older than this (None : never)
+    '''
+    deadband: float = MONITOR.POWER_DEADBAND
+    max_stale: float = MONITOR.MAX_STALE
+    written: int = 0
+    suppressed: int = 0
+    _last: tuple = None
+    _last_time: float = 0.0
+
+    def check(self, data: 'hubdata') -> bool:
+        '''True if data should be written, the written value is remembered'''
+        now = time.monotonic()
+        discrete = (data.serverid, data.clientid, data.signal, data.powerstatus)
+        changed = (self._last is None
+                   or discrete != self._last[0]
+                   or abs(data.power - self._last[1]) > self.deadband
+                   or (self.max_stale is not None and now - self._last_time >= self.max_stale))
+        if changed:
+            self._last = (discrete, data.power)
+            self._last_time = now
+            self.written += 1
+        else:
+            self.suppressed += 1
+        return changed
+
 @dataclass
 class hubdata:
     _serverid: int
@@ -76,6 +112,11 @@ hubDatas = hubdata(_serverid= 0x0,
 
 db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
 db_cmdTable = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
+db_history = SqlHistory(filename=db_file_path)
+db_ramdisk = SqlRamDisk()
+# delta filters : sqlite write (deadband + max staleness), change event (deadband only)
+db_detector = changeDetector()
+notify_detector = changeDetector(max_stale=None)
 ## ---------------- 콜백 ---------------- ##
 
 ## ---------------- 서브루틴 ---------------- ##
@@ -112,9 +153,19 @@ def get_power_save(pioData: dict) -> int:
 ## ---------------- 메인루틴 ---------------- ##
 def main():
     try:
+        # working database on tmpfs (HUB_DB_RAM=1) : restore the SD card checkpoint first
+        # periodic / shutdown checkpoint of both tasks here (task_network only restores)
+        if SqlRamDisk.enabled():
+            db_ramdisk.restore()
+            db_ramdisk.start()
+        # database schema upgrade (task_network 과 동시 실행 가능)
+        SqlSchema.migrate(db_file_path)
         Pio = pio() # power/signal control instance
         # db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
         fd = Pio.pio_I2Csetup() # i2c file descriptor
+        # shared memory for task_network, sqlite is written on change only (changeDetector)
+        shared_state = sharedState.open(create=True)
+        notifier = stateNotifier.open()
 
         print(f'start {__file__} main() loop ...')
 
@@ -133,14 +184,10 @@ def main():
             pio_signal = get_signal_status(pioData)
 
             # get id from database 
-            serverId = db_data.sql_select_one(SQL_PARAMETER.COL_SID)
-            if serverId is not None:
-                hubDatas.serverid = serverId[SQL_PARAMETER.COL_SID]
-
-            # get id from database 
-            clientId = db_data.sql_select_one(SQL_PARAMETER.COL_CID)
-            if clientId is not None:
-                hubDatas.clientid = clientId[SQL_PARAMETER.COL_CID]
+            hubRow = db_data.sql_fetch_first()
+            if hubRow is not None:
+                hubDatas.serverid = hubRow[SQL_PARAMETER.COL_SID]
+                hubDatas.clientid = hubRow[SQL_PARAMETER.COL_CID]
             
             # get host ip for mode
             hostip = db_cmdTable.sql_select_one(SQL_PARAMETER.COL_HIP)
@@ -155,31 +202,36 @@ def main():
             hubDatas.signal = pio_signal
             hubDatas.powerstatus = int(pioData['power_save'])
 
+            # publish to task_network (every loop, no DB access)
+            if shared_state is not None:
+                shared_state.publish(SHARED_PARAMETER.LOCAL, hubDatas.serverid, hubDatas.clientid,
+                                     hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
+                # wake up task_network at once when a value is changed (out of the power deadband)
+                if notifier is not None and notify_detector.check(hubDatas):
+                    notifier.notify()
+            write_db = db_detector.check(hubDatas)
+
             # db table update (server mode / client mode)
             if hubDatas.opMode == MODE.SERVER:
             # if 0:
                 if hubDatas.serverid != 0:    
-                    if db_data.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-                        # get hub data from DB
-                        readSql = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", db_data._dbcon, index_col=None)
-                        db_data.sql_commit()
-                        if not readSql.empty:
-                            # check client id '0' for server board
-                            result = readSql[SQL_PARAMETER.COL_CID].isin([0])
-                            # searching client id index
-                            for i in result.index:
-                                if result[i]:  # if is true
-                                    db_data.sql_update_multi_column(0x0, hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
+                    if write_db and db_data.sql_table_check(SQL_PARAMETER.DATA_TABLE):
+                        # update the row of client id '0' for server board (no-op if not exist)
+                        db_data.sql_update_multi_column(0x0, hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
+                    db_history.append(0x0, hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
             elif hubDatas.opMode == MODE.CLIENT:
             # elif 1:
                 if hubDatas.clientid != 0:    
-                    df = pd.DataFrame(data=hubDatas.getDict())
-                    df.to_sql(SQL_PARAMETER.DATA_TABLE, db_data._dbcon, if_exists='replace', index=False)
-                    db_data.sql_commit()
+                    if write_db:
+                        db_data.sql_replace_data_row(hubDatas.serverid, hubDatas.clientid,
+                                                     hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
+                    db_history.append(hubDatas.clientid, hubDatas.power, hubDatas.signal, hubDatas.powerstatus)
             else:
                 syslog.syslog(f'disabled mode : {hubDatas.opMode}')  
                 pass
-            time.sleep(0.7)
+            # history buffer is written every SQL_HISTORY.INTERVAL
+            db_history.flush()
+            time.sleep(MONITOR.LOOP_DELAY)
     except KeyboardInterrupt as e:
         syslog.syslog(f'KeyInterrupt : {e}')
     except ConnectionError as e:
@@ -188,6 +240,9 @@ def main():
         print(f'File : {__file__}, Msg : {e}')
         syslog.syslog(f'File : {__file__}, Msg : {e}')
     finally:
+        db_history.flush(force=True)
+        db_ramdisk.stop()
+        syslog.syslog(f'Event : Sql write {db_detector.written}, suppressed {db_detector.suppressed}')
         if db_data._dbcon:
             db_data.close()
             syslog.syslog(f'Event : Sql event code [{SQL_EVENT.CONNECT}]')
@@ -6,8 +6,9 @@
 ## Feature : network's task loutine
 
 from pickle import NONE
-import socket, socketserver, time, sys, os, syslog, json, threading
-import pandas as pd
+import asyncio, socket, socketserver, time, sys, os, syslog, json, threading, signal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Callable
 
@@ -15,14 +16,109 @@ sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
 from lib.ethernet import *
 from lib.database import *
 from lib.protocol import *
+from lib.sharedstate import *
 
 ## ---------------- 고정 변수 ---------------- ##
+module_loaded = time.monotonic()    # start time if /proc is not available (see getProcessUptime)
 
 ## ---------------- 서브클래스 ---------------- ##
 @dataclass
 class EventTrigger:
     on_evnet: Callable = field(default=lambda: None)
 
+@dataclass
+class hubAggregator:
+    '''
+    downstream hub records merged into the upstream frame of this hub (HUB_AGGREGATE=1)
+    put() by the dispatcher thread, take() by the sender thread (setClientDataPort)
+    '''
+    enabled: bool = os.environ.get('HUB_AGGREGATE', '0') == '1'
+    stale: float = ETHER.RAW_AGGREGATE_STALE
+    _records: dict = field(default_factory=dict)    # clientId : record (latest)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+    notify_address: str = SHARED_PARAMETER.NOTIFY  # listened by the sender (setClientDataPort)
+    _notifier: object = None
+    _last_put: float = 0.0
+    received: int = 0
+    merged: int = 0
+
+    def put(self, records: list, clientId=None):
+        '''buffer records (except this hub) and wake the sender'''
+        with self._lock:
+            for record in records:
+                if record[SQL_PARAMETER.COL_CID] == clientId:
+                    continue
+                if record[SQL_PARAMETER.COL_CID] in self._records:
+                    self.merged += 1    # not sent yet, newer one wins
+                self._records[record[SQL_PARAMETER.COL_CID]] = record
+                self.received += 1
+            self._last_put = time.monotonic()
+        if self._notifier is None:
+            self._notifier = stateNotifier.open(address=self.notify_address)
+        if self._notifier is not None:
+            self._notifier.notify()
+
+    def take(self) -> list:
+        '''buffered records in clientId order, the buffer is emptied (each record is sent once)'''
+        with self._lock:
+            records, self._records = self._records, dict()
+        return [records[clientId] for clientId in sorted(records)]
+
+    def live(self) -> bool:
+        '''downstream hubs are sending (frames upstream are driven by them, not by the heartbeat)'''
+        return self._last_put > 0 and time.monotonic() - self._last_put < self.stale
+
+    def getDict(self) -> dict:
+        dic = dict()
+        dic['enabled'] = self.enabled
+        dic['pending'] = len(self._records)
+        dic['received'] = self.received
+        dic['merged'] = self.merged
+        dic['live'] = self.live()
+        return dic
+
+@dataclass
+class relayCache:
+    '''
+    hub info frames already relayed : (origin clientId, payload hash) kept RAW_RELAY_TTL sec, LRU bounded
+    a frame seen again in this time (bounce, duplicate) is not relayed. used by the dispatcher thread only
+    ttl is shorter than the send period of a hub, the same data sent again by its origin is relayed
+    '''
+    size: int = ETHER.RAW_RELAY_CACHE
+    ttl: float = ETHER.RAW_RELAY_TTL
+    _entries: OrderedDict = field(default_factory=OrderedDict)    # key : expire time
+    hits: int = 0
+    misses: int = 0
+    saved_bytes: int = 0
+
+    def check(self, origin, payload: bytes) -> bool:
+        '''True if the frame is new (remembered now), False if already relayed'''
+        now = time.monotonic()
+        key = (origin, hash(payload))
+        expire = self._entries.get(key)
+        if expire is not None and expire > now:
+            self.hits += 1
+            self.saved_bytes += len(payload)
+            return False
+        self.misses += 1
+        self._entries[key] = now + self.ttl
+        self._entries.move_to_end(key)
+        # expired or least recently relayed first
+        while self._entries:
+            oldest, expire = next(iter(self._entries.items()))
+            if len(self._entries) <= self.size and expire > now:
+                break
+            del self._entries[oldest]
+        return True
+
+    def getDict(self) -> dict:
+        dic = dict()
+        dic['entries'] = len(self._entries)
+        dic['hits'] = self.hits
+        dic['misses'] = self.misses
+        dic['saved_bytes'] = self.saved_bytes
+        return dic
+
 @dataclass
 class tcpFormat:
     _h_server_id: int
@@ -31,8 +127,8 @@ class tcpFormat:
     _host_request: str
     _client_request_to_server: str = ""
     _client_request_to_client: str = ""
-    event_trigger_server: EventTrigger = EventTrigger()
-    event_trigger_client: EventTrigger = EventTrigger()
+    event_trigger_server: EventTrigger = field(default_factory=EventTrigger)
+    event_trigger_client: EventTrigger = field(default_factory=EventTrigger)
     
     def __post_init__(self):
         self.event_trigger_server.on_evnet = self.handle_event_server
@@ -54,9 +150,13 @@ class tcpFormat:
             self.c_command = ""
 
     def getJsonTcp(self, string):
+        '''
+        parse host request / command frame
+        parameter : (str) JSON or (dict) decoded command (see decode_cmd)
+        '''
         try:
             self.host_request = string
-            data = json.loads(string)
+            data = string if isinstance(string, dict) else json.loads(string)
             # checking companyId 
             check_result = True if data[TCP_OBJECT.HEADER_COMPANY_ID] == TCP_OBJECT.COMPANY_ID else False
 
@@ -76,41 +176,39 @@ class tcpFormat:
                       f'{__file__} {self.__class__.__name__} getJsonTcp, msg : {data}')
                 syslog.syslog(f'The JSON string does not conform to the protocol.'
                               f'{__file__} {self.__class__.__name__} getJsonTcp, msg : {data}')
-                pass
+                self.c_command = ""     # not the command of the previous request
         except ValueError as e:
             syslog.syslog(f'Socket error {__file__} {self.__class__.__name__}, msg : {e}')
+            self.c_command = ""
     
-    def setJsonCmdClientId(self, string):
+    def setCmdClientId(self, packet):
         '''
-        json string for set client id
-        parameter : (str) JSON
+        command frame for set client id
+        parameter : (str) JSON or (bytes) JSON / binary payload
         work : clientNumber + 1
-        return : (str) JSON
+        return : (str) JSON or (bytes) binary by wire_format
         '''
-        data = json.loads(string)
+        data = decode_cmd(packet)
         data[TCP_OBJECT.HEADER_CLIENT_NUMBER] += 1
-        return json.dumps(data)
+        return encode_cmd(data)
     
     def setJsonResponeReqId(self) -> str:
         '''json string for request setup server id'''
         handle_db_req = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
         # get header + command (dict)
         headerCmd = self.getResFormatDictEx()
-        # get hub data from DB (table:hubDataTable) (dataframe to dict)
-        if handle_db_req.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-            hubData = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", handle_db_req._dbcon, index_col=None)
-            handle_db_req.sql_commit()
-            if not hubData.empty:
-                dictHubData = hubData.to_dict(orient='index') # type: ignore
-                # rename object
-                tcpData = dict()
-                tcpData[TCP_OBJECT.DATA_ID] = dictHubData[0][SQL_PARAMETER.COL_SID]
-                tcpData[TCP_OBJECT.DATA_POWER] = dictHubData[0][SQL_PARAMETER.COL_POW]
-                tcpData[TCP_OBJECT.DATA_SIGNAL] = dictHubData[0][SQL_PARAMETER.COL_SIG]
-                tcpData[TCP_OBJECT.DATA_POWERSTATUS] = dictHubData[0][SQL_PARAMETER.COL_PST]
+        serverData = dict()
+        # get hub data of this board (shared state or DB first row)
+        hubData = getLocalHubData(handle_db_req)
+        if hubData is not None:
+            # rename object
+            serverData[TCP_OBJECT.DATA_ID] = hubData[SQL_PARAMETER.COL_SID]
+            serverData[TCP_OBJECT.DATA_POWER] = hubData[SQL_PARAMETER.COL_POW]
+            serverData[TCP_OBJECT.DATA_SIGNAL] = hubData[SQL_PARAMETER.COL_SIG]
+            serverData[TCP_OBJECT.DATA_POWERSTATUS] = hubData[SQL_PARAMETER.COL_PST]
         # appending
-        if tcpData:
-            headerCmd[TCP_OBJECT.DATA_SERVER_INFO] = tcpData
+        if serverData:
+            headerCmd[TCP_OBJECT.DATA_SERVER_INFO] = serverData
         else:
             headerCmd[TCP_OBJECT.DATA_SERVER_INFO] = "Unknown"
         # print(headerCmd)
@@ -122,15 +220,17 @@ class tcpFormat:
         handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
         # get header + command (dict)
         headerCmd = self.getResFormatDictEx()
-        # get hub data from DB (table:hubDataTable) (dataframe to dict)
+        clientList = []
+        # get hub data from DB (table:hubDataTable, row list)
         if handle_db_req.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-            hubData = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", handle_db_req._dbcon, index_col=None)
-            handle_db_req.sql_commit()
-            if not hubData.empty:
-                dictHubData = hubData.to_dict(orient='index') # type: ignore
+            hubData = handle_db_req.sql_get_all()
+            if hubData:
+                # first row (this board) is newer in shared state
+                localData = getLocalHubData()
+                if localData is not None and localData[SQL_PARAMETER.COL_CID] == hubData[0][SQL_PARAMETER.COL_CID]:
+                    hubData[0] = localData
                 # rename object and appending
-                clientList = []
-                for index, value in dictHubData.items():
+                for index, value in enumerate(hubData):
                     if index == 0:
                         del value[SQL_PARAMETER.COL_CID]
                         headerCmd[TCP_OBJECT.DATA_SERVER_INFO] = value
@@ -172,55 +272,32 @@ class tcpFormat:
         dic[TCP_OBJECT.RESPONSE_CMD] = [self.c_command, ]
         return dic
     
-    def getcmdTableDict(self) -> dict:
+    def getcmdTableRow(self) -> tuple:
         '''
-        get dictionary type of command table
+        get row of command table (serverId, hostIp, clientNumber, IN, OUT)
         '''
-        dic = dict()
-        dic[TCP_OBJECT.HEADER_SERVER_ID] = [self.h_server_id, ]
-        dic[TCP_OBJECT.HOST_IP] = [Ether.host_ip_addr, ]
-        dic[TCP_OBJECT.HEADER_CLIENT_NUMBER] = [self.h_client_number, ]
-        dic[TCP_OBJECT.PORT_IN] = [Ether.port_in, ]
-        dic[TCP_OBJECT.PORT_OUT] = [Ether.port_out, ]
-        return dic
+        return (self.h_server_id, Ether.host_ip_addr, self.h_client_number, Ether.port_in, Ether.port_out)
 
     def handle_event_server(self):
         '''
         raw 패킷 수신 이벤트 처리함수 (서버 모드)
         In server mode, when set client_request, working parser and store database
         '''
-        if self.client_request_to_server == "":
+        if not self.client_request_to_server:
             return
         
-        handle_db_req = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
-        # load json data from raw packet
-        data = json.loads(self.client_request_to_server)
-        # if exist client id, check DB's client id and insert row list
-        if data[SQL_PARAMETER.COL_CID] != 0:
-            # get hub data from DB (table:hubDataTable) (dataframe to dict)
-            if handle_db_req.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-                readSql = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", handle_db_req._dbcon, index_col=None)
-                handle_db_req.sql_commit()
-                if not readSql.empty:    
-                    # check id is exist
-                    result = readSql[SQL_PARAMETER.COL_CID].isin([data[SQL_PARAMETER.COL_CID]])
-                    cnt = 0
-                    for i in result.index:
-                        if result[i]:  # if is true, increase count
-                            cnt += 1
-            if cnt > 0:   # is duplicated
-                handle_db_req.sql_update_multi_column(clientId=data[SQL_PARAMETER.COL_CID],
-                                                      power=data[SQL_PARAMETER.COL_POW],
-                                                      signal=data[SQL_PARAMETER.COL_SIG],
-                                                      powerStatus=data[SQL_PARAMETER.COL_PST])
-            else:   # if new, insert data
-                insert_row = (data[SQL_PARAMETER.COL_SID], data[SQL_PARAMETER.COL_CID],
-                            data[SQL_PARAMETER.COL_POW], data[SQL_PARAMETER.COL_SIG],
-                            data[SQL_PARAMETER.COL_PST])
-                handle_db_req.sql_insert(insert_row)
-        else:   # when clientId is '0'
-            syslog.syslog(f'packet client id not exist {__file__} func : handle_event_server -> msg: {self.client_request_to_server}')
-            pass
+        # load hub data from raw packet (JSON or binary)
+        for data in decode_hubinfo(self.client_request_to_server):
+            # if exist client id, queue the row of client id (write-behind, insert if new)
+            if data[SQL_PARAMETER.COL_CID] != 0:
+                db_writer.put(serverId=data[SQL_PARAMETER.COL_SID],
+                              clientId=data[SQL_PARAMETER.COL_CID],
+                              power=data[SQL_PARAMETER.COL_POW],
+                              signal=data[SQL_PARAMETER.COL_SIG],
+                              powerStatus=data[SQL_PARAMETER.COL_PST])
+            else:   # when clientId is '0'
+                syslog.syslog(f'packet client id not exist {__file__} func : handle_event_server -> msg: {data}')
+                pass
 
     def handle_event_client(self):
         '''
@@ -228,7 +305,7 @@ class tcpFormat:
         In client mode, when set client_request, working parser and store database
         '''
         # check msg
-        if self.client_request_to_client == "":
+        if not self.client_request_to_client:
             return
         # set port in/out
         Ether.port_out = ETHER.PORT_LAN if Ether.port_in == ETHER.PORT_WAN else ETHER.PORT_WAN
@@ -237,7 +314,7 @@ class tcpFormat:
         if tcpData.h_client_number > 0: # monitoring
             tcpData.c_command = TCP_OBJECT.RESPONSE_CMD_INFO
         else:
-            tcpData.getJsonTcp(self.client_request_to_client)
+            tcpData.getJsonTcp(decode_cmd(self.client_request_to_client))
 
         # processing
         if tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_ID:
@@ -246,38 +323,36 @@ class tcpFormat:
             handle_db_cmd = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
             if tcpData.h_server_id != 0 and tcpData.h_client_number > 0:
                 clientId = tcpData.h_server_id + tcpData.h_client_number
-                # update hubDataTable (serverId, clientId)
-                handle_db_data.sql_update_column(column=SQL_PARAMETER.COL_SID, value=tcpData.h_server_id)
-                handle_db_data.sql_update_column(column=SQL_PARAMETER.COL_CID, value=clientId)
+                # hubDataTable is the row of this board only (clientId primary key : rows of a former
+                # chain would collide with an update of every row)
+                replaceLocalRow(handle_db_data, tcpData.h_server_id, clientId)
                 # update hubcmdTable (serverId, hostIp, clientNumber, In, Out)
-                df = pd.DataFrame(data=tcpData.getcmdTableDict())
-                df.to_sql(SQL_PARAMETER.CMD_TABLE, handle_db_cmd._dbcon, if_exists='replace', index=False)
-                handle_db_cmd.sql_commit()
+                handle_db_cmd.sql_replace_cmd_row(*tcpData.getcmdTableRow())
                 # next client id (+1 clientNumber)
-                clientPacket = tcpData.setJsonCmdClientId(self.client_request_to_client)
+                clientPacket = tcpData.setCmdClientId(self.client_request_to_client)
                 print(f'{COLOR.RED} {clientPacket} {COLOR.DEFAULT}')
                 # send next hub board
-                result = Ether.sendRaw(target=ETHER.BROADCAST_MAC,
-                            interface=Ether.port_out,
-                            etherType=ETHER.ETH_REQ_ID,
-                            packet=clientPacket
-                            )
+                result = sendReqId(clientPacket)
                 if result != 0:
                     syslog.syslog(f'send error {__file__} {self.__class__.__name__} func : handle_event_client -> error_code: {result}')
         elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_SAVE:
             pass
         elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_INFO:
-            rcv_string = json.loads(self.client_request_to_client)
+            records = decode_hubinfo(self.client_request_to_client)
             handle_db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
-            if handle_db_data.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-                readSql = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", handle_db_data._dbcon, index_col=None)
-                handle_db_data.sql_commit()
-                if not readSql.empty:
-                    clientId = readSql.loc[0, SQL_PARAMETER.COL_CID]
+            clientId = None
+            hubData = getLocalHubData(handle_db_data)
+            if hubData is not None:
+                clientId = hubData[SQL_PARAMETER.COL_CID]
             # 수신받은 패킷의 클라이언트 아이디를 확인 및 처리
-            # port out -> in : toss hub data
-            if rcv_string[SQL_PARAMETER.COL_CID] != clientId:
-                result = Ether.sendRaw(target=ETHER.BROADCAST_MAC,
+            if not records or not relay_cache.check(records[0][SQL_PARAMETER.COL_CID], self.client_request_to_client):
+                pass    # already relayed (bounce, duplicate)
+            elif hub_aggregator.enabled:
+                # merged into the next upstream frame of this hub (setClientDataPort)
+                hub_aggregator.put(records, clientId)
+            # port out -> in : toss hub data (unicast to the upstream hub if known)
+            elif any(record[SQL_PARAMETER.COL_CID] != clientId for record in records):
+                result = Ether.sendRaw(target=Ether.get_neighbor_target(Ether.port_in),
                             interface=Ether.port_in,
                             etherType=ETHER.ETH_REQ_HUBINFO,
                             packet=self.client_request_to_client
@@ -326,53 +401,39 @@ class tcpFormat:
         self.event_trigger_client.on_evnet()   # when client_request_client value set, trigging event!
 
 class HubTCPHandler(socketserver.BaseRequestHandler):
-    '''attention - Create a thread, not a main thread'''
+    '''
+    attention - Create a thread, not a main thread
+    requests of the connection in order (tcpFramer) until the client closes, TCP_FRAME.IDLE_TIMEOUT,
+    the response of a legacy single shot request or the error reply of input that is not a request
+    '''
     def handle(self) -> None:
         print(f'Connected client ip address : [{self.client_address[0]}]')
+        setKeepalive(self.request)
+        self.request.settimeout(TCP_FRAME.IDLE_TIMEOUT)
+        framer = tcpFramer()
         # User protocol parser 
         try: 
-            packet = str(self.request.recv(1024), 'utf-8')
-            # packet 분석(serverId, command), write server id 
-            tcpData.getJsonTcp(packet) 
-
-            # 명령처리
-            if tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_ID:
-                # DB store after checking id
-                handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
-                df = pd.DataFrame(data=tcpData.getcmdTableDict())
-                # print(df)
-                df.to_sql(SQL_PARAMETER.CMD_TABLE, handle_db._dbcon, if_exists='replace', index=False)
-                # DB store to datatable
-                handle_db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
-                if tcpData.h_server_id != 0:
-                    # update hubDataTable (serverId)
-                    handle_db_data.sql_update_column(column=SQL_PARAMETER.COL_SID, value=tcpData.h_server_id)
-                if Ether.port_out != "undefinded":
-                    # set client id (ether_type : 0x6000)
-                    clientPacket = tcpData.setJsonCmdClientId(packet)
-                    result = Ether.sendRaw(target=ETHER.BROADCAST_MAC,
-                                interface=Ether.port_out,
-                                etherType=ETHER.ETH_REQ_ID,
-                                packet=clientPacket
-                                )
-                    if result != 0:
-                        syslog.syslog(f'send error {__file__} {self.__class__.__name__} func : handle_event_client -> error_code: {result}')
-                response = bytes(tcpData.setJsonResponeReqId(), 'utf-8')
-                self.request.sendall(response)
-            elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_SAVE:
-                pass
-            elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_INFO:
-                # DB store after updating client Number
-                handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
-                client_number, response_Json = tcpData.setJsonResponseReqHub()
-                handle_db.sql_update_column(column=SQL_PARAMETER.COL_CNB, value=client_number)
-                response = bytes(response_Json, 'utf-8')
-                self.request.sendall(response)
-            else:
-                syslog.syslog(f'Command error {__file__} {self.__class__.__name__} func : handle')
+            while True:
+                try:
+                    data = self.request.recv(TCP_FRAME.RECV_SIZE)
+                except socket.timeout:
+                    data = b''  # idle : a request not complete is answered with an error
+                packets = framer.feed(data) if data else framer.flush()
+                for packet in packets:
+                    with tcp_request_lock:
+                        response = processTcpRequest(packet)
+                    frame = framer.encode(response)
+                    if frame:
+                        self.request.sendall(frame)
+                if not data or (packets and not framer.persistent):
+                    break
+        except ValueError as e:
+            # not JSON, UnicodeDecodeError, request larger than TCP_FRAME.MAX_SIZE : error reply and close
+            syslog.syslog(f'Frame error {__file__} {self.__class__.__name__} func : handle, msg : {e}')
+            try:
+                self.request.sendall(framer.error(str(e)))
+            except socket.error:
                 pass
-        except UnicodeDecodeError as e:
-            print(f'{e}')  
         except socket.error as e:
             syslog.syslog(f'Socket error {__file__} {self.__class__.__name__} func : handle, msg : {e}')
         # return    
@@ -407,157 +468,650 @@ try:
 except Exception as e:
     syslog.syslog(f'File : {__file__}, Msg : {e}')
     pass
+# shared memory of task_monitoring (opened on first use, see getLocalHubData)
+shared_state = None
+shared_state_retry = 0.0
+# write-behind queue and history for hub data of the chain (server mode)
+db_history = SqlHistory(filename=db_file_path)
+db_writer = SqlWriteBehind(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE, history=db_history)
+# restore of the tmpfs database (HUB_DB_RAM=1), checkpointed by task_monitoring
+db_ramdisk = SqlRamDisk()
+# downstream hub data relayed in the frames of this hub (HUB_AGGREGATE=1)
+hub_aggregator = hubAggregator()
+# duplicate hub info frames not relayed again
+relay_cache = relayCache()
+# per-hop ACK / retransmit of ETH_REQ_ID (sent reliable if HUB_RELIABLE=1, received / acknowledged always)
+frame_reliable = etherReliable(Ether)
+reliable_send = os.environ.get('HUB_RELIABLE', '0') == '1'
+# tcpData is shared by the TCP connections and the frame handlers : one command / frame at a time
+tcp_request_lock = threading.Lock()
+# next keepalive to the downstream hub (sendNeighborHello)
+neighbor_hello = 0.0
+# blocking SQLite work of the event loop (HUB_ASYNCIO=1), one worker : commands run in order
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
 
 ## ---------------- 콜백(이벤트) ---------------- ##
 
 ## ---------------- 서브루틴 ---------------- ##
-def getClientDataPort(iface: str, timeout: int):
+def processTcpRequest(packet: str) -> bytes:
+    '''
+    command of the operating PC (HubTCPHandler, asyncio server), return response or None
+    blocking (SQLite, raw send) : called in a handler thread or in the executor
+    '''
+    # packet 분석(serverId, command), write server id 
+    tcpData.getJsonTcp(packet) 
+
+    # 명령처리
+    if tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_ID:
+        # DB store after checking id
+        handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
+        handle_db.sql_replace_cmd_row(*tcpData.getcmdTableRow())
+        # DB store to datatable
+        handle_db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
+        if tcpData.h_server_id != 0:
+            # update hubDataTable (serverId)
+            handle_db_data.sql_update_column(column=SQL_PARAMETER.COL_SID, value=tcpData.h_server_id)
+        if Ether.port_out != "undefinded":
+            # set client id (ether_type : 0x6000)
+            clientPacket = tcpData.setCmdClientId(packet)
+            result = sendReqId(clientPacket)
+            if result != 0:
+                syslog.syslog(f'send error {__file__} func : processTcpRequest -> error_code: {result}')
+        return bytes(tcpData.setJsonResponeReqId(), 'utf-8')
+    elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_SAVE:
+        pass
+    elif tcpData.c_command == TCP_OBJECT.RESPONSE_CMD_INFO:
+        # write pending hub data of the chain before reading
+        db_writer.flush()
+        # DB store after updating client Number
+        handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
+        client_number, response_Json = tcpData.setJsonResponseReqHub()
+        handle_db.sql_update_column(column=SQL_PARAMETER.COL_CNB, value=client_number)
+        return bytes(response_Json, 'utf-8')
+    else:
+        syslog.syslog(f'Command error {__file__} func : processTcpRequest')
+        pass
+    return None
+
+def getLocalHubData(db: SqlLib = None):
     '''
-    get client data from port in/out ('eth0', 'lan0') by orangepi-r1-plus-lts
+    latest hub data of this board (dict like a hubDataTable row)
+    published by task_monitoring in shared memory, DB first row (checkpoint) if not available
     '''
+    global shared_state, shared_state_retry
+    if shared_state is None and time.monotonic() >= shared_state_retry:
+        shared_state = sharedState.open()
+        shared_state_retry = time.monotonic() + SHARED_PARAMETER.STALE
+    if shared_state is not None:
+        hubData = shared_state.read()
+        if hubData is not None:
+            return hubData
+    return db.sql_fetch_first() if db is not None else None
+
+def onRawFrame(interface: str, etherType: int, payload: bytes, src: bytes):
+    '''
+    frame handler of the dispatcher, get client data from port in/out ('eth0', 'lan0') by orangepi-r1-plus-lts
+    called in the dispatcher thread (handle_event_server / handle_event_client run at once)
+    '''
+    if etherType == ETHER.ETH_ACK:
+        frame_reliable.ack(payload)
+        return
+    # sequenced frame : acknowledged to the sender, None if already received
+    data = frame_reliable.receive(interface, etherType, bytes(payload), src)
+    if data is None:
+        return
+    # JSON or binary, decoded by the event handler
+    # tcpData (command, client number) is shared with the TCP command handlers
+    with tcp_request_lock:
+        if Ether.op_mode == MODE.SERVER:
+            # if serverid, wait to hub data.
+            if tcpData.h_server_id and etherType == ETHER.ETH_REQ_HUBINFO:
+                tcpData.client_request_to_server = data
+        elif Ether.op_mode == MODE.CLIENT:
+            if Ether.port_in == "undefinded":
+                Ether.port_in = interface
+            # if client number, wait to hub data
+            if tcpData.h_client_number > 0:
+                if etherType == ETHER.ETH_REQ_HUBINFO:
+                    tcpData.client_request_to_client = data
+            # if not client numner, wait to id (command)
+            elif etherType != ETHER.ETH_REQ_HUBINFO:
+                tcpData.client_request_to_client = data
+        else:
+            pass
+
+def logDiagnostics(signum=None, frame=None):
+    '''
+    state of the network task to syslog (kill -USR1 <pid>)
+    ports / neighbor table, relay cache, reliable delivery, aggregation, write-behind queue
+    '''
+    dic = dict()
+    dic['ether'] = Ether.getDict()
+    dic['link'] = Ether._link.getDict() if Ether._link is not None else None
+    dic['relay'] = relay_cache.getDict()
+    dic['reliable'] = frame_reliable.getDict()
+    dic['aggregator'] = hub_aggregator.getDict()
+    dic['db_writer'] = db_writer.getDict()
+    syslog.syslog(f'Diagnostics {__file__} {json.dumps(dic)}')
+    return dic
+
+def sendReqId(packet) -> int:
+    '''
+    ETH_REQ_ID (set client id) to the next hub board (port_out), always broadcast (discovery of new hubs)
+    HUB_RELIABLE=1 : retransmitted until the next hub acknowledges (etherReliable), result is 0
+    '''
+    if reliable_send:
+        frame_reliable.send(Ether.port_out, ETHER.ETH_REQ_ID, packet)
+        return 0
+    return Ether.sendRaw(target=ETHER.BROADCAST_MAC,
+                         interface=Ether.port_out,
+                         etherType=ETHER.ETH_REQ_ID,
+                         packet=packet
+                         )
+
+def getClientDataPort(interfaces: list, etherTypes: list, ring=False, stop: threading.Event = None):
+    '''
+    receive loop of raw packets : one epoll over every (interface, etherType), no sleep between frames
+    ring : memory-mapped receive ring (TPACKET_V3) instead of recv() for ETH_REQ_HUBINFO
+    stop : returns when set (mode switch), checked every ETHER.MODE_POLL
+    '''
+    dispatcher = etherDispatcher(Ether)
     try:
-        while True:
-            if Ether.op_mode == MODE.SERVER:
-            # if 0:
-                # if serverid, wait to hub data.
-                if tcpData.h_server_id:
-                    data = Ether.receiveRaw(interface=iface, time=timeout, etherType=ETHER.ETH_REQ_HUBINFO)
-                    tcpData.client_request_to_server = data if data != "" else ""
-                # # if not serverid, wait to id
-                # else:
-                #     data = Ether.receiveRaw(interface=iface, time=timeout, etherType=ETHER.ETH_REQ_ID)
-                #     tcpData.client_request_to_server = data if data != "" else ""
-            elif Ether.op_mode == MODE.CLIENT:
-            # elif 1:
-                # if client number, wait to hub data
-                if tcpData.h_client_number > 0:
-                    data = Ether.receiveRaw(interface=iface, time=timeout, etherType=ETHER.ETH_REQ_HUBINFO)
-                    tcpData.client_request_to_client = data if data != "" else ""
-                # if not client numner, wait to id
-                else:
-                    data = Ether.receiveRaw(interface=iface, time=timeout, etherType=ETHER.ETH_REQ_ID)
-                    tcpData.client_request_to_client = data if data != "" else ""
-            else:
-                pass
-            time.sleep(1)
+        for iface in interfaces:
+            for etherType in etherTypes:
+                dispatcher.register(iface, etherType, onRawFrame, ring=ring and etherType == ETHER.ETH_REQ_HUBINFO)
+        if stop is None:
+            dispatcher.run()
+        while stop is not None and not stop.is_set():
+            dispatcher.poll(ETHER.MODE_POLL)
     except Exception as e:
         syslog.syslog(f'File : {__file__} func : getClientDataPort, Msg : {e}')
+    finally:
+        syslog.syslog(f'Dispatcher stopped {__file__}, {dispatcher.getDict()}, relay {relay_cache.getDict()}, '
+                      f'neighbors {Ether.get_neighbors()}')
+        dispatcher.close()
 
 def init_attribute():
     '''to initialize a attribute of classes from DB'''
     try:
         init_db_cmd = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
-        if init_db_cmd.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-            readSql = pd.read_sql(f"select * from {SQL_PARAMETER.CMD_TABLE}", init_db_cmd._dbcon, index_col=None)
-            init_db_cmd.sql_commit()
-            if not readSql.empty:
-                tcpData.h_server_id = readSql.loc[0, SQL_PARAMETER.COL_SID]
-                tcpData.h_client_number = readSql.loc[0, SQL_PARAMETER.COL_CNB]
-                Ether.port_in = readSql.loc[0, TCP_OBJECT.PORT_IN]
-                Ether.port_out = readSql.loc[0, TCP_OBJECT.PORT_OUT]
+        if init_db_cmd.sql_table_check(SQL_PARAMETER.CMD_TABLE):
+            cmdData = init_db_cmd.sql_fetch_first()
+            if cmdData is not None:
+                tcpData.h_server_id = cmdData[SQL_PARAMETER.COL_SID]
+                tcpData.h_client_number = cmdData[SQL_PARAMETER.COL_CNB]
+                Ether.port_in = cmdData[TCP_OBJECT.PORT_IN]
+                Ether.port_out = cmdData[TCP_OBJECT.PORT_OUT]
+                # last host ip found by UDP discovery, the TCP server does not wait for it
+                Ether.host_ip_addr = cmdData[SQL_PARAMETER.COL_HIP] or "localhost"
     except Exception as e:
         syslog.syslog(f'File : {__file__} func : init_attribute, Msg : {e}')
 
-def setClientDataPort():
-    '''set client data to send a next connection'''
+def setKeepalive(sock: socket.socket):
+    '''TCP keepalive of a persistent command connection (TCP_FRAME)'''
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, TCP_FRAME.KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, TCP_FRAME.KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, TCP_FRAME.KEEPALIVE_COUNT)
+    except (OSError, AttributeError) as e:
+        syslog.syslog(f'Socket error {__file__} func : setKeepalive, msg : {e}')
+
+def storeHostIp(host_ip: str):
+    '''host ip of the operating PC (UDP discovery) to hubCmdTable, cached at the next start'''
+    cmdRow = list(tcpData.getcmdTableRow())
+    cmdRow[1] = host_ip
+    handle_db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.CMD_TABLE)
+    handle_db.sql_replace_cmd_row(*cmdRow)
+
+def getProcessUptime() -> float:
+    '''sec since this process was started (/proc, interpreter start included), since module load if not available'''
+    try:
+        with open('/proc/self/stat') as f:
+            # starttime : 22nd field, the 20th after the command name
+            start = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0]) - start
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - module_loaded
+
+def reportServing(host, port):
+    '''time from the process start to the TCP server of the operating PC'''
+    uptime = getProcessUptime()
+    print(f'TCP server is up [{host} : {port}], {uptime:.3f} sec after start, host ip {Ether.host_ip_addr}')
+    syslog.syslog(f'Serving {__file__} TCP [{host} : {port}], {uptime:.3f} sec after start, '
+                  f'host ip {Ether.host_ip_addr}')
+
+def discoverHost(stop: threading.Event):
+    '''UDP responder of the operating PC until stop (background), a changed host ip is stored'''
+    try:
+        Ether.get_host_ip_addr(Ether.get_broadcast_ip_addr(), ETHER.UDP_PORT, stop, on_host=storeHostIp)
+    except socket.error as e:
+        syslog.syslog(f'Socket error {__file__}, msg : {e}')
+
+def sendNeighborHello() -> int:
+    '''
+    keepalive to the downstream hub every ETHER.NEIGHBOR_HELLO (called by the mode loops) :
+    its upstream neighbor (port_in) is otherwise heard only at the ID assignment, unicast would expire
+    '''
+    global neighbor_hello
+    now = time.monotonic()
+    if Ether.port_out == "undefinded" or now < neighbor_hello:
+        return 0
+    neighbor_hello = now + ETHER.NEIGHBOR_HELLO
+    return Ether.sendRaw(target=ETHER.BROADCAST_MAC, interface=Ether.port_out,
+                         etherType=ETHER.ETH_ACK, packet=RELIABLE.HELLO)
+
+def sendHubData(hubData: dict) -> int:
+    '''hub data of this board (and the aggregated downstream records) to port_in, return 0 or error code'''
+    records = [hubData]
+    if hub_aggregator.enabled:
+        # this board first, then the downstream records received since the last frame
+        records += hub_aggregator.take()
+    # print(f'{records}')
+    # every frame of the cycle in one call, unicast to the upstream hub if known
+    status = Ether.send_batch(target=Ether.get_neighbor_target(Ether.port_in),
+                interface=Ether.port_in,
+                etherType=ETHER.ETH_REQ_HUBINFO,
+                packets=encode_hubinfo_frames(records, size=ETHER.ETH_DATA_LEN)
+                )
+    return next((code for code in status if code != 0), 0)
+
+def setClientDataPort(notify_address=SHARED_PARAMETER.NOTIFY, stop: threading.Event = None):
+    '''
+    set client data to send a next connection
+    sent at once on a change event of task_monitoring, every ETHER.RAW_HEARTBEAT otherwise
+    notify_address : change event socket (one per hub when simulated, see bench/bench_cascade.py)
+    stop : returns when set (mode switch), wake up by a change event to notify_address
+    '''
+    notifier = None
     try:
         result = 0
-        while True:
-            thread_db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
-            # busy check from database
-            if thread_db_data.sql_table_check(SQL_PARAMETER.DATA_TABLE):
-                readSql = pd.read_sql(f"select * from {SQL_PARAMETER.DATA_TABLE}", thread_db_data._dbcon, index_col=None)
-                thread_db_data.sql_commit()
-                if not readSql.empty:
-                    hubData = readSql.to_dict(orient='index')
-                    hubDataJSON = json.dumps(hubData[0])
-                    # print(f'{hubDataJSON}')
-                    if Ether.port_in != "undefinded":
-                        result = Ether.sendRaw(target=ETHER.BROADCAST_MAC,
-                                    interface=Ether.port_in,
-                                    etherType=ETHER.ETH_REQ_HUBINFO,
-                                    packet=hubDataJSON
-                                    )
+        thread_db_data = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
+        notifier = stateNotifier.open(listener=True, address=notify_address)
+        hub_aggregator.notify_address = notify_address
+        send = True
+        while stop is None or not stop.is_set():
+            # hub data of this board (shared state, DB if not available)
+            hubData = getLocalHubData(thread_db_data) if send else None
+            if hubData is not None and Ether.port_in != "undefinded":
+                result = sendHubData(hubData)
             if result != 0:
                 syslog.syslog(f'send error {__file__} {__name__} func : setClientDataPort -> error_code: {result}')
-            time.sleep(ETHER.RAW_SEND_DELAY)
+                result = 0
+            sendNeighborHello()
+            if notifier is not None and (shared_state is not None or hub_aggregator.enabled):
+                # no change event without shared state : DB polling period
+                notified = notifier.wait(ETHER.RAW_HEARTBEAT if shared_state is not None else ETHER.RAW_SEND_DELAY)
+            else:
+                # no change event without shared state (polling)
+                time.sleep(ETHER.RAW_SEND_DELAY)
+                notified = False
+            if notified and hub_aggregator.enabled:
+                # collect the other frames of the same downstream cycle
+                time.sleep(ETHER.RAW_AGGREGATE_HOLD)
+                notifier.drain()
+            # heartbeat is sent by the last hub of the chain only, the others send on arrival
+            send = notified or not (hub_aggregator.enabled and hub_aggregator.live())
     except Exception as e:
         print(f'File : {__file__} func : setClientDataPort, Msg : {e}')
         syslog.syslog(f'File : {__file__} func : setClientDataPort, Msg : {e}')
         pass
+    finally:
+        if notifier is not None:
+            notifier.close()    # bound again by the next client mode
+
+def replaceLocalRow(db: SqlLib, serverId, clientId):
+    '''hubDataTable reduced to the row of this board (status of the local hub data), rows of a chain are dropped'''
+    hubData = getLocalHubData(db) or dict()
+    db.sql_replace_data_row(serverId, clientId,
+                            hubData.get(SQL_PARAMETER.COL_POW, 0.0),
+                            hubData.get(SQL_PARAMETER.COL_SIG, TCP_OBJECT.NO_SIGNAL),
+                            hubData.get(SQL_PARAMETER.COL_PST, TCP_OBJECT.POWER_NORMAL))
+
+def resetModeAttribute(previous, mode):
+    '''
+    attributes and hub data of the previous mode not valid in the new one (live mode switch)
+    blocking (SQLite) : called before the threads / tasks of the new mode are started
+    '''
+    if previous == MODE.SERVER and mode == MODE.CLIENT:
+        # upstream port and client id are given again by the new chain
+        Ether.port_in = Ether.port_out = "undefinded"
+        tcpData.h_client_number = 0
+    if previous != MODE.NONE and previous != mode:
+        # rows of the former chain (server) or the client id of the former chain (client) are dropped :
+        # the row of this board is clientId 0 until the next ID assignment (task_monitoring of the server mode)
+        replaceLocalRow(SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE), tcpData.h_server_id, 0)
+    # host ip is kept : the discovery responder of the server mode updates it
+
+def runServer(stop: threading.Event):
+    '''
+    server mode until stop : TCP server of the operating PC, host ip (UDP, background), hub data of the chain (port_out)
+    '''
+    if Ether.local_ip_addr == "":
+        return
+    HOST = Ether.local_ip_addr
+    PORT = ETHER.TCP_PORT
+    db_writer.start()
+    with ThreadedHubTCPServer((HOST, PORT), HubTCPHandler) as server:
+        # 운영서버 통신라인 : cached host ip, not waiting for the UDP discovery
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        reportServing(HOST, PORT)
+
+        discovery_thread = threading.Thread(target=discoverHost, args=(stop,), daemon=True)
+        discovery_thread.start()
+        client_thread = threading.Thread(target=getClientDataPort,
+                                         args=([Ether.port_out], [ETHER.ETH_REQ_HUBINFO, ETHER.ETH_ACK],
+                                               os.environ.get('HUB_RX_RING', '0') == '1', stop),
+                                         daemon=True)
+        client_thread.start()
+        syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.SERVER}, '
+                    f'Processing thread: {server_thread.name}, {discovery_thread.name}, {client_thread.name}')
+        stored = False
+        while not stop.wait(ETHER.MODE_POLL):
+            if server_thread.is_alive() == False:
+                break
+            sendNeighborHello()
+            if not stored and tcpData.h_server_id != 0:
+                # updating DB's command table in main loop
+                cmdRow = tcpData.getcmdTableRow()
+                db_cmdTable.sql_replace_cmd_row(*cmdRow)
+                print(cmdRow)
+                stored = True
+        server.shutdown()
+        stop.set()
+        client_thread.join()
+        discovery_thread.join()
+    db_writer.stop()
+
+def runClient(stop: threading.Event):
+    '''
+    client mode until stop : hub data to port_in, ID / hub data of the chain from both ports
+    '''
+    # thread<1> : socket to send the packet hub data
+    socket_thread_send = threading.Thread(target=setClientDataPort, kwargs={'stop': stop}, daemon=True)
+    socket_thread_send.start()
+    # thread<2> : dispatcher to receive the ports (eth0, lan0), every etherType
+    socket_thread_rcv = threading.Thread(target=getClientDataPort,
+                                         args=([ETHER.PORT_WAN, ETHER.PORT_LAN],
+                                               [ETHER.ETH_REQ_ID, ETHER.ETH_REQ_HUBINFO, ETHER.ETH_SET_POWER_SAVE, ETHER.ETH_ACK]),
+                                         kwargs={'stop': stop},
+                                         daemon=True)
+    socket_thread_rcv.start()
+    syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.CLIENT}, '
+                    f'Processing thread: {socket_thread_send.name}, {socket_thread_rcv.name}')
+    while not stop.wait(ETHER.MODE_POLL):
+        if not (socket_thread_send.is_alive() and socket_thread_rcv.is_alive()):
+            return
+    # wake up the sender waiting for a change event
+    waker = stateNotifier.open()
+    if waker is not None:
+        waker.notify()
+        waker.close()
+    socket_thread_send.join()
+    socket_thread_rcv.join()
+
+## ---------------- asyncio (HUB_ASYNCIO=1) ---------------- ##
+async def waitEvent(timeout, *events) -> bool:
+    '''wait until one of events is set (True) or timeout sec (False)'''
+    waiters = [asyncio.ensure_future(event.wait()) for event in events]
+    done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    for waiter in pending:
+        waiter.cancel()
+    return bool(done)
+
+def onRawFrameAsync(interface: str, etherType: int, payload: bytes, src: bytes):
+    '''
+    frame handler of the event loop : ACK at once in the loop, every other frame in the executor,
+    copied (ring buffers are reused). the executor is the only thread of tcpData (with the TCP commands)
+    and of the SQLite fallback of getLocalHubData (shared state missing / stale)
+    '''
+    if etherType == ETHER.ETH_ACK:
+        onRawFrame(interface, etherType, payload, src)
+    else:
+        future = db_executor.submit(onRawFrame, interface, etherType, bytes(payload), bytes(src))
+        future.add_done_callback(onRawFrameDone)
+
+def onRawFrameDone(future):
+    '''error of a frame handled in the executor (logged by the dispatcher if handled in the loop)'''
+    if future.exception() is not None:
+        syslog.syslog(f'File : {__file__} func : onRawFrameAsync, Msg : {future.exception()}')
+
+async def serveTcpClient(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    '''requests of the operating PC in order (see HubTCPHandler), processTcpRequest runs in the executor'''
+    loop = asyncio.get_running_loop()
+    print(f'Connected client ip address : [{writer.get_extra_info("peername")[0]}]')
+    setKeepalive(writer.get_extra_info('socket'))
+    framer = tcpFramer()
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(TCP_FRAME.RECV_SIZE), TCP_FRAME.IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                data = b''  # idle : a request not complete is answered with an error
+            packets = framer.feed(data) if data else framer.flush()
+            for packet in packets:
+                response = await loop.run_in_executor(db_executor, processTcpRequest, packet)
+                frame = framer.encode(response)
+                if frame:
+                    writer.write(frame)
+                    await writer.drain()
+            if not data or (packets and not framer.persistent):
+                break
+    except ValueError as e:
+        # not JSON, UnicodeDecodeError, request larger than TCP_FRAME.MAX_SIZE : error reply and close
+        syslog.syslog(f'Frame error {__file__} func : serveTcpClient, msg : {e}')
+        try:
+            writer.write(framer.error(str(e)))
+            await writer.drain()
+        except ConnectionError:
+            pass
+    except ConnectionError as e:
+        syslog.syslog(f'Socket error {__file__} func : serveTcpClient, msg : {e}')
+    finally:
+        writer.close()
+
+async def serveServer(stop: asyncio.Event):
+    '''server mode on the event loop until stop (see runServer)'''
+    loop = asyncio.get_running_loop()
+    if Ether.local_ip_addr == "":
+        return
+    db_writer.start()
+    # cached host ip, not waiting for the UDP discovery
+    server = await asyncio.start_server(serveTcpClient, Ether.local_ip_addr, ETHER.TCP_PORT, reuse_address=True)
+    reportServing(Ether.local_ip_addr, ETHER.TCP_PORT)
+    discovery = None
+    try:
+        # answered until the mode is stopped, a changed host ip is stored in the executor
+        discovery, _ = await loop.create_datagram_endpoint(
+            lambda: etherDiscovery(Ether, on_host=lambda ip: db_executor.submit(storeHostIp, ip)),
+            local_addr=(Ether.get_broadcast_ip_addr(), ETHER.UDP_PORT))
+    except OSError as e:
+        syslog.syslog(f'Socket error {__file__}, msg : {e}')
+    dispatcher = etherDispatcher(Ether)
+    dispatcher.attach(loop)
+    ring = os.environ.get('HUB_RX_RING', '0') == '1'
+    for etherType in (ETHER.ETH_REQ_HUBINFO, ETHER.ETH_ACK):
+        dispatcher.register(Ether.port_out, etherType, onRawFrameAsync, ring=ring and etherType == ETHER.ETH_REQ_HUBINFO)
+    syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.SERVER}, asyncio')
+    try:
+        stored = False
+        while not await waitEvent(ETHER.MODE_POLL, stop):
+            sendNeighborHello()
+            if not stored and tcpData.h_server_id != 0:
+                # updating DB's command table
+                cmdRow = tcpData.getcmdTableRow()
+                await loop.run_in_executor(db_executor, db_cmdTable.sql_replace_cmd_row, *cmdRow)
+                print(cmdRow)
+                stored = True
+    finally:
+        syslog.syslog(f'Dispatcher stopped {__file__}, {dispatcher.getDict()}, relay {relay_cache.getDict()}')
+        dispatcher.close()
+        server.close()
+        await server.wait_closed()
+        if discovery is not None:
+            discovery.close()
+        await loop.run_in_executor(db_executor, db_writer.stop)
+
+async def serveClient(stop: asyncio.Event):
+    '''client mode on the event loop until stop (see runClient, setClientDataPort)'''
+    loop = asyncio.get_running_loop()
+    dispatcher = etherDispatcher(Ether)
+    dispatcher.attach(loop)
+    for iface in (ETHER.PORT_WAN, ETHER.PORT_LAN):
+        for etherType in (ETHER.ETH_REQ_ID, ETHER.ETH_REQ_HUBINFO, ETHER.ETH_SET_POWER_SAVE, ETHER.ETH_ACK):
+            dispatcher.register(iface, etherType, onRawFrameAsync)
+    # change event of task_monitoring / downstream frames (aggregator) read by the loop
+    wake = asyncio.Event()
+    notifier = stateNotifier.open(listener=True)
+    hub_aggregator.notify_address = SHARED_PARAMETER.NOTIFY
+    if notifier is not None:
+        def notified():
+            notifier.drain()
+            wake.set()
+        loop.add_reader(notifier.fileno(), notified)
+    db = SqlLib(filename=db_file_path, table=SQL_PARAMETER.DATA_TABLE)
+    syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.CLIENT}, asyncio')
+    send = True
+    try:
+        while not stop.is_set():
+            hubData = None
+            if send:
+                # shared state in the loop, DB (not published yet) in the executor
+                hubData = getLocalHubData()
+                if hubData is None:
+                    hubData = await loop.run_in_executor(db_executor, getLocalHubData, db)
+            if hubData is not None and Ether.port_in != "undefinded":
+                result = sendHubData(hubData)
+                if result != 0:
+                    syslog.syslog(f'send error {__file__} {__name__} func : serveClient -> error_code: {result}')
+            sendNeighborHello()
+            if notifier is not None and (shared_state is not None or hub_aggregator.enabled):
+                # no change event without shared state : DB polling period
+                await waitEvent(ETHER.RAW_HEARTBEAT if shared_state is not None else ETHER.RAW_SEND_DELAY, wake, stop)
+            else:
+                await waitEvent(ETHER.RAW_SEND_DELAY, stop)
+            notified = wake.is_set()
+            wake.clear()
+            if notified and hub_aggregator.enabled:
+                # collect the other frames of the same downstream cycle
+                await asyncio.sleep(ETHER.RAW_AGGREGATE_HOLD)
+                wake.clear()
+            # heartbeat is sent by the last hub of the chain only, the others send on arrival
+            send = notified or not (hub_aggregator.enabled and hub_aggregator.live())
+    except Exception as e:
+        print(f'File : {__file__} func : serveClient, Msg : {e}')
+        syslog.syslog(f'File : {__file__} func : serveClient, Msg : {e}')
+    finally:
+        syslog.syslog(f'Dispatcher stopped {__file__}, {dispatcher.getDict()}, relay {relay_cache.getDict()}, '
+                      f'neighbors {Ether.get_neighbors()}')
+        dispatcher.close()
+        if notifier is not None:
+            loop.remove_reader(notifier.fileno())
+            notifier.close()
+
+async def amain():
+    '''
+    network task on one event loop (HUB_ASYNCIO=1) : TCP / UDP servers, raw frame readers (add_reader),
+    hub data sender and netlink events. SQLite work in db_executor, the mode is switched like main()
+    '''
+    loop = asyncio.get_running_loop()
+    mode_changed = asyncio.Event()
+    link = etherLink.open()
+    if link is not None:
+        link.subscribe(lambda iface, changed, state:
+                       mode_changed.set() if iface in (ETHER.PORT_WAN, ETHER.PORT_LAN) and 'ip' in changed else None)
+        Ether.set_link(link, start=False)
+        loop.add_reader(link.fileno(), link.drain)
+
+    mode = MODE.NONE
+    while True:
+        previous, mode = mode, Ether.get_operate_mode()
+        await loop.run_in_executor(db_executor, resetModeAttribute, previous, mode)
+        stop = asyncio.Event()
+        task = asyncio.ensure_future(serveServer(stop) if mode == MODE.SERVER else serveClient(stop))
+        # the mode is kept until the address of eth0 / lan0 is changed (cable moved, DHCP)
+        while True:
+            changed = asyncio.ensure_future(mode_changed.wait())
+            await asyncio.wait({task, changed}, return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if task.done():
+                break
+            await asyncio.sleep(ETHER.LINK_SETTLE)
+            mode_changed.clear()
+            if Ether.detect_operate_mode() != mode:
+                break
+        if task.done():
+            task.result()   # stopped by an error
+            break
+        syslog.syslog(f'Mode switch {__file__} {mode} -> {Ether.detect_operate_mode()}, link {link.getDict()}')
+        stop.set()
+        await task
 
 ## ---------------- 메인루틴 ---------------- ##
 def main():
     try:
+        # working database on tmpfs (HUB_DB_RAM=1) : restore the SD card checkpoint first
+        if SqlRamDisk.enabled():
+            db_ramdisk.restore()
+        # database schema upgrade before reading any table
+        SqlSchema.migrate(db_file_path)
         # tcpData value initialize from DB
         init_attribute()
+        # diagnostics to syslog on SIGUSR1
+        signal.signal(signal.SIGUSR1, logDiagnostics)
+        # retransmit timer of ETH_REQ_ID (HUB_RELIABLE=1)
+        if reliable_send:
+            frame_reliable.start()
 
-        if Ether.get_operate_mode() == MODE.SERVER:
-        # if 0:
-            try:
-                if Ether.host_ip_addr == "localhost":
-                    HOST = Ether.get_broadcast_ip_addr()
-                    PORT = ETHER.UDP_PORT
-                    Ether.get_host_ip_addr(HOST, PORT)
-            except socket.error as e:
-                syslog.syslog(f'Socket error {__file__}, msg : {e}')
+        if os.environ.get('HUB_ASYNCIO', '0') == '1':
+            # one event loop for TCP / UDP / raw frames / sender, SQLite in the executor
+            asyncio.run(amain())
+            return
+        # interface state from netlink (netifaces if not available), a changed address switches the mode
+        mode_changed = threading.Event()
+        link = etherLink.open()
+        if link is not None:
+            link.subscribe(lambda iface, changed, state:
+                           mode_changed.set() if iface in (ETHER.PORT_WAN, ETHER.PORT_LAN) and 'ip' in changed else None)
+        Ether.set_link(link)
+
+        mode = MODE.NONE
+        while True:
+            previous, mode = mode, Ether.get_operate_mode()
+            resetModeAttribute(previous, mode)
+            if mode == MODE.SERVER:
+                target = runServer
+            elif mode == MODE.CLIENT:
+                target = runClient
             else:
-                if Ether.local_ip_addr != "":
-                    HOST = Ether.local_ip_addr
-                    PORT = ETHER.TCP_PORT
-                    with ThreadedHubTCPServer((HOST, PORT), HubTCPHandler) as server:
-                        # 운영서버 통신라인
-                        server_thread = threading.Thread(target=server.serve_forever)
-                        server_thread.daemon = True                                                         
-                        server_thread.start()
-
-                        client_thread = threading.Thread(target=getClientDataPort,
-                                                         args=(Ether.port_out, ETHER.RAW_TIMEOUT),
-                                                         daemon=True)
-                        client_thread.start()
-                        syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.NONE}, '
-                                    f'Processing thread: {server_thread.name}, {client_thread.name}')
-                        while True:
-                            if tcpData.h_server_id != 0:
-                                break
-                        # updating DB's command table in main loop
-                        df = pd.DataFrame(data=tcpData.getcmdTableDict())
-                        df.to_sql(SQL_PARAMETER.CMD_TABLE, db_cmdTable._dbcon, if_exists='replace', index=False)
-                        db_cmdTable.sql_commit()
-                        print(df)
-
-                        while True:
-                            if server_thread.is_alive() == False:
-                                break
-                        
-        elif Ether.get_operate_mode() == MODE.CLIENT:
-        # elif 1:
-            # thread<1> : socket to send the packet hub data
-            socket_thread_send = threading.Thread(target=setClientDataPort, daemon=True)
-            socket_thread_send.start()
-            # thread<2> : socket to receive the port (eth0)
-            socket_thread_rcv_eth0 = threading.Thread(target=getClientDataPort,
-                                                      args=(ETHER.PORT_WAN, ETHER.RAW_TIMEOUT),
-                                                      daemon=True)
-            socket_thread_rcv_eth0.start()
-            # thread<3> : socket to receive the port (lan0)
-            socket_thread_rcv_lan0 = threading.Thread(target=getClientDataPort,
-                                                      args=(ETHER.PORT_LAN, ETHER.RAW_TIMEOUT),
-                                                      daemon=True)
-            socket_thread_rcv_lan0.start()
-            syslog.syslog(f'Main() working.. {__file__} Mode: {MODE.NONE}, '
-                            f'Processing thread: {socket_thread_send.name}, {socket_thread_rcv_eth0.name}, {socket_thread_rcv_lan0.name}')
-            while True:
-                if socket_thread_send.is_alive() == False or socket_thread_rcv_eth0.is_alive() == False or socket_thread_rcv_lan0.is_alive() == False:
+                syslog.syslog(f'Mode not definded error {__file__} {MODE.NONE}, will be pass in while loop')
+                break
+            stop = threading.Event()
+            mode_thread = threading.Thread(target=target, args=(stop,), daemon=True)
+            mode_thread.start()
+            # the mode is kept until the address of eth0 / lan0 is changed (cable moved, DHCP)
+            while mode_thread.is_alive():
+                if not mode_changed.wait(ETHER.RAW_TIMEOUT):
+                    continue
+                time.sleep(ETHER.LINK_SETTLE)
+                mode_changed.clear()
+                if Ether.detect_operate_mode() != mode:
                     break
-        else:
-            syslog.syslog(f'Mode not definded error {__file__} {MODE.NONE}, will be pass in while loop')
-            pass
+            if not mode_thread.is_alive():
+                break   # stopped by an error
+            syslog.syslog(f'Mode switch {__file__} {mode} -> {Ether.detect_operate_mode()}, link {link.getDict()}')
+            stop.set()
+            mode_thread.join()
     except KeyboardInterrupt as e:
         syslog.syslog(f'KeyInterrupt : {e}')
     except Exception as e:
         print(f'File : {__file__}, Msg : {e}')
         syslog.syslog(f'File : {__file__}, Msg : {e}')
+        db_writer.stop()
+        frame_reliable.stop()
         if db_data._dbcon:
             db_data.close()
             syslog.syslog(f'Event : Sql event code [{SQL_EVENT.CONNECT}], Table name [{SQL_PARAMETER.DATA_TABLE}]')